@@ -1,156 +1,176 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+import time
 import altair as alt
 
+from rollups import build_rollup, count_by, date_range, filter_rollup, sum_by, totals
+from search import search_mask
+from taxonomy import macro_tipologia_attivita, tipi_malattia
+from validation import check_activities
+from importer import import_activities
+from cache import CACHE_TTL, UTENTI_TTL, ActivityCache, ActivitySnapshot, UserDirectory
+from exports import ESPORTAZIONI_MAX, FORMATI, ExportCache
+from metrics import METRICHE
+from storage import (
+    COLONNA_PARTIZIONE, COLONNA_VERSIONE, QUOTA_LETTURE, QUOTA_SCRITTURE, GoogleSheetsStore,
+    LocalSnapshot, PartitionedSheetsStore, SheetsConnection, SheetsQuota, SQLiteStore, memory_report, merge_rows,
+    parse_dates, upsert_rows,
+)
+
 # =====================================
 # Config Google Sheets
 # =====================================
 SHEET_NAME = "GestionaleLavoro"   # <-- nome del tuo Google Sheet
 
-def connect_gsheet(sheet_name, worksheet=0):
-    scope = [
-        "https://spreadsheets.google.com/feeds",
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive.file",
-        "https://www.googleapis.com/auth/drive",
-    ]
+def config(nome, default=None):
+    """Legge un'impostazione dai secrets di Streamlit, se presenti."""
+    try:
+        return st.secrets.get(nome, default)
+    except FileNotFoundError:
+        return default
+
+@st.cache_resource
+def sheets_connection():
     # 🔑 Legge le credenziali dai secrets di Streamlit
-    creds_dict = st.secrets["google"]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-    client = gspread.authorize(creds)
-    return client.open(sheet_name).get_worksheet(worksheet)
-    
-def load_utenti(sheet_name="GestionaleLavoro", worksheet_name="Utenti"):
-    client = gspread.authorize(ServiceAccountCredentials.from_json_keyfile_dict(
-        st.secrets["google"], 
-        ["https://spreadsheets.google.com/feeds","https://www.googleapis.com/auth/spreadsheets",
-         "https://www.googleapis.com/auth/drive.file","https://www.googleapis.com/auth/drive"]
-    ))
-    ws = client.open(sheet_name).worksheet(worksheet_name)
-    data = ws.get_all_records()
-    df = pd.DataFrame(data)
-    if df.empty:
-        df = pd.DataFrame(columns=["NomeUtente","Password","Ruolo"])
-    return ws, df
-
-def save_utenti(ws, df):
-    ws.clear()
-    ws.update([df.columns.tolist()] + df.astype(str).values.tolist())
-
-def load_data(sheet):
-    """Carica i dati da Google Sheets e mantiene il formato anno-giorno-mese."""
-    data = sheet.get_all_records()
-    df = pd.DataFrame(data)
-
-    if df.empty:
-        return pd.DataFrame(columns=[
-            "ID","NomeUtente","Data","MacroAttivita","Tipologia","Attivita",
-            "Note","Ore","Minuti","NumCampioni","TipoMalattia","NumReferti","TipoMalattiaRef"
-        ])
-
-    # ✅ Converte solo se serve, mantenendo il formato %Y-%d-%m
-    if "Data" in df.columns:
-        df["Data"] = pd.to_datetime(
-            df["Data"], format="%Y-%d-%m %H:%M", errors="coerce"
-        )
+    # 🔹 Quote di lettura e scrittura al minuto: "quota_letture" e "quota_scritture" nei secrets
+    quota = SheetsQuota(
+        letture=config("quota_letture", QUOTA_LETTURE), scritture=config("quota_scritture", QUOTA_SCRITTURE)
+    )
+    return SheetsConnection(dict(st.secrets["google"]), quota)
 
-    # Conversione numerica sicura
-    for col in ["Ore","Minuti","NumCampioni","NumReferti"]:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0).astype(int)
+@st.cache_resource
+def activity_store():
+    """Backend di persistenza scelto nei secrets: backend = "sheets" (default) o "sqlite".
 
-    return df
+    Con partizioni = "anno" o "mese" le attività su Sheets sono divise in un foglio per periodo.
+    """
+    if config("backend", "sheets") == "sqlite":
+        return SQLiteStore(config("sqlite_path", "gestionale.db"))
+    if config("partizioni"):
+        return PartitionedSheetsStore(sheets_connection(), SHEET_NAME, config("partizioni"))
+    return GoogleSheetsStore(sheets_connection(), SHEET_NAME)
 
 
-def save_data(sheet, df):
-    """Salva i dati mantenendo intatte le date esistenti nello sheet, senza sovrascriverle."""
-    try:
-        existing_data = pd.DataFrame(sheet.get_all_records())
+# =====================================
+# Cache attività condivisa fra le sessioni
+# =====================================
+SNAPSHOT_LOCALE = "snapshot_locale"   # cartella dello snapshot su disco
+
+@st.cache_resource
+def local_snapshot():
+    """Snapshot su disco per l'avvio rapido; "snapshot_locale" nei secrets ("" lo disattiva)."""
+    cartella = config("snapshot_locale", SNAPSHOT_LOCALE)
+    return LocalSnapshot(cartella) if cartella else None
+
+@st.cache_resource
+def activity_cache():
+    return ActivityCache(ttl=config("cache_ttl", CACHE_TTL), locale=local_snapshot())
+
+def use_snapshot(snapshot):
+    """Snapshot della sessione; df_att ne è una vista in sola lettura."""
+    st.session_state.snapshot = snapshot
+    st.session_state.df_att = snapshot.view()
+
+
+@st.cache_resource
+def export_cache():
+    return ExportCache(max_file=config("esportazioni_max", ESPORTAZIONI_MAX))
+
+def export_button(dati, filtro, nome_file, key):
+    """Scelta del formato e pulsante di download. Il file viene generato solo al clic e
+    riusato finché versione dei dati e filtro non cambiano; dati restituisce il DataFrame.
+    Al download Streamlit tiene in memoria il file intero, anche se generato a blocchi."""
+    formato = st.selectbox("Formato", list(FORMATI), key=f"{key}_formato")
+    estensione, mime = FORMATI[formato]
+    snapshot = st.session_state.snapshot
+    # Gli snapshot di ripiego (versione 0) non sono condivisi: si distinguono per identità
+    chiave = (snapshot.versione or id(snapshot), filtro)
+    st.download_button(
+        f"⬇️ Scarica risultato ({formato})",
+        lambda: export_cache().get(chiave, formato, dati),
+        f"{nome_file}.{estensione}",
+        mime,
+        key=key,
+    )
 
-        if existing_data.empty:
-            updated = df.copy()
-        else:
-            # 🔹 Partiamo dai dati esistenti
-            updated = existing_data.copy()
-
-            # 🔹 Aggiorna solo le righe modificate o nuove
-            for _, row in df.iterrows():
-                mask = updated["ID"] == row["ID"]
-                if mask.any():
-                    for col in df.columns:
-                        # 👇 Se la colonna è "Data" e nel DF è vuota o NaT, NON toccarla
-                        if col == "Data":
-                            if pd.isna(row["Data"]) or str(row["Data"]).strip() == "":
-                                continue
-                            else:
-                                updated.loc[mask, col] = row[col]
-                        else:
-                            updated.loc[mask, col] = row[col]
-                else:
-                    # Aggiunge solo le nuove righe (es. nuove attività)
-                    updated = pd.concat([updated, pd.DataFrame([row])], ignore_index=True)
+# =====================================
+# Anagrafica utenti condivisa fra le sessioni
+# =====================================
+@st.cache_resource
+def user_directory():
+    return UserDirectory(activity_store(), ttl=config("utenti_ttl", UTENTI_TTL), locale=local_snapshot())
 
-            # 🔹 Rimuove righe eliminate (ID non più presenti)
-            updated = updated[updated["ID"].isin(df["ID"])]
 
-        # ✅ Mantiene SEMPRE il formato anno-giorno-mese se la data è valida
-        if "Data" in updated.columns:
-            def fix_date_safe(x):
-                if pd.isna(x) or str(x).strip() == "":
-                    return ""
-                try:
-                    parsed = pd.to_datetime(str(x), errors="coerce", dayfirst=False)
-                    if pd.notna(parsed):
-                        return parsed.strftime("%Y-%d-%m %H:%M")
-                    return str(x).strip()
-                except Exception:
-                    return str(x).strip()
+@METRICHE.timed("app.save_data")
+def save_data(store, df, base=None):
+    """Salva solo le celle modificate rispetto all'ultimo stato noto dello Sheet (base).
+
+    Se base non è indicato si usa st.session_state.df_att; le date esistenti non vengono
+    sovrascritte con valori vuoti.
+    """
+    try:
+        existing_data = st.session_state.df_att if base is None else base
+
+        # 🔹 Aggiorna per ID le righe modificate, aggiunge le nuove e toglie quelle eliminate
+        updated = merge_rows(existing_data, df)
 
-            updated["Data"] = updated["Data"].apply(fix_date_safe)
+        # ✅ Date decodificate in blocco (ISO o formato storico); la codifica avviene in scrittura
+        if "Data" in updated.columns:
+            updated["Data"] = parse_dates(updated["Data"])
 
         # 🔹 Conversione sicura per i numeri
         for col in ["Ore", "Minuti", "NumCampioni", "NumReferti"]:
             if col in updated.columns:
                 updated[col] = pd.to_numeric(updated[col], errors="coerce").fillna(0).astype(int)
 
-        # 🔹 Scrive tutto sullo Sheet
-        sheet.clear()
-        sheet.update([updated.columns.tolist()] + updated.astype(str).values.tolist())
+        # 🔹 Scrive sullo Sheet solo le differenze
+        risultato = store.write_delta(existing_data, updated)
 
-        st.session_state.df_att = load_data(sheet)
+        # 🔹 Aggiorna la cache condivisa con le sole righe scritte (versione o partizione cambiata)
+        chiave = ["ID", COLONNA_VERSIONE] + [c for c in [COLONNA_PARTIZIONE] if c in risultato.columns]
+        scritte = ~pd.MultiIndex.from_frame(risultato[chiave].astype(object)).isin(
+            pd.MultiIndex.from_frame(existing_data.reindex(columns=chiave).astype(object).fillna(0))
+        )
+        eliminati = existing_data["ID"][~existing_data["ID"].isin(risultato["ID"])]
+        use_snapshot(activity_cache().patch(risultato[scritte], eliminati) or ActivitySnapshot(risultato, 0))
 
         st.success("✅ Dati salvati senza alterare le date già presenti nello Sheet.")
 
     except Exception as e:
+        # Lo stato dello Sheet non è più noto con certezza: si riparte da una rilettura
+        activity_cache().invalidate()
         st.error(f"❌ Errore nel salvataggio su Google Sheets: {e}")
 
 
 
-def append_data(sheet, new_row_df):
+@METRICHE.timed("app.append_data")
+def append_data(store, new_row_df):
+    """Aggiunge in coda allo Sheet solo le nuove righe, senza riscrivere il foglio."""
     try:
-        # 🔹 Ricarica sempre lo stato aggiornato del foglio
-        current_df = load_data(sheet)
+        current_df = st.session_state.df_att
 
         # 🔒 Evita conflitti di ID duplicati
-        new_row_df = new_row_df[~new_row_df["ID"].isin(current_df["ID"])]
+        new_row_df = new_row_df[~new_row_df["ID"].isin(current_df["ID"])].copy()
         if new_row_df.empty:
             st.warning("⚠️ L'attività non è stata aggiunta perché esiste già un ID uguale.")
             return
 
         # Se manca la data, la imposta a ora
-        if "Data" in new_row_df.columns and pd.isna(new_row_df.loc[0, "Data"]):
-            new_row_df.loc[0, "Data"] = datetime.now()
-
-        # 🔹 Aggiunge la nuova riga in locale
-        current_df = pd.concat([current_df, new_row_df], ignore_index=True)
-
-        # 🔹 Salva tutto sullo Sheet
-        save_data(sheet, current_df)
+        if "Data" in new_row_df.columns:
+            new_row_df["Data"] = parse_dates(new_row_df["Data"]).fillna(pd.Timestamp(datetime.now()))
+
+        # 🔹 Invia solo le righe nuove e le aggiunge anche in memoria, come se fossero rilette
+        new_row_df = store.append_data(current_df, new_row_df)
+        use_snapshot(
+            activity_cache().patch(new_row_df)
+            or ActivitySnapshot(pd.concat([current_df, new_row_df], ignore_index=True), 0)
+        )
 
-        st.success("✅ Nuova attività aggiunta correttamente e dati aggiornati.")
+        if len(new_row_df) == 1:
+            st.success("✅ Nuova attività aggiunta correttamente e dati aggiornati.")
+        else:
+            st.success(f"✅ {len(new_row_df)} nuove attività aggiunte correttamente e dati aggiornati.")
     except Exception as e:
         st.error(f"❌ Errore durante l'inserimento: {e}")
 
@@ -165,6 +185,27 @@ st.set_page_config(
     layout="wide"
 )
 
+# 🔹 Misura dell'esecuzione: durata e chiamate a storage e API fatte da questo rerun
+METRICHE.begin_scope()
+inizio_pagina = time.perf_counter()
+PROMETHEUS_INTERVALLO = 15   # secondi fra due scritture del file "prometheus_file" dei secrets
+
+@st.cache_resource
+def prometheus_state():
+    return {"scritto": 0.0}
+
+def end_page(pagina):
+    """Registra durata e chiamate dell'esecuzione; se configurato, aggiorna il file Prometheus."""
+    METRICHE.end_scope(pagina, time.perf_counter() - inizio_pagina)
+    percorso = config("prometheus_file")
+    stato = prometheus_state()
+    if percorso and time.monotonic() - stato["scritto"] > PROMETHEUS_INTERVALLO:
+        stato["scritto"] = time.monotonic()
+        try:
+            METRICHE.write_prometheus(percorso)
+        except OSError:
+            pass   # le metriche non devono mai bloccare l'app
+
 # CSS custom per modernizzare lo stile
 st.markdown("""
     <style>
@@ -187,118 +228,13 @@ st.markdown("""
 # Dati utenti (login demo)
 # =====================================
 
-# Carico gli utenti dal foglio "Utenti"
-if "df_utenti" not in st.session_state:
-    try:
-        st.session_state.ws_utenti, st.session_state.df_utenti = load_utenti()
-    except Exception as e:
-        st.error(f"Errore caricamento utenti da Google Sheets: {e}")
-        st.stop()
+# Utenti dal foglio "Utenti", letti una volta per processo e condivisi fra le sessioni
+try:
+    user_directory().users()
+except Exception as e:
+    st.error(f"Errore caricamento utenti da Google Sheets: {e}")
+    st.stop()
    
-# =====================================
-# Dizionario Macro/Tipologia/Attività
-# =====================================
-macro_tipologia_attivita = {
-    "AGENDA": {
-        "Gestione agenda appuntamenti e telefono": [
-            "Informazioni analisi",
-            "Telefonate in entrata",
-            "Telefonate in uscita",
-            "Comunicazione con pazienti (mail o telefono)",
-            "Organizzazione appuntamenti con medici",
-            "Supporto amministrativo (se pertinente)",
-            "Prenotazioni"
-        ],
-        "Controllo e-mail e risposta": [
-            "Prenotazioni",
-            "Informazioni analisi",
-            "Richieste varie"
-        ]
-    },
-    "CONSULENZA GENETICA": {
-        "Ambulatorio": [
-            "Consulenza",
-            "Controllo Impegnative",
-            "Relazioni consulenza"
-        ],
-        "Teleconsulenza": [
-            "Consulenza Telefonica",
-            "Relazione Post-test"
-        ]
-    },
-    "ACCETTAZIONE": {
-        "Accettazione campioni e impegnative": [
-            "Accettazione campioni interni",
-            "Accettazione campioni esterni",
-            "Registrazione impegnative access",
-            "Conteggio impegnative (mensile)"
-        ]
-    },
-    "ORDINI E MAGAZZINO": {
-        "Gestione Ordini Reagenti e varie": [
-            "Richiesta preventivo",
-            "Ordine SAP",
-            "Verifica arrivi DDT",
-            "Controllo Giacenza"
-        ]
-    },
-    "LABORATORIO": {
-        "Lavoro al bancone": [
-            "Estrazione DNA",
-            "Preparazione reagenti",
-            "Analisi molecolare",
-            "Digestioni",
-            "Blot",
-            "Ibridazioni",
-            "Genotipizzazione OA"
-        ],
-        "Manutenzione strumenti": [
-            "Pulizia ABI e/o cambio capillari",
-            "Pulizia NextSeq",
-            "Pulizia MiSeq",
-            "Backup Dati"
-        ]
-    },
-    "INFORMATICA": {
-        "Backup Dati NGS": ["Scarico Dati NGS"],
-        "Programmazione": ["Programmazione"],
-        "Interpretazione dati grezzi": [
-            "Analisi dati NGS",
-            "Match OA",
-            "Interpretazione analisi Sanger",
-            "Interpretazione analisi MLPA",
-            "Interpretazione analisi Microsatelliti",
-            "Interpretazione analisi Metilazione",
-            "Lettura e interpretazione Lastre"
-        ]
-    },
-    "REFERTAZIONE": {
-        "Compilazione referti": [
-            "Calcolo coverage e OMIM",
-            "Stesura bozza referto",
-            "Trascrizione referti"
-        ],
-        "Rilettura e validazione referti": [
-            "NGS",
-            "Analisi di sequenza (Trombofilia, Segregazioni mut)",
-            "MLPA",
-            "Analisi di frammenti (FC, Trombofilia, ecc.)",
-            "FSHD"
-        ]
-    },
-    "ATTIVITA' DIDATTICA": {
-        "Lezioni": ["Lezioni"],
-        "Esami": ["Esami"],
-        "Correzione tesi": ["Correzione tesi"],
-        "Slide": ["Slide"]
-    },
-    "RICERCA": {
-        "Articolo scientifico": ["Scrittura", "Revisione", "Sottomissione"],
-        "Riunioni e attività amministrative": ["Riunioni e attività amministrative"],
-        "Studio e analisi": ["Studio articoli","Analisi dei dati"]
-    }
-}
-
 # =====================================
 # Stato sessione & Login utils
 # =====================================
@@ -308,24 +244,64 @@ if "logged_in" not in st.session_state:
     st.session_state.ruolo = ""
 
 def login(username, password):
-    dfu = st.session_state.df_utenti
-    user = dfu[(dfu["NomeUtente"] == username) & (dfu["Password"] == password)]
-    if not user.empty:
-        return user.iloc[0]["Ruolo"]
+    utente = user_directory().lookup(username)
+    # 🔒 Gli utenti disattivati dal capo non possono entrare
+    if utente is not None and utente.get("Attivo") != "0" and utente.get("Password") == password:
+        return utente.get("Ruolo")
     return None
 
+def account_changes(prima, dopo):
+    """Modifiche {NomeUtente: campi} fra la tabella utenti e quella modificata dal capo, più gli errori.
+
+    Righe esistenti: ruolo, stato Attivo e, se indicata, nuova password. Righe aggiunte:
+    utenti nuovi, con nome e password obbligatori.
+    """
+    modifiche, errori = {}, []
+    dopo = dopo.astype(object).where(dopo.notna(), None)
+    for indice, riga in dopo.iterrows():
+        nome = str(riga["NomeUtente"] or "").strip()
+        password = str(riga["Password"] or "")
+        campi = {}
+        if indice in prima.index:
+            vecchia = prima.loc[indice]
+            if nome != vecchia["NomeUtente"]:
+                errori.append(f"{vecchia['NomeUtente']}: il nome utente non si può cambiare.")
+                continue
+            if riga["Ruolo"] != vecchia["Ruolo"]:
+                campi["Ruolo"] = riga["Ruolo"]
+            if bool(riga["Attivo"]) != bool(vecchia["Attivo"]):
+                campi["Attivo"] = "1" if riga["Attivo"] else "0"
+        elif not nome:
+            continue
+        elif nome in set(prima["NomeUtente"]) or nome in modifiche:
+            errori.append(f"{nome}: esiste già.")
+            continue
+        elif not password:
+            errori.append(f"{nome}: per un utente nuovo serve la password.")
+            continue
+        else:
+            campi = {"Ruolo": riga["Ruolo"] or "utente", "Attivo": "1" if riga["Attivo"] else "0"}
+        if password:
+            if len(password) < 6:
+                errori.append(f"{nome}: la password deve avere almeno 6 caratteri.")
+                continue
+            campi["Password"] = password
+        if campi:
+            modifiche[nome] = campi
+    return modifiche, errori
+
 # =====================================
 # Connessione e Cache iniziale (una sola volta)
 # =====================================
-if "sheet" not in st.session_state:
-    try:
-        st.session_state.sheet = connect_gsheet(SHEET_NAME)
-    except Exception as e:
-        st.error(f"Impossibile connettersi a Google Sheets: {e}")
-        st.stop()
+# Backend e connessione sono condivisi da tutte le sessioni del processo
+try:
+    st.session_state.store = activity_store()
+except Exception as e:
+    st.error(f"Impossibile connettersi a Google Sheets: {e}")
+    st.stop()
 
-if "df_att" not in st.session_state:
-    st.session_state.df_att = load_data(st.session_state.sheet)
+# Snapshot condiviso: lo Sheet viene riletto solo alla scadenza del TTL
+use_snapshot(activity_cache().get(st.session_state.store))
 
 # =====================================
 # UI - Titolo e Login
@@ -388,6 +364,7 @@ if not st.session_state.logged_in:
         # 👉 Chiusura div
         st.markdown("</div>", unsafe_allow_html=True)
 
+    end_page("login")
     st.stop()
 
 
@@ -495,7 +472,7 @@ if st.session_state.ruolo == "utente":
     # Menu utente
     scelta_pagina = st.sidebar.radio(
         "📌 Menu utente",
-        ["🏠 Home","➕ Inserisci attività", "✏️ Modifica attività", "📑 Elenco attività", "📊 Riepilogo e Grafici","⚙️ Profilo"],
+        ["🏠 Home","➕ Inserisci attività", "🗂️ Inserimento multiplo", "✏️ Modifica attività", "📑 Elenco attività", "📊 Riepilogo e Grafici","⚙️ Profilo"],
         index=0
     )
     
@@ -506,11 +483,10 @@ if st.session_state.ruolo == "utente":
 
         # KPI cards di esempio (totali generali)
         st.markdown("### 📈 Panoramica rapida")
-        df_user = st.session_state.df_att[st.session_state.df_att["NomeUtente"] == st.session_state.username]
-        if not df_user.empty:
-            tot_ore = df_user["Ore"].fillna(0).sum() + df_user["Minuti"].fillna(0).sum()/60
-            tot_campioni = df_user["NumCampioni"].fillna(0).sum()
-            tot_referti = df_user["NumReferti"].fillna(0).sum()
+        df_user = st.session_state.snapshot.of_user(st.session_state.username)
+        kpi_user = filter_rollup(st.session_state.snapshot.kpi, utente=st.session_state.username)
+        if not kpi_user.empty:
+            tot_ore, tot_campioni, tot_referti = totals(kpi_user)
 
             c1, c2, c3 = st.columns(3)
             with c1:
@@ -577,13 +553,13 @@ if st.session_state.ruolo == "utente":
         if macro_tmp == "ACCETTAZIONE":
             with st.expander("Dettagli campioni"):
                 num_campioni = st.number_input("Numero di campioni", min_value=0, step=1, key="num_campioni")
-                tipo_malattia = st.selectbox("Tipo di malattia", ["-- Seleziona --", "FSHD", "Genetica oculare", "Cardio", "Neurodegenerative", "Autismo", "Oncogenetica", "Covid", "Rene Policistico", "Routine", "Infettivologia", "Altro"], key="tipo_malattia")
+                tipo_malattia = st.selectbox("Tipo di malattia", ["-- Seleziona --"] + tipi_malattia, key="tipo_malattia")
                 if tipo_malattia == "-- Seleziona --":
                     tipo_malattia = None
         elif macro_tmp == "REFERTAZIONE":
             with st.expander("Dettagli referti"):
                 num_referti = st.number_input("Numero di referti", min_value=0, step=1, key="num_referti")
-                tipo_malattia_ref = st.selectbox("Tipo di malattia", ["-- Seleziona --", "FSHD", "Genetica oculare", "Cardio", "Neurodegenerative", "Autismo", "Oncogenetica", "Covid", "Rene Policistico", "Routine", "Infettivologia", "Altro"], key="tipo_malattia_ref")
+                tipo_malattia_ref = st.selectbox("Tipo di malattia", ["-- Seleziona --"] + tipi_malattia, key="tipo_malattia_ref")
                 if tipo_malattia_ref == "-- Seleziona --":
                     tipo_malattia_ref = None
 
@@ -594,13 +570,8 @@ if st.session_state.ruolo == "utente":
                 if not (macro_tmp and tipologia_tmp and attivita_tmp):
                     st.error("Seleziona MacroAttività, Tipologia e Attività prima di salvare!")
                 else:
-                    # ✅ Ricarica sempre il foglio aggiornato per calcolare l'ID corretto
-                    df_attuale = load_data(st.session_state.sheet)
-
-                    if df_attuale.empty:
-                        new_id = 1
-                    else:
-                        new_id = int(pd.to_numeric(df_attuale["ID"], errors="coerce").fillna(0).max()) + 1
+                    # ✅ ID dal blocco riservato al processo, senza letture dello Sheet
+                    new_id = st.session_state.store.next_id()
 
                     new_row = pd.DataFrame([{
                         "ID": new_id,
@@ -619,11 +590,8 @@ if st.session_state.ruolo == "utente":
                     }])
 
                     try:
-                        # 🔹 Aggiunge direttamente sullo sheet e ricarica subito tutti i dati aggiornati
-                        append_data(st.session_state.sheet, new_row)
-
-                        # 🔄 Ricarica i dati aggiornati dallo sheet in memoria
-                        st.session_state.df_att = load_data(st.session_state.sheet)
+                        # 🔹 Aggiunge la riga in coda allo sheet e ai dati in memoria
+                        append_data(st.session_state.store, new_row)
 
                         st.success("✅ Attività salvata correttamente!")
                     except Exception as e:
@@ -641,19 +609,81 @@ if st.session_state.ruolo == "utente":
 
                     # Ricarica la pagina con i campi puliti
                     st.rerun()
+
+    # ---------- INSERIMENTO MULTIPLO ----------
+    elif scelta_pagina == "🗂️ Inserimento multiplo":
+        st.subheader("🗂️ Inserisci più attività insieme")
+        st.caption(
+            "Una riga per attività (senza data vale l'ora attuale). Le righe vengono controllate "
+            "e salvate tutte insieme, con un'unica scrittura sullo Sheet."
+        )
+
+        tipologie_tutte = sorted({t for tipologie in macro_tipologia_attivita.values() for t in tipologie})
+        attivita_tutte = sorted({
+            a for tipologie in macro_tipologia_attivita.values() for lista in tipologie.values() for a in lista
+        })
+        griglia = pd.DataFrame({
+            "Data": pd.Series(dtype="datetime64[ns]"),
+            "MacroAttivita": pd.Series(dtype=object),
+            "Tipologia": pd.Series(dtype=object),
+            "Attivita": pd.Series(dtype=object),
+            "Note": pd.Series(dtype=object),
+            "Ore": pd.Series(dtype="int64"),
+            "Minuti": pd.Series(dtype="int64"),
+            "NumCampioni": pd.Series(dtype="int64"),
+            "TipoMalattia": pd.Series(dtype=object),
+            "NumReferti": pd.Series(dtype="int64"),
+            "TipoMalattiaRef": pd.Series(dtype=object),
+        })
+        # La chiave cambia dopo ogni salvataggio, così la griglia riparte vuota
+        righe = st.data_editor(
+            griglia,
+            num_rows="dynamic",
+            hide_index=True,
+            key=f"griglia_{st.session_state.get('griglia_salvate', 0)}",
+            column_config={
+                "Data": st.column_config.DatetimeColumn("Data", format="YYYY-MM-DD HH:mm"),
+                "MacroAttivita": st.column_config.SelectboxColumn("MacroAttività", options=list(macro_tipologia_attivita)),
+                "Tipologia": st.column_config.SelectboxColumn("Tipologia", options=tipologie_tutte),
+                "Attivita": st.column_config.SelectboxColumn("Attività", options=attivita_tutte),
+                "Ore": st.column_config.NumberColumn("Ore", min_value=0, max_value=24, step=1, default=0),
+                "Minuti": st.column_config.NumberColumn("Minuti", min_value=0, max_value=59, step=1, default=0),
+                "NumCampioni": st.column_config.NumberColumn("Campioni", min_value=0, step=1, default=0),
+                "TipoMalattia": st.column_config.SelectboxColumn("Malattia (campioni)", options=tipi_malattia),
+                "NumReferti": st.column_config.NumberColumn("Referti", min_value=0, step=1, default=0),
+                "TipoMalattiaRef": st.column_config.SelectboxColumn("Malattia (referti)", options=tipi_malattia),
+            },
+        )
+
+        if st.button("💾 Salva tutte le attività"):
+            righe = righe.dropna(how="all").reset_index(drop=True)
+            if righe.empty:
+                st.warning("⚠️ Nessuna riga da salvare.")
+            else:
+                righe["Data"] = parse_dates(righe["Data"]).fillna(pd.Timestamp(datetime.now()))
+                errori = check_activities(righe, macro_tipologia_attivita)
+                if not errori.empty:
+                    for riga, messaggio in errori.items():
+                        st.error(f"❌ Riga {riga + 1}: {messaggio}")
+                else:
+                    # 🔹 ID riservati in blocco e un solo append per tutte le righe
+                    righe.insert(0, "ID", st.session_state.store.next_ids(len(righe)))
+                    righe.insert(1, "NomeUtente", st.session_state.username)
+                    append_data(st.session_state.store, righe)
+                    st.session_state.griglia_salvate = st.session_state.get("griglia_salvate", 0) + 1
     
 
     # ---------- MODIFICA ----------
     elif scelta_pagina == "✏️ Modifica attività":
         st.subheader("✏️ Modifica attività esistente")
-        df_mio = st.session_state.df_att[st.session_state.df_att["NomeUtente"] == st.session_state.username]
+        df_mio = st.session_state.snapshot.of_user(st.session_state.username)
         if df_mio.empty:
             st.info("Nessuna attività registrata.")
         else:
             scelta_id = st.selectbox("Seleziona attività", df_mio["ID"], key="scelta_id_mod")
             attivita_da_modificare = df_mio[df_mio["ID"] == scelta_id].iloc[0]
 
-            current_dt = pd.to_datetime(attivita_da_modificare["Data"], errors="coerce")
+            current_dt = attivita_da_modificare["Data"]
             default_date = (current_dt.date() if pd.notna(current_dt) else datetime.today().date())
             default_time = (current_dt.time() if pd.notna(current_dt) else datetime.now().replace(second=0, microsecond=0).time())
 
@@ -681,7 +711,7 @@ if st.session_state.ruolo == "utente":
 
             # --- Campi extra per ACCETTAZIONE / REFERTAZIONE ---
             num_campioni_mod, tipo_malattia_mod, num_referti_mod, tipo_malattia_ref_mod = None, None, None, None
-            mal_opts = ["-- Seleziona --", "FSHD", "Genetica oculare", "Cardio", "Neurodegenerative", "Autismo", "Oncogenetica", "Covid", "Rene Policistico", "Routine", "Infettivologia", "Altro"]
+            mal_opts = ["-- Seleziona --"] + tipi_malattia
 
             if macro_mod == "ACCETTAZIONE":
                 with st.expander("Dettagli campioni"):
@@ -723,23 +753,29 @@ if st.session_state.ruolo == "utente":
             with col_save:
                 if st.button("💾 Salva modifiche", key=f"btn_modifica_{scelta_id}"):
                     nuovo_dt = datetime.combine(data_mod, ora_mod)
-                    st.session_state.df_att.loc[
-                        st.session_state.df_att["ID"] == scelta_id,
+                    # 🔹 Si modifica solo la riga scelta (colonne generiche, le categorie non bastano
+                    # per i valori nuovi; Data resta datetime, così il salvataggio non la rilegge
+                    # come testo) e la si sostituisce per ID nel frame
+                    riga_mod = st.session_state.df_att[st.session_state.df_att["ID"] == scelta_id]
+                    riga_mod = riga_mod.astype({c: object for c in riga_mod.columns if c != "Data"})
+                    riga_mod.loc[
+                        :,
                         ["Data","MacroAttivita","Tipologia","Attivita","Note","Ore","Minuti",
                          "NumCampioni","TipoMalattia","NumReferti","TipoMalattiaRef"]
-                    ] = [nuovo_dt, macro_mod, tipologia_mod, attivita_mod, note_mod, ore_mod, minuti_mod,
+                    ] = [pd.Timestamp(nuovo_dt), macro_mod, tipologia_mod, attivita_mod, note_mod, ore_mod, minuti_mod,
                          num_campioni_mod, tipo_malattia_mod, num_referti_mod, tipo_malattia_ref_mod]
+                    df_mod = upsert_rows(st.session_state.df_att, riga_mod)
                     try:
-                        save_data(st.session_state.sheet, st.session_state.df_att)
+                        save_data(st.session_state.store, df_mod)
                     except Exception as e:
                         st.warning(f"Modifica salvata localmente ma non su Google Sheets: {e}")
                     st.success("✅ Attività modificata!")
 
             with col_del:
                 if st.button("🗑️ Elimina attività", key=f"btn_elimina_{scelta_id}"):
-                    st.session_state.df_att = st.session_state.df_att[st.session_state.df_att["ID"] != scelta_id]
+                    df_mod = st.session_state.df_att[st.session_state.df_att["ID"] != scelta_id]
                     try:
-                        save_data(st.session_state.sheet, st.session_state.df_att)
+                        save_data(st.session_state.store, df_mod)
                     except Exception as e:
                         st.warning(f"Eliminazione salvata localmente ma non su Google Sheets: {e}")
 
@@ -752,21 +788,16 @@ if st.session_state.ruolo == "utente":
                 st.success("✅ Attività eliminata con successo!")
                 # Resetto il flag così non rimane sempre
                 st.session_state.attivita_eliminata = False
-                
-            st.session_state.df_att = load_data(st.session_state.sheet)
     
 
                     
     # ---------- ELENCO ----------
     elif scelta_pagina == "📑 Elenco attività":
         st.subheader("📑 Le mie attività - elenco")
-        df_mio = st.session_state.df_att[st.session_state.df_att["NomeUtente"] == st.session_state.username].copy()
+        df_mio = st.session_state.snapshot.of_user(st.session_state.username)
         if df_mio.empty:
             st.info("Nessuna attività registrata.")
         else:
-            if not pd.api.types.is_datetime64_any_dtype(df_mio["Data"]):
-                df_mio["Data"] = pd.to_datetime(df_mio["Data"], errors="coerce")
-
             data_min = df_mio["Data"].dropna().min().date()
             data_max = df_mio["Data"].dropna().max().date()
 
@@ -780,15 +811,14 @@ if st.session_state.ruolo == "utente":
 
             df_filtered = df_mio[
                 df_mio["Data"].notna()
-                & (df_mio["Data"].dt.date >= start_date)
-                & (df_mio["Data"].dt.date <= end_date)
+                & (df_mio["Data"] >= pd.Timestamp(start_date))
+                & (df_mio["Data"] < pd.Timestamp(end_date) + pd.Timedelta(days=1))
             ].sort_values("Data", ascending=False)
 
-            search_term = st.text_input("🔍 Cerca nelle attività (note, attività, tipologia)...", "")
+            search_term = st.text_input("🔍 Cerca nelle attività (note, attività, tipologia, malattia)...", "")
             if search_term:
-                df_filtered = df_filtered[
-                    df_filtered.apply(lambda row: row.astype(str).str.contains(search_term, case=False).any(), axis=1)
-                ]
+                indice = st.session_state.snapshot.search_index
+                df_filtered = df_filtered[search_mask(indice, search_term, df_filtered.index)]
 
             total = len(df_filtered)
             if total == 0:
@@ -802,44 +832,36 @@ if st.session_state.ruolo == "utente":
                 st.caption(f"Mostrando {start + 1}–{end} di {total} record")
                 st.dataframe(df_filtered.iloc[start:end])
 
-                st.download_button(
-                    "⬇️ Scarica risultato (CSV)",
-                    df_filtered.to_csv(index=False).encode("utf-8"),
-                    "attivita_filtrate.csv",
-                    "text/csv",
-                    key="tbl_download"
+                export_button(
+                    lambda df=df_filtered: df,
+                    (st.session_state.username, start_date, end_date, search_term),
+                    "attivita_filtrate",
+                    key="tbl_download",
                 )
 
     # ---------- GRAFICI ----------
     elif scelta_pagina == "📊 Riepilogo e Grafici":
         st.subheader("📊 Riepilogo attività personali")
 
-        df_mio = st.session_state.df_att[st.session_state.df_att["NomeUtente"] == st.session_state.username]
+        kpi_mio = filter_rollup(st.session_state.snapshot.kpi, utente=st.session_state.username)
 
-        if df_mio.empty:
+        if kpi_mio.empty:
             st.info("Nessuna attività registrata.")
         else:
-            if not pd.api.types.is_datetime64_any_dtype(df_mio["Data"]):
-                df_mio["Data"] = pd.to_datetime(df_mio["Data"], errors="coerce")
-
-            data_min = df_mio["Data"].dropna().min().date() if df_mio["Data"].notna().any() else datetime.today().date()
-            data_max = df_mio["Data"].dropna().max().date() if df_mio["Data"].notna().any() else datetime.today().date()
+            data_min, data_max = date_range(kpi_mio) or (datetime.today().date(),) * 2
 
             start_date = st.date_input("Data inizio", data_min)
             end_date = st.date_input("Data fine", data_max)
 
-            df_periodo = df_mio[
-                df_mio["Data"].notna()
-                & (df_mio["Data"].dt.date >= start_date)
-                & (df_mio["Data"].dt.date <= end_date)
-            ]
+            rollup_periodo = filter_rollup(
+                st.session_state.snapshot.rollup, utente=st.session_state.username,
+                start_date=start_date, end_date=end_date,
+            )
 
             # KPI
-            tot_ore = df_periodo["Ore"].fillna(0).sum()
-            tot_minuti = df_periodo["Minuti"].fillna(0).sum()
-            tot_ore_equivalenti = tot_ore + (tot_minuti / 60)
-            tot_campioni = df_periodo["NumCampioni"].fillna(0).sum()
-            tot_referti = df_periodo["NumReferti"].fillna(0).sum()
+            tot_ore_equivalenti, tot_campioni, tot_referti = totals(
+                filter_rollup(kpi_mio, start_date=start_date, end_date=end_date)
+            )
 
             col1, col2, col3 = st.columns(3)
             with col1:
@@ -866,7 +888,7 @@ if st.session_state.ruolo == "utente":
 
             # Grafico ore totali per MacroAttività
             st.markdown("**Ore totali per MacroAttività**")
-            ore_macro = df_periodo.groupby("MacroAttivita")["Ore"].sum().reset_index()
+            ore_macro = sum_by(rollup_periodo, "MacroAttivita", "Ore")
             if not ore_macro.empty:
                 chart = alt.Chart(ore_macro).mark_bar().encode(
                     x=alt.X("MacroAttivita:N", sort='-y'),
@@ -879,17 +901,12 @@ if st.session_state.ruolo == "utente":
 
             # Grafico referti per tipologia
             # Suddivisione referti per tipo
-            df_ref = df_periodo[df_periodo["MacroAttivita"] == "REFERTAZIONE"].copy()
-            if not df_ref.empty:
+            rollup_ref = rollup_periodo[rollup_periodo["MacroAttivita"] == "REFERTAZIONE"]
+            if not rollup_ref.empty:
                 st.markdown("**Referti per tipologia**")
-    
-                # 🔍 DEBUG: controlla che ci siano dati
-                st.write("Dati referti trovati:", df_ref[["MacroAttivita","Tipologia"]].head(10))
-
-                if "Tipologia" in df_ref.columns and df_ref["Tipologia"].notna().any():
-                    ref_counts = df_ref["Tipologia"].value_counts().reset_index()
-                    ref_counts.columns = ["Tipologia", "Conteggio"]
 
+                ref_counts = count_by(rollup_ref, "Tipologia")
+                if not ref_counts.empty:
                     chart_admin_ref = alt.Chart(ref_counts).mark_bar().encode(
                         x=alt.X("Tipologia:N", title="Tipologia"),
                         y=alt.Y("Conteggio:Q", title="Numero"),
@@ -902,16 +919,11 @@ if st.session_state.ruolo == "utente":
 
 
             # Grafico accettazione campioni interni vs esterni
-            df_acc = df_periodo[df_periodo["MacroAttivita"] == "ACCETTAZIONE"].copy()
-            if not df_acc.empty:
+            rollup_acc = rollup_periodo[rollup_periodo["MacroAttivita"] == "ACCETTAZIONE"]
+            if not rollup_acc.empty:
                 st.markdown("**Accettazione: campioni interni vs esterni**")
-                df_acc["NumCampioni"] = pd.to_numeric(df_acc["NumCampioni"], errors="coerce").fillna(0)
-                att_lower = df_acc["Attivita"].str.lower().fillna("")
-                df_acc["TipoAcc"] = att_lower.apply(
-                    lambda s: "Interni" if "intern" in s else ("Esterni" if "estern" in s else "Altro")
-                )
                 serie_accettazione = (
-                    df_acc.groupby("TipoAcc")["NumCampioni"]
+                    rollup_acc.groupby("TipoAcc")["NumCampioni"]
                     .sum()
                     .reindex(["Interni", "Esterni", "Altro"])
                     .fillna(0)
@@ -939,28 +951,25 @@ if st.session_state.ruolo == "utente":
         confirm_pw = st.text_input("Conferma nuova password", type="password", key="confirm_pw")
 
         if st.button("Salva nuova password"):
-            dfu = st.session_state.df_utenti
-            user_row = dfu[dfu["NomeUtente"] == st.session_state.username]
+            utente = user_directory().lookup(st.session_state.username)
 
-            if user_row.empty:
+            if utente is None:
                 st.error("Utente non trovato.")
-            elif old_pw != user_row.iloc[0]["Password"]:
+            elif old_pw != utente.get("Password"):
                 st.error("❌ La password attuale non è corretta.")
             elif new_pw != confirm_pw:
                 st.error("❌ Le nuove password non coincidono.")
             elif len(new_pw) < 6:
                 st.error("❌ La password deve avere almeno 6 caratteri.")
             else:
-                st.session_state.df_utenti.loc[
-                    st.session_state.df_utenti["NomeUtente"] == st.session_state.username, "Password"
-                ] = new_pw
-
-                # Salvo subito su Google Sheets
+                # Salvo subito su Google Sheets (solo la cella della password), poi aggiorno l'anagrafica condivisa
                 try:
-                    save_utenti(st.session_state.ws_utenti, st.session_state.df_utenti)
+                    st.session_state.store.update_utenti({st.session_state.username: {"Password": new_pw}})
+                    user_directory().update(st.session_state.username, Password=new_pw)
                     st.success("✅ Password cambiata e salvata su Google Sheets!")
                 except Exception as e:
-                    st.warning(f"Password aggiornata localmente ma non su Google Sheets: {e}")
+                    user_directory().invalidate()
+                    st.error(f"❌ Password non salvata su Google Sheets: {e}")
 
 # =====================================
 # Area CAPO (Admin)
@@ -970,11 +979,13 @@ elif st.session_state.ruolo == "capo":
     # Menu capo
     scelta_pagina_capo = st.sidebar.radio(
         "📌 Menu capo",
-        ["🏠 Home", "📊 Dashboard", "👩‍🔬 Monitoraggio per Utente", "🧬 Monitoraggio per Attività/Malattia"],
+        ["🏠 Home", "📊 Dashboard", "👩‍🔬 Monitoraggio per Utente", "🧬 Monitoraggio per Attività/Malattia", "👥 Utenti", "📥 Importa attività", "🩺 Diagnostica"],
         index=0
     )
 
-    df_all = st.session_state.df_att.copy()
+    df_all = st.session_state.df_att
+    rollup_all = st.session_state.snapshot.rollup
+    kpi_all = st.session_state.snapshot.kpi
 
     # ---------- HOME ----------
     if scelta_pagina_capo == "🏠 Home":
@@ -984,9 +995,7 @@ elif st.session_state.ruolo == "capo":
         if df_all.empty:
             st.info("Nessuna attività registrata dagli utenti.")
         else:
-            tot_ore = df_all["Ore"].fillna(0).sum() + df_all["Minuti"].fillna(0).sum()/60
-            tot_campioni = df_all["NumCampioni"].fillna(0).sum()
-            tot_referti = df_all["NumReferti"].fillna(0).sum()
+            tot_ore, tot_campioni, tot_referti = totals(kpi_all)
 
             c1, c2, c3 = st.columns(3)
             with c1:
@@ -1016,6 +1025,10 @@ elif st.session_state.ruolo == "capo":
             df_recent = df_all.sort_values("Data", ascending=False).head(10)[["Data","NomeUtente","MacroAttivita","Attivita","Note"]]
             st.dataframe(df_recent)
 
+            st.markdown("---")
+            st.markdown("### Esporta tutte le attività")
+            export_button(lambda df=df_all: df, "tutte", "attivita_tutte", key="capo_export_tutte")
+
     # ---------- DASHBOARD ----------
     elif scelta_pagina_capo == "📊 Dashboard":
         st.subheader("📊 Dashboard Amministratore")
@@ -1023,30 +1036,21 @@ elif st.session_state.ruolo == "capo":
         if df_all.empty:
             st.info("Nessuna attività registrata dagli utenti.")
         else:
-            if not pd.api.types.is_datetime64_any_dtype(df_all["Data"]):
-                df_all["Data"] = pd.to_datetime(df_all["Data"], errors="coerce")
-
             # --- FILTRO PERIODO ---
-            data_min = df_all["Data"].dropna().min().date()
-            data_max = df_all["Data"].dropna().max().date()
+            data_min, data_max = date_range(kpi_all) or (datetime.today().date(),) * 2
             col1, col2 = st.columns(2)
             with col1:
                 start_date = st.date_input("Da", data_min, key="admin_start")
             with col2:
                 end_date = st.date_input("A", data_max, key="admin_end")
 
-            df_periodo = df_all[
-                df_all["Data"].notna()
-                & (df_all["Data"].dt.date >= start_date)
-                & (df_all["Data"].dt.date <= end_date)
-            ]
+            rollup_periodo = filter_rollup(rollup_all, start_date=start_date, end_date=end_date)
 
             # =========================
             # Panoramica Campioni e Referti
             # =========================
             st.markdown("### 📦 Panoramica Campioni e Referti")
-            tot_campioni = df_periodo["NumCampioni"].fillna(0).sum()
-            tot_referti = df_periodo["NumReferti"].fillna(0).sum()
+            _, tot_campioni, tot_referti = totals(filter_rollup(kpi_all, start_date=start_date, end_date=end_date))
 
             c1, c2 = st.columns(2)
             with c1:
@@ -1065,11 +1069,10 @@ elif st.session_state.ruolo == "capo":
                 """, unsafe_allow_html=True)
 
             # Suddivisione referti per tipo
-            df_ref = df_periodo[df_periodo["MacroAttivita"] == "REFERTAZIONE"].copy()
-            if not df_ref.empty:
+            rollup_ref = rollup_periodo[rollup_periodo["MacroAttivita"] == "REFERTAZIONE"]
+            if not rollup_ref.empty:
                 st.markdown("**Referti per tipologia**")
-                ref_counts = df_ref["Tipologia"].value_counts().reset_index()
-                ref_counts.columns = ["Tipologia", "Conteggio"]
+                ref_counts = count_by(rollup_ref, "Tipologia")
 
                 chart_admin_ref = alt.Chart(ref_counts).mark_bar().encode(
                     x=alt.X("Tipologia:N", title="Tipologia"),
@@ -1080,8 +1083,7 @@ elif st.session_state.ruolo == "capo":
                 st.altair_chart(chart_admin_ref, use_container_width=True)
 
                 st.markdown("**Referti per malattia**")
-                ref_mal = df_ref["TipoMalattiaRef"].value_counts().reset_index()
-                ref_mal.columns = ["Malattia", "Conteggio"]
+                ref_mal = count_by(rollup_ref, "TipoMalattiaRef", "Malattia")
 
                 chart_admin_ref_mal = alt.Chart(ref_mal).mark_bar().encode(
                     x=alt.X("Malattia:N", title="Malattia"),
@@ -1096,14 +1098,8 @@ elif st.session_state.ruolo == "capo":
             # =========================
             st.markdown("### ⏱️ Ore per MacroAttività suddivise per Utente")
 
-            # Calcolo ore totali (ore + minuti/60)
-            df_periodo["OreTot"] = df_periodo["Ore"].fillna(0) + df_periodo["Minuti"].fillna(0) / 60
-
-            ore_macro_user = (
-                df_periodo.groupby(["MacroAttivita", "NomeUtente"])["OreTot"]
-                .sum()
-                .reset_index()
-            )
+            # Ore totali (ore + minuti/60)
+            ore_macro_user = sum_by(rollup_periodo, ["MacroAttivita", "NomeUtente"], "OreTot")
 
             if not ore_macro_user.empty:
                 chart_macro_user = (
@@ -1122,11 +1118,10 @@ elif st.session_state.ruolo == "capo":
                 st.info("Nessuna attività nel periodo selezionato.")
 
             # Suddivisione campioni per malattia
-            df_acc = df_periodo[df_periodo["MacroAttivita"] == "ACCETTAZIONE"].copy()
-            if not df_acc.empty:
+            rollup_acc = rollup_periodo[rollup_periodo["MacroAttivita"] == "ACCETTAZIONE"]
+            if not rollup_acc.empty:
                 st.markdown("**Campioni per malattia**")
-                camp_user_counts = df_acc["TipoMalattia"].value_counts().reset_index()
-                camp_user_counts.columns = ["Malattia", "Conteggio"]
+                camp_user_counts = count_by(rollup_acc, "TipoMalattia", "Malattia")
 
                 chart_admin_camp_user = alt.Chart(camp_user_counts).mark_bar().encode(
                     x=alt.X("Malattia:N", title="Malattia"),
@@ -1145,8 +1140,8 @@ elif st.session_state.ruolo == "capo":
         if df_all.empty:
             st.info("Nessuna attività registrata dagli utenti.")
         else:
-            utente_sel = st.selectbox("Seleziona utente", sorted(df_all["NomeUtente"].dropna().unique()))
-            df_user = df_all[df_all["NomeUtente"] == utente_sel]
+            utente_sel = st.selectbox("Seleziona utente", sorted(rollup_all["NomeUtente"].dropna().unique()))
+            df_user = st.session_state.snapshot.of_user(utente_sel)
 
             if df_user.empty:
                 st.info(f"Nessuna attività per {utente_sel}.")
@@ -1154,9 +1149,6 @@ elif st.session_state.ruolo == "capo":
                 # 📑 --- TABELLINA PRIMA ---
                 st.subheader(f"📑 Elenco attività di {utente_sel}")
 
-                if not pd.api.types.is_datetime64_any_dtype(df_user["Data"]):
-                    df_user["Data"] = pd.to_datetime(df_user["Data"], errors="coerce")
-
                 if df_user["Data"].notna().any():
                     data_min = df_user["Data"].dropna().min().date()
                     data_max = df_user["Data"].dropna().max().date()
@@ -1173,8 +1165,8 @@ elif st.session_state.ruolo == "capo":
                 with colC:
                     page_size = st.selectbox("Righe per pagina", [10, 20, 50, 100], index=1, key="admin_user_tbl_pagesize")
 
-                start_date_dt = pd.to_datetime(start_date)
-                end_date_dt = pd.to_datetime(end_date) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+                start_date_dt = pd.Timestamp(start_date)
+                end_date_dt = pd.Timestamp(end_date) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
 
                 df_filtered = df_user[
                     df_user["Data"].notna()
@@ -1183,13 +1175,12 @@ elif st.session_state.ruolo == "capo":
                 ].sort_values("Data", ascending=False)
 
                 search_term = st.text_input(
-                    "🔍 Cerca nelle attività (note, attività, tipologia)...",
+                    "🔍 Cerca nelle attività (note, attività, tipologia, malattia)...",
                     key="admin_user_tbl_search"
                 )
                 if search_term:
-                    df_filtered = df_filtered[
-                        df_filtered.apply(lambda row: row.astype(str).str.contains(search_term, case=False).any(), axis=1)
-                    ]
+                    indice = st.session_state.snapshot.search_index
+                    df_filtered = df_filtered[search_mask(indice, search_term, df_filtered.index)]
 
                 total = len(df_filtered)
                 if total == 0:
@@ -1203,22 +1194,25 @@ elif st.session_state.ruolo == "capo":
                     st.caption(f"Mostrando {start + 1}–{end} di {total} record")
                     st.dataframe(df_filtered.iloc[start:end])
 
-                    st.download_button(
-                        "⬇️ Scarica risultato (CSV)",
-                        df_filtered.to_csv(index=False).encode("utf-8"),
-                        f"attivita_{utente_sel}.csv",
-                        "text/csv",
-                        key="admin_user_tbl_download"
+                    export_button(
+                        lambda df=df_filtered: df,
+                        (utente_sel, start_date, end_date, search_term),
+                        f"attivita_{utente_sel}",
+                        key="admin_user_tbl_download",
                     )
 
                 # 📊 --- GRAFICI DOPO ---
                 st.markdown("---")
                 st.subheader("📊 Analisi grafica")
 
-                # Usa lo stesso df filtrato anche per i grafici
-                df_grafici = df_filtered.copy()
+                # Usa lo stesso filtro anche per i grafici: senza ricerca basta il rollup del periodo
+                if search_term:
+                    rollup_grafici = build_rollup(df_filtered)
+                    tot_ore = totals(rollup_grafici)[0]
+                else:
+                    rollup_grafici = filter_rollup(rollup_all, utente=utente_sel, start_date=start_date, end_date=end_date)
+                    tot_ore = totals(filter_rollup(kpi_all, utente=utente_sel, start_date=start_date, end_date=end_date))[0]
 
-                tot_ore = df_grafici["Ore"].fillna(0).sum() + df_grafici["Minuti"].fillna(0).sum() / 60
                 st.markdown(f"""
                 <div style="background-color:#e8f5e9;padding:15px;border-radius:10px;text-align:center">
                 <h3>⏱️ Ore Totali di {utente_sel}</h3>
@@ -1227,8 +1221,8 @@ elif st.session_state.ruolo == "capo":
                 """, unsafe_allow_html=True)
 
                 st.markdown("**Ore per MacroAttività**")
-                ore_macro = df_grafici.groupby("MacroAttivita")["Ore"].sum()
-                chart = alt.Chart(ore_macro.reset_index()).mark_bar().encode(
+                ore_macro = sum_by(rollup_grafici, "MacroAttivita", "Ore")
+                chart = alt.Chart(ore_macro).mark_bar().encode(
                     x=alt.X("MacroAttivita:N", sort='-y'),
                     y="Ore:Q",
                     color=alt.value("#4caf50")
@@ -1236,10 +1230,9 @@ elif st.session_state.ruolo == "capo":
                 st.altair_chart(chart, use_container_width=True)
 
                 st.markdown("**Numero referti per tipologia**")
-                ref_user = df_grafici[df_grafici["MacroAttivita"] == "REFERTAZIONE"]
+                ref_user = rollup_grafici[rollup_grafici["MacroAttivita"] == "REFERTAZIONE"]
                 if not ref_user.empty:
-                    ref_user_counts = ref_user["Tipologia"].value_counts().reset_index()
-                    ref_user_counts.columns = ["Tipologia", "Conteggio"]
+                    ref_user_counts = count_by(ref_user, "Tipologia")
 
                     chart_admin_ref_user = alt.Chart(ref_user_counts).mark_bar().encode(
                         x=alt.X("Tipologia:N", title="Tipologia"),
@@ -1252,10 +1245,9 @@ elif st.session_state.ruolo == "capo":
                     st.info("Nessun referto registrato per questo utente.")
 
                 st.markdown("**Campioni per malattia**")
-                camp_user = df_grafici[df_grafici["MacroAttivita"] == "ACCETTAZIONE"]
+                camp_user = rollup_grafici[rollup_grafici["MacroAttivita"] == "ACCETTAZIONE"]
                 if not camp_user.empty:
-                    camp_user_counts = camp_user["TipoMalattia"].value_counts().reset_index()
-                    camp_user_counts.columns = ["Malattia", "Conteggio"]
+                    camp_user_counts = count_by(camp_user, "TipoMalattia", "Malattia")
 
                     chart_admin_camp_user = alt.Chart(camp_user_counts).mark_bar().encode(
                         x=alt.X("Malattia:N", title="Malattia"),
@@ -1277,12 +1269,15 @@ elif st.session_state.ruolo == "capo":
         else:
             filtro_att = st.selectbox(
                 "Seleziona una malattia/attività da monitorare",
-                sorted(set(df_all["TipoMalattia"].dropna().unique()) | set(df_all["TipoMalattiaRef"].dropna().unique()))
+                sorted(set(rollup_all["TipoMalattia"].dropna().unique()) | set(rollup_all["TipoMalattiaRef"].dropna().unique()))
             )
 
             df_filtro = df_all[
                 (df_all["TipoMalattia"] == filtro_att) | (df_all["TipoMalattiaRef"] == filtro_att)
             ]
+            rollup_filtro = rollup_all[
+                (rollup_all["TipoMalattia"] == filtro_att) | (rollup_all["TipoMalattiaRef"] == filtro_att)
+            ]
 
             if df_filtro.empty:
                 st.info(f"Nessun dato trovato per '{filtro_att}'.")
@@ -1291,7 +1286,7 @@ elif st.session_state.ruolo == "capo":
                 st.dataframe(df_filtro.sort_values("Data", ascending=False))
 
                 st.markdown("**Referti per utente**")
-                ref_utenti = df_filtro.groupby("NomeUtente")["NumReferti"].sum().reset_index()
+                ref_utenti = sum_by(rollup_filtro, "NomeUtente", "NumReferti")
                 chart_ref_utenti = alt.Chart(ref_utenti).mark_bar().encode(
                     x=alt.X("NomeUtente:N", title="Utente"),
                     y="NumReferti:Q",
@@ -1300,7 +1295,7 @@ elif st.session_state.ruolo == "capo":
                 st.altair_chart(chart_ref_utenti, use_container_width=True)
 
                 st.markdown("**Campioni per utente**")
-                camp_utenti = df_filtro.groupby("NomeUtente")["NumCampioni"].sum().reset_index()
+                camp_utenti = sum_by(rollup_filtro, "NomeUtente", "NumCampioni")
                 chart_camp_utenti = alt.Chart(camp_utenti).mark_bar().encode(
                     x=alt.X("NomeUtente:N", title="Utente"),
                     y="NumCampioni:Q",
@@ -1308,6 +1303,164 @@ elif st.session_state.ruolo == "capo":
                 ).properties(width=600, height=400)
                 st.altair_chart(chart_camp_utenti, use_container_width=True)
 
+    # ---------- UTENTI ----------
+    elif scelta_pagina_capo == "👥 Utenti":
+        st.subheader("👥 Gestione utenti")
+        st.caption(
+            "Modifica ruolo e stato, aggiungi una riga per ogni nuovo utente; la password cambia solo se "
+            "indicata. Gli utenti non si eliminano: si disattivano. Tutte le modifiche partono insieme."
+        )
+
+        utenti = user_directory().frame()
+        utenti = utenti.assign(Attivo=utenti["Attivo"].ne("0"), Password="")[["NomeUtente", "Ruolo", "Attivo", "Password"]]
+        utenti_mod = st.data_editor(
+            utenti,
+            num_rows="dynamic",
+            hide_index=True,
+            key="editor_utenti",
+            column_config={
+                "Ruolo": st.column_config.SelectboxColumn("Ruolo", options=["utente", "capo"], default="utente"),
+                "Attivo": st.column_config.CheckboxColumn("Attivo", default=True),
+                "Password": st.column_config.TextColumn("Nuova password"),
+            },
+        )
+
+        if st.button("Salva utenti"):
+            modifiche, errori = account_changes(utenti, utenti_mod)
+            for errore in errori:
+                st.error(f"❌ {errore}")
+            if not errori and modifiche:
+                try:
+                    # 🔹 Un'unica scrittura per tutte le modifiche
+                    st.session_state.store.update_utenti(modifiche)
+                    for nome, campi in modifiche.items():
+                        user_directory().update(nome, **campi)
+                    st.success(f"✅ Utenti aggiornati: {', '.join(modifiche)}")
+                except Exception as e:
+                    user_directory().invalidate()
+                    st.error(f"❌ Errore nel salvataggio degli utenti: {e}")
+            elif not errori:
+                st.info("Nessuna modifica da salvare.")
+
+    elif scelta_pagina_capo == "📥 Importa attività":
+        st.subheader("📥 Importa attività storiche")
+        st.caption(
+            "File CSV o Excel (.xlsx) con le colonne della tabella attività (l'ID è facoltativo). "
+            "Il file viene letto e salvato a blocchi; righe non valide e duplicati vengono scartati."
+        )
+
+        file = st.file_uploader("File da importare", type=["csv", "xlsx"])
+        if file is not None:
+            # 🔹 Stato dell'importazione legato al file: serve a riprendere dopo un errore
+            if st.session_state.get("import_file") != (file.name, file.size):
+                st.session_state.import_file = (file.name, file.size)
+                st.session_state.import_stato = {
+                    "completate": 0, "importate": 0, "duplicate": 0, "scartate": 0, "finito": False, "errori": [],
+                }
+            stato = st.session_state.import_stato
+
+            if stato["finito"]:
+                st.info("Questo file è già stato importato.")
+            elif st.button("▶️ Riprendi importazione" if stato["completate"] else "▶️ Avvia importazione"):
+                if stato["completate"]:
+                    st.info(f"Si riprende dalla riga {stato['completate'] + 2} del file.")
+                avanzamento_testo = st.empty()
+                try:
+                    file.seek(0)
+                    for avanzamento in import_activities(
+                        st.session_state.store, file, file.name, macro_tipologia_attivita,
+                        st.session_state.df_att, riprendi_da=stato["completate"],
+                    ):
+                        if not avanzamento["righe"].empty:
+                            snapshot = activity_cache().patch(avanzamento["righe"])
+                            if snapshot is not None:
+                                use_snapshot(snapshot)
+                        stato["completate"] = avanzamento["completate"]
+                        stato["importate"] += avanzamento["importate"]
+                        stato["duplicate"] += avanzamento["duplicate"]
+                        stato["scartate"] += len(avanzamento["errori"])
+                        stato["errori"].extend(avanzamento["errori"].items())
+                        avanzamento_testo.write(
+                            f"⏳ Righe lette: {stato['completate']} — importate {stato['importate']}, "
+                            f"duplicate {stato['duplicate']}, scartate {stato['scartate']}"
+                        )
+                    stato["finito"] = True
+                    st.success(
+                        f"✅ Importazione completata: {stato['importate']} attività importate, "
+                        f"{stato['duplicate']} duplicate, {stato['scartate']} scartate."
+                    )
+                except Exception as e:
+                    st.error(
+                        f"❌ Importazione interrotta alla riga {stato['completate'] + 2} del file: {e}. "
+                        "Le righe precedenti sono salvate: premi 'Riprendi importazione' per continuare."
+                    )
+
+            if stato["errori"]:
+                errori = pd.DataFrame(stato["errori"], columns=["Riga", "Errore"])
+                st.warning(f"⚠️ {len(errori)} righe scartate perché non valide.")
+                st.dataframe(errori.head(200), hide_index=True)
+                st.download_button(
+                    "📥 Scarica le righe scartate (CSV)", errori.to_csv(index=False).encode("utf-8"),
+                    file_name="righe_scartate.csv", mime="text/csv",
+                )
+
+    elif scelta_pagina_capo == "🩺 Diagnostica":
+        st.subheader("🩺 Diagnostica")
+        st.caption(
+            "Tempi e volumi delle operazioni di questo processo: storage (store.*), chiamate all'API "
+            "Google (sheets.*, drive.*), funzioni dell'app (app.*) e pagine (pagina.*)."
+        )
+
+        riepilogo = METRICHE.summary()
+        if riepilogo.empty:
+            st.info("Nessuna operazione misurata finora.")
+        else:
+            st.dataframe(riepilogo.round(1), hide_index=True)
+
+            operazione = st.selectbox("Istogramma delle latenze", riepilogo["Operazione"], key="diag_operazione")
+            chart_diag = alt.Chart(METRICHE.histogram(operazione)).mark_bar().encode(
+                x=alt.X("Intervallo:N", sort=None, title="Durata"),
+                y=alt.Y("Chiamate:Q", title="Chiamate"),
+                color=alt.value("#4caf50")
+            ).properties(width=600, height=300)
+            st.altair_chart(chart_diag, use_container_width=True)
+
+        st.markdown(f"### Operazioni lente (≥ {METRICHE.soglia_lenta:g} s)")
+        lente = pd.DataFrame(list(METRICHE.lente), columns=["Ora", "Operazione", "Secondi", "Dettaglio"])
+        if lente.empty:
+            st.info("Nessuna operazione lenta.")
+        else:
+            st.dataframe(lente.iloc[::-1].round({"Secondi": 2}), hide_index=True)
+
+        st.markdown("### Ultime esecuzioni delle pagine")
+        esecuzioni = pd.DataFrame(
+            [
+                (ora, pagina, secondi * 1000, sum(c for n, c in chiamate.items() if n.startswith(("sheets.", "drive."))),
+                 ", ".join(f"{n} ×{c}" for n, c in sorted(chiamate.items())))
+                for ora, pagina, secondi, chiamate in METRICHE.esecuzioni
+            ],
+            columns=["Ora", "Pagina", "ms", "Chiamate API", "Operazioni"],
+        )
+        st.dataframe(esecuzioni.iloc[::-1].round({"ms": 1}), hide_index=True)
+
+        if config("backend", "sheets") != "sqlite":
+            st.markdown("### Quote API Google Sheets")
+            st.json(sheets_connection().quota.statistiche)
+
+        st.markdown("### Memoria della tabella attività")
+        memoria = memory_report(df_all) / 2**20
+        st.dataframe(memoria.rename("MB").round(3))
+
+        st.markdown("### Prometheus")
+        testo_prometheus = METRICHE.to_prometheus()
+        st.download_button("⬇️ Scarica metriche (formato Prometheus)", testo_prometheus, "metriche.prom", "text/plain")
+        percorso = config("prometheus_file")
+        if percorso:
+            st.caption(f"Le metriche vengono scritte anche in {percorso} ogni {PROMETHEUS_INTERVALLO} secondi.")
+        if st.button("🗑️ Azzera metriche"):
+            METRICHE.reset()
+            st.rerun()
+
 # =====================================
 # Azioni comuni (utente e capo)
 # =====================================
@@ -1319,6 +1472,8 @@ if st.sidebar.button("🚪 Logout", key="logout_common"):
     st.session_state.ruolo = ""
     st.rerun()
 
+end_page(scelta_pagina if st.session_state.ruolo == "utente" else scelta_pagina_capo)
+
 
 
 
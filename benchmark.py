@@ -0,0 +1,499 @@
+"""Benchmark delle operazioni sull'intera tabella attività.
+
+Uso: python benchmark.py [righe ...]   (default 1000 5000 10000 100000 200000)
+     python benchmark.py --suite [--json FILE] [righe ...]   (default 1000 10000 100000 1000000)
+
+Merge di save_data: per ogni dimensione modifica l'1% delle righe, ne elimina l'1% e ne
+aggiunge l'1%, poi confronta merge_rows con il ciclo iterrows originale (quadratico,
+misurato solo fino a LIMITE_CICLO righe). Ricerca: costruzione dell'indice e query con
+più termini, contro il vecchio filtro apply riga per riga. Rollup: costruzione, aggiornamento
+per una riga modificata e KPI di un periodo letti dal rollup giorno × utente invece che dalle righe.
+Memoria: frame con stringhe object e interi a 64 bit contro quello tipizzato da apply_schema.
+Inserimento multiplo: 100 righe con un solo append contro 100 inserimenti singoli, su un
+foglio in memoria con una latenza fissa per chiamata (LATENZA_API).
+
+Suite (--suite): tabelle realistiche generate dalla tassonomia dell'app, caricate su un
+MemoryWorksheet senza latenza; misura load_data, sync_data, il salvataggio di save_data
+(merge_rows + write_delta), append_data, la ricerca e le aggregazioni di ogni dashboard,
+con il numero di chiamate al foglio. I risultati vanno in JSON (--json) per confrontare
+le versioni. Con 1.000.000 di righe servono circa 3 GB di memoria.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import time
+
+import numpy as np
+import pandas as pd
+
+from gspread.utils import a1_to_rowcol, numericise_all, to_records
+
+from rollups import (
+    CHIAVI_KPI, build_rollup, count_by, date_range, filter_rollup, rollup_by, sum_by, totals, update_rollup,
+)
+from search import build_search_index, search_mask
+from storage import (
+    COLONNE_ATTIVITA, append_sheet_rows, apply_schema, load_data, memory_report, merge_rows, parse_dates,
+    sync_data, to_sheet_rows, write_delta,
+)
+from taxonomy import macro_tipologia_attivita, tipi_malattia
+from validation import taxonomy_triples
+
+LIMITE_CICLO = 5_000
+LATENZA_API = 0.05   # secondi simulati per ogni chiamata a Google Sheets
+
+
+class MemorySpreadsheet:
+    """Spreadsheet del MemoryWorksheet: solo la cancellazione di righe di batch_update."""
+
+    def __init__(self, foglio):
+        self.foglio = foglio
+
+    def batch_update(self, body):
+        self.foglio._chiamata()
+        # Le richieste arrivano dal basso verso l'alto: gli indici sono quelli di partenza
+        via = {
+            r["deleteDimension"]["range"]["startIndex"] for r in body["requests"] if "deleteDimension" in r
+        }
+        self.foglio.righe = [r for i, r in enumerate(self.foglio.righe) if i not in via]
+        return {}
+
+
+class MemoryWorksheet:
+    """Foglio in memoria con le chiamate gspread usate da storage; conta le chiamate e
+    attende latenza secondi ad ognuna, come una richiesta di rete."""
+
+    id = 0
+
+    def __init__(self, righe=(), latenza=LATENZA_API, title="Foglio1"):
+        self.title = title
+        self.righe = [list(r) for r in righe]
+        self.latenza = latenza
+        self.chiamate = 0
+        self.spreadsheet = MemorySpreadsheet(self)
+
+    def _chiamata(self):
+        self.chiamate += 1
+        if self.latenza:
+            time.sleep(self.latenza)
+
+    def _cella(self, r, c):
+        riga = self.righe[r - 1] if r <= len(self.righe) else []
+        return riga[c - 1] if c <= len(riga) else ""
+
+    def _range(self, a1):
+        """Valori di un intervallo A1 (anche aperto, come "A2:A", o di righe intere, come "1:1"),
+        senza celle vuote finali."""
+        inizio, _, fine = a1.split("!")[-1].partition(":")
+        if inizio.isdigit():
+            r1, c1, r2, c2 = int(inizio), 1, int(fine or inizio), max(map(len, self.righe), default=0)
+        elif fine:
+            r1, c1 = a1_to_rowcol(inizio)
+            colonna = fine.rstrip("0123456789")
+            r2 = int(fine[len(colonna):]) if fine[len(colonna):] else len(self.righe)
+            c2 = a1_to_rowcol(f"{colonna}1")[1]
+        else:
+            r1, c1 = a1_to_rowcol(inizio)
+            r2, c2 = r1, c1
+        valori = []
+        for riga in self.righe[r1 - 1:r2]:
+            riga = riga[c1 - 1:c2]
+            while riga and riga[-1] == "":
+                riga = riga[:-1]
+            valori.append(riga)
+        while valori and not valori[-1]:
+            valori.pop()
+        return valori
+
+    def row_values(self, riga):
+        self._chiamata()
+        return list(self.righe[riga - 1]) if riga <= len(self.righe) else []
+
+    def col_values(self, colonna):
+        self._chiamata()
+        valori = [self._cella(r, colonna) for r in range(1, len(self.righe) + 1)]
+        while valori and valori[-1] == "":
+            valori.pop()
+        return valori
+
+    def get_all_values(self, **kwargs):
+        self._chiamata()
+        return [list(r) for r in self.righe]
+
+    def get_all_records(self, numericise_ignore=None, **kwargs):
+        """Come gspread: intestazione come chiavi e valori convertiti in numeri."""
+        self._chiamata()
+        if not self.righe:
+            return []
+        chiavi, n = self.righe[0], len(self.righe[0])
+        valori = [(r + [""] * n)[:n] for r in self.righe[1:]]
+        if numericise_ignore != ["all"]:
+            valori = [numericise_all(r, False, "", False, numericise_ignore) for r in valori]
+        return to_records(chiavi, valori)
+
+    def get(self, a1, **kwargs):
+        self._chiamata()
+        return self._range(a1)
+
+    def batch_get(self, intervalli, major_dimension=None, **kwargs):
+        self._chiamata()
+        risultati = [self._range(a1) for a1 in intervalli]
+        if major_dimension == "COLUMNS":
+            risultati = [
+                [[r[0] if r else "" for r in valori]] if valori else [] for valori in risultati
+            ]
+        return risultati
+
+    def _scrivi(self, a1, valori):
+        r0, c0 = a1_to_rowcol(a1.split(":")[0])
+        for i, riga in enumerate(valori):
+            while len(self.righe) < r0 + i:
+                self.righe.append([])
+            destinazione = self.righe[r0 + i - 1]
+            for j, valore in enumerate(riga):
+                while len(destinazione) < c0 + j:
+                    destinazione.append("")
+                destinazione[c0 + j - 1] = str(valore)
+
+    def update(self, values=None, range_name=None, **kwargs):
+        self._chiamata()
+        self._scrivi(range_name or "A1", values)
+
+    def batch_update(self, dati, **kwargs):
+        self._chiamata()
+        for voce in dati:
+            self._scrivi(voce["range"], voce["values"])
+
+    def append_rows(self, valori, **kwargs):
+        self._chiamata()
+        self.righe.extend([str(v) for v in r] for r in valori)
+        return {"updates": {"updatedRange": f"A{len(self.righe) - len(valori) + 1}:A{len(self.righe)}"}}
+
+    def clear(self):
+        self._chiamata()
+        self.righe = []
+
+
+def synthetic_activities(n, seed=0):
+    """Tabella attività sintetica con n righe, tipizzata come da load_data."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "ID": np.arange(1, n + 1),
+        "NomeUtente": rng.choice(["anna", "bob", "carla", "dario"], n),
+        "Data": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365 * 24 * 60, n), unit="min"),
+        "MacroAttivita": rng.choice(["LABORATORIO", "ANALISI DATI", "FORMAZIONE"], n),
+        "Tipologia": rng.choice(["Lavoro al bancone", "Refertazione"], n),
+        "Attivita": rng.choice(["Estrazione DNA", "PCR", "Blot"], n),
+        "Note": [f"nota {i}" for i in range(n)],
+        "Ore": rng.integers(0, 8, n),
+        "Minuti": rng.integers(0, 60, n),
+        "NumCampioni": rng.integers(0, 20, n),
+        "TipoMalattia": "",
+        "NumReferti": 0,
+        "TipoMalattiaRef": "",
+        "Versione": 1,
+    })
+
+
+def edited_copy(df, seed=1):
+    """Copia di df con l'1% delle righe modificate (metà senza data), eliminate e aggiunte."""
+    rng = np.random.default_rng(seed)
+    k = max(len(df) // 100, 1)
+    df = df.copy()
+    modificate = rng.choice(df.index, k, replace=False)
+    df.loc[modificate, "Note"] = "modificata"
+    df.loc[modificate[: k // 2], "Data"] = pd.NaT
+    df = df.drop(index=rng.choice(df.index.difference(modificate), k, replace=False))
+    nuove = synthetic_activities(k, seed).assign(ID=np.arange(k) + df["ID"].max() + 1)
+    return pd.concat([df, nuove], ignore_index=True)
+
+
+def legacy_merge(existing_data, df):
+    """Il ciclo di save_data prima di merge_rows, per confronto."""
+    updated = existing_data.copy()
+    for _, row in df.iterrows():
+        mask = updated["ID"] == row["ID"]
+        if mask.any():
+            for col in df.columns:
+                if col == "Data":
+                    if pd.isna(row["Data"]) or str(row["Data"]).strip() == "":
+                        continue
+                    else:
+                        updated.loc[mask, col] = row[col]
+                else:
+                    updated.loc[mask, col] = row[col]
+        else:
+            updated = pd.concat([updated, pd.DataFrame([row])], ignore_index=True)
+    return updated[updated["ID"].isin(df["ID"])]
+
+
+def timed(funzione, *args):
+    inizio = time.perf_counter()
+    risultato = funzione(*args)
+    return time.perf_counter() - inizio, risultato
+
+
+def legacy_search(df, termine):
+    """Il filtro di ricerca prima dell'indice, per confronto."""
+    return df[df.apply(lambda row: row.astype(str).str.contains(termine, case=False).any(), axis=1)]
+
+
+def bench_merge(dimensioni):
+    print(f"{'righe':>9} {'merge_rows s':>13} {'µs/riga':>8} {'iterrows s':>11}")
+    for n in dimensioni:
+        existing = synthetic_activities(n)
+        df = edited_copy(existing)
+        secondi, merged = timed(merge_rows, existing, df)
+        assert len(merged) == len(df)
+        ciclo = ""
+        if n <= LIMITE_CICLO:
+            secondi_ciclo, atteso = timed(legacy_merge, existing, df)
+            pd.testing.assert_frame_equal(
+                merged.reset_index(drop=True), atteso.reset_index(drop=True), check_dtype=False
+            )
+            ciclo = f"{secondi_ciclo:11.3f}"
+        print(f"{n:>9} {secondi:13.4f} {secondi / n * 1e6:8.2f} {ciclo}")
+
+
+def bench_search(dimensioni, query="estrazione nota 12"):
+    print(f"{'righe':>9} {'indice s':>9} {'query ms':>9} {'apply s':>8}")
+    for n in dimensioni:
+        df = synthetic_activities(n)
+        secondi_indice, indice = timed(build_search_index, df)
+        secondi_query, mask = timed(search_mask, indice, query)
+        vecchio = ""
+        if n <= LIMITE_CICLO:
+            vecchio = f"{timed(legacy_search, df, 'nota 12')[0]:8.3f}"
+        print(f"{n:>9} {secondi_indice:9.3f} {secondi_query * 1000:9.1f} {vecchio}")
+
+
+def raw_totals(df, inizio, fine):
+    """KPI di un periodo calcolati sulle righe, come prima del rollup."""
+    periodo = df[df["Data"].notna() & (df["Data"].dt.date >= inizio) & (df["Data"].dt.date <= fine)]
+    return periodo["Ore"].sum() + periodo["Minuti"].sum() / 60, periodo["NumCampioni"].sum(), periodo["NumReferti"].sum()
+
+
+def bench_rollup(dimensioni):
+    inizio, fine = pd.Timestamp("2024-03-01").date(), pd.Timestamp("2024-06-30").date()
+    print(f"{'righe':>9} {'gruppi':>7} {'gruppi KPI':>11} {'build s':>8} {'update ms':>10} {'KPI ms':>7} {'KPI righe ms':>13}")
+    for n in dimensioni:
+        df = synthetic_activities(n)
+        secondi_build, rollup = timed(build_rollup, df)
+        rollup_kpi = rollup_by(rollup, CHIAVI_KPI)
+        modificata = df.iloc[[n // 2]].assign(Ore=7)
+        secondi_update, _ = timed(update_rollup, rollup, df.iloc[[n // 2]], modificata)
+        secondi_kpi, kpi = timed(lambda: totals(filter_rollup(rollup_kpi, start_date=inizio, end_date=fine)))
+        secondi_righe, atteso = timed(raw_totals, df, inizio, fine)
+        assert np.isclose(kpi[0], atteso[0]) and kpi[1:] == tuple(int(v) for v in atteso[1:])
+        print(f"{n:>9} {len(rollup):>7} {len(rollup_kpi):>11} {secondi_build:8.3f} {secondi_update * 1000:10.1f} "
+              f"{secondi_kpi * 1000:7.1f} {secondi_righe * 1000:13.1f}")
+
+
+def bench_memory(dimensioni):
+    print(f"{'righe':>9} {'object MB':>10} {'tipizzato MB':>13} {'rapporto':>9} {'groupby obj ms':>15} {'groupby cat ms':>15}")
+    for n in dimensioni:
+        grezzo = synthetic_activities(n)
+        testo = grezzo.select_dtypes(exclude="number").columns.drop("Data")
+        grezzo[testo] = grezzo[testo].astype(object)
+        grezzo[grezzo.select_dtypes("number").columns] = grezzo.select_dtypes("number").astype("int64")
+        tipizzato = apply_schema(grezzo.copy())
+        prima, dopo = memory_report(grezzo)["Totale"], memory_report(tipizzato)["Totale"]
+        chiavi = ["NomeUtente", "MacroAttivita", "Attivita"]
+        ms_obj = timed(lambda: grezzo.groupby(chiavi)["Ore"].sum())[0] * 1000
+        ms_cat = timed(lambda: tipizzato.groupby(chiavi, observed=True)["Ore"].sum())[0] * 1000
+        print(f"{n:>9} {prima / 2**20:10.1f} {dopo / 2**20:13.1f} {dopo / prima:9.2f} {ms_obj:15.1f} {ms_cat:15.1f}")
+
+
+def bench_bulk_entry(n=100):
+    base = synthetic_activities(1_000)
+    righe = synthetic_activities(n, seed=2).assign(ID=np.arange(n) + len(base) + 1)
+    print(f"{'modalità':>10} {'righe':>6} {'chiamate':>9} {'s':>7} {'righe/s':>8}   (latenza {LATENZA_API * 1000:.0f} ms/chiamata)")
+    for modalita in ("singole", "multiplo"):
+        foglio = MemoryWorksheet([COLONNE_ATTIVITA])
+        inizio = time.perf_counter()
+        if modalita == "singole":
+            for i in range(n):
+                append_sheet_rows(foglio, base, righe.iloc[[i]])
+        else:
+            append_sheet_rows(foglio, base, righe)
+        secondi = time.perf_counter() - inizio
+        assert len(foglio.righe) == n + 1
+        print(f"{modalita:>10} {n:>6} {foglio.chiamate:>9} {secondi:7.2f} {n / secondi:8.0f}")
+
+
+def realistic_activities(n, seed=0, utenti=20):
+    """Tabella attività di n righe con terne prese dalla tassonomia dell'app: campioni e
+    malattia solo per l'accettazione, referti solo per la refertazione, note sul 30% delle righe."""
+    rng = np.random.default_rng(seed)
+    terne = taxonomy_triples(macro_tipologia_attivita).to_frame(index=False)
+    terne = terne.iloc[rng.integers(0, len(terne), n)].reset_index(drop=True)
+    accettazione = terne["MacroAttivita"].eq("ACCETTAZIONE").to_numpy()
+    refertazione = terne["MacroAttivita"].eq("REFERTAZIONE").to_numpy()
+    note = np.array(["", "urgente", "da ricontrollare", "campione in ritardo", "richiesta del medico"])
+    return pd.DataFrame({
+        "ID": np.arange(1, n + 1),
+        "NomeUtente": np.char.add("utente", rng.integers(1, utenti + 1, n).astype(str)),
+        "Data": pd.Timestamp("2023-01-01") + pd.to_timedelta(rng.integers(0, 3 * 365 * 24 * 60, n), unit="min"),
+        **terne,
+        "Note": np.where(rng.random(n) < 0.3, note[rng.integers(1, len(note), n)], ""),
+        "Ore": rng.integers(0, 8, n),
+        "Minuti": rng.choice([0, 15, 30, 45], n),
+        "NumCampioni": np.where(accettazione, rng.integers(1, 30, n), 0),
+        "TipoMalattia": np.where(accettazione, rng.choice(tipi_malattia, n), ""),
+        "NumReferti": np.where(refertazione, rng.integers(1, 10, n), 0),
+        "TipoMalattiaRef": np.where(refertazione, rng.choice(tipi_malattia, n), ""),
+        "Versione": 1,
+    })
+
+
+def dashboard_aggregations(rollup, kpi, utente, inizio, fine):
+    """Le aggregazioni di ogni pagina con grafici, come le calcola app.py, per nome di pagina.
+
+    kpi è il rollup giorno × utente usato per totali e intervalli di date.
+    """
+    def riepilogo_utente():
+        mio = filter_rollup(kpi, utente=utente)
+        date_range(mio)
+        totals(filter_rollup(mio, start_date=inizio, end_date=fine))
+        periodo = filter_rollup(rollup, utente=utente, start_date=inizio, end_date=fine)
+        sum_by(periodo, "MacroAttivita", "Ore")
+        count_by(periodo[periodo["MacroAttivita"] == "REFERTAZIONE"], "Tipologia")
+
+    def dashboard_capo():
+        totals(kpi)
+        date_range(kpi)
+        totals(filter_rollup(kpi, start_date=inizio, end_date=fine))
+        periodo = filter_rollup(rollup, start_date=inizio, end_date=fine)
+        referti = periodo[periodo["MacroAttivita"] == "REFERTAZIONE"]
+        count_by(referti, "Tipologia")
+        count_by(referti, "TipoMalattiaRef", "Malattia")
+        sum_by(periodo, ["MacroAttivita", "NomeUtente"], "OreTot")
+        count_by(periodo[periodo["MacroAttivita"] == "ACCETTAZIONE"], "TipoMalattia", "Malattia")
+
+    def monitoraggio_utente():
+        grafici = filter_rollup(rollup, utente=utente, start_date=inizio, end_date=fine)
+        totals(filter_rollup(kpi, utente=utente, start_date=inizio, end_date=fine))
+        sum_by(grafici, "MacroAttivita", "Ore")
+        count_by(grafici[grafici["MacroAttivita"] == "REFERTAZIONE"], "Tipologia")
+        count_by(grafici[grafici["MacroAttivita"] == "ACCETTAZIONE"], "TipoMalattia", "Malattia")
+
+    def monitoraggio_malattia():
+        filtro = rollup[(rollup["TipoMalattia"] == tipi_malattia[0]) | (rollup["TipoMalattiaRef"] == tipi_malattia[0])]
+        sum_by(filtro, "NomeUtente", "NumReferti")
+        sum_by(filtro, "NomeUtente", "NumCampioni")
+
+    return {
+        "home_utente": lambda: totals(filter_rollup(kpi, utente=utente)),
+        "riepilogo_utente": riepilogo_utente,
+        "dashboard_capo": dashboard_capo,
+        "monitoraggio_utente": monitoraggio_utente,
+        "monitoraggio_malattia": monitoraggio_malattia,
+    }
+
+
+def run_suite(dimensioni):
+    """Misure della suite, una voce per dimensione e operazione: secondi (il migliore su
+    più ripetizioni per le tabelle piccole) e chiamate al foglio."""
+    risultati = []
+
+    def misura(n, operazione, funzione, foglio=None, ripetizioni=1):
+        migliori, chiamate = None, 0
+        for _ in range(ripetizioni):
+            prima = foglio.chiamate if foglio is not None else 0
+            secondi, risultato = timed(funzione)
+            chiamate = foglio.chiamate - prima if foglio is not None else 0
+            migliori = secondi if migliori is None else min(migliori, secondi)
+        risultati.append({"righe": n, "operazione": operazione, "secondi": migliori, "chiamate": chiamate})
+        print(f"{n:>9} {operazione:<34} {migliori * 1000:11.1f} {chiamate:>9}")
+        return risultato
+
+    print(f"{'righe':>9} {'operazione':<34} {'ms':>11} {'chiamate':>9}")
+    for n in dimensioni:
+        ripetizioni = 3 if n <= 10_000 else 1
+        tabella = realistic_activities(n)
+        foglio = MemoryWorksheet([COLONNE_ATTIVITA] + to_sheet_rows(tabella, COLONNE_ATTIVITA), latenza=0)
+        del tabella
+
+        base = misura(n, "load_data", lambda: load_data(foglio), foglio, ripetizioni)
+        stato = len(base)   # nessuna riga eliminata nel foglio di prova
+        misura(n, "sync_data (nessuna modifica)", lambda: sync_data(foglio, base, stato), foglio, ripetizioni)
+
+        # save_data: merge delle righe modificate e scrittura delle sole differenze (1% modificate,
+        # eliminate e aggiunte); una sola ripetizione perché modifica il foglio
+        modificata = edited_copy(base)
+        def salva():
+            aggiornata = merge_rows(base, modificata)
+            aggiornata["Data"] = parse_dates(aggiornata["Data"])
+            return write_delta(foglio, base, aggiornata)
+        base = misura(n, "save_data (1% delle righe)", salva, foglio)
+        # le righe eliminate restano sul foglio, con la versione negativa
+        assert len(foglio.righe) - 1 - max(n // 100, 1) == len(base) == len(modificata)
+
+        nuove = realistic_activities(100, seed=3).assign(ID=np.arange(100) + int(base["ID"].max()) + 1)
+        misura(n, "append_data (100 righe)", lambda: append_sheet_rows(foglio, base, nuove), foglio)
+
+        indice = misura(n, "ricerca: indice", lambda: build_search_index(base), ripetizioni=ripetizioni)
+        misura(n, "ricerca: query", lambda: search_mask(indice, "campione ritardo"), ripetizioni=ripetizioni)
+
+        rollup = misura(n, "rollup", lambda: build_rollup(base), ripetizioni=ripetizioni)
+        kpi = misura(n, "rollup KPI (giorno × utente)", lambda: rollup_by(rollup, CHIAVI_KPI), ripetizioni=ripetizioni)
+        modificate = base.sample(3, random_state=0)
+        misura(
+            n, "rollup: aggiornamento (3 righe)",
+            lambda: update_rollup(rollup, modificate, modificate.assign(Ore=7)), ripetizioni=ripetizioni,
+        )
+        for pagina, aggrega in dashboard_aggregations(rollup, kpi, "utente1", "2024-01-01", "2024-06-30").items():
+            misura(n, f"dashboard: {pagina}", aggrega, ripetizioni=ripetizioni)
+        del base, foglio, indice, rollup, kpi
+    return risultati
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(risultati, percorso):
+    """Risultati della suite in JSON, con l'ambiente in cui sono stati misurati."""
+    documento = {
+        "data": pd.Timestamp.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "piattaforma": platform.platform(),
+        "risultati": risultati,
+    }
+    with open(percorso, "w", encoding="utf-8") as f:
+        json.dump(documento, f, indent=2, ensure_ascii=False)
+
+
+def main(dimensioni):
+    bench_merge(dimensioni)
+    print()
+    bench_search(dimensioni)
+    print()
+    bench_rollup(dimensioni)
+    print()
+    bench_memory(dimensioni)
+    print()
+    bench_bulk_entry()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark delle operazioni sulla tabella attività")
+    parser.add_argument("righe", nargs="*", type=int, help="dimensioni delle tabelle")
+    parser.add_argument("--suite", action="store_true", help="suite su foglio in memoria con tabelle realistiche")
+    parser.add_argument("--json", help="file JSON in cui scrivere i risultati della suite")
+    argomenti = parser.parse_args()
+    if argomenti.suite or argomenti.json:
+        risultati = run_suite(argomenti.righe or [1_000, 10_000, 100_000, 1_000_000])
+        if argomenti.json:
+            write_results(risultati, argomenti.json)
+    else:
+        main(argomenti.righe or [1_000, 5_000, 10_000, 100_000, 200_000])
@@ -0,0 +1,304 @@
+"""Cache condivise da tutte le sessioni del processo: tabella attività e anagrafica utenti.
+
+ActivityCache tiene l'ultimo ActivitySnapshot e lo sincronizza con lo store in un thread
+in background; le pagine leggono sempre lo snapshot, senza accessi in rete. UserDirectory
+tiene gli utenti in un dizionario, riletto dallo store allo scadere del TTL.
+"""
+import threading
+import time
+
+import pandas as pd
+
+from rollups import CHIAVI_KPI, build_rollup, changed_rows, rollup_by, update_rollup
+from search import build_search_index
+from storage import COLONNA_VERSIONE, COLONNE_UTENTI, upsert_rows
+
+CACHE_TTL = 60               # secondi fra due sincronizzazioni; "cache_ttl" nei secrets
+RICARICA_COMPLETA = 30 * 60  # secondi; la rilettura completa coglie anche le modifiche fatte a mano sullo Sheet
+
+
+class ActivitySnapshot:
+    """Versione immutabile della tabella attività.
+
+    Le pagine leggono il frame con view(), una copia superficiale che grazie al copy-on-write
+    di pandas (sempre attivo da pandas 3) non duplica i dati e non può modificare lo snapshot,
+    oppure con of_user, che seleziona per posizione le sole righe dell'utente. Rollup (dei
+    grafici e dei KPI), indice di ricerca e posizioni per utente sono calcolati una sola volta
+    per versione, al primo uso.
+    """
+
+    def __init__(self, df, versione, rollup=None, kpi=None):
+        self._df = df
+        self.versione = versione
+        self._lock = threading.Lock()
+        self._rollup = rollup
+        self._kpi = kpi
+        self._indice = None
+        self._posizioni = None   # NomeUtente → posizioni delle sue righe
+
+    def view(self):
+        return self._df.copy(deep=False)
+
+    def of_user(self, utente):
+        """Righe di un utente, selezionate per posizione senza scorrere tutta la tabella."""
+        with self._lock:
+            if self._posizioni is None:
+                self._posizioni = self._df.groupby("NomeUtente", observed=True, sort=False).indices
+        posizioni = self._posizioni.get(utente)
+        return self._df.take(posizioni) if posizioni is not None else self._df.iloc[:0]
+
+    @property
+    def rollup(self):
+        with self._lock:
+            if self._rollup is None:
+                self._rollup = build_rollup(self._df)
+            return self._rollup
+
+    @property
+    def kpi(self):
+        """Rollup giorno × utente, per totali e intervalli di date."""
+        rollup = self.rollup
+        with self._lock:
+            if self._kpi is None:
+                self._kpi = rollup_by(rollup, CHIAVI_KPI)
+            return self._kpi
+
+    @property
+    def search_index(self):
+        with self._lock:
+            if self._indice is None:
+                self._indice = build_search_index(self._df)
+            return self._indice
+
+
+class ActivityCache:
+    """Snapshot della tabella attività condiviso da tutte le sessioni del processo.
+
+    Solo la prima lettura avviene durante una richiesta: poi un thread in background si
+    sincronizza ogni ttl secondi in modo incrementale (solo le righe nuove), con una
+    rilettura completa ogni RICARICA_COMPLETA secondi o dopo invalidate, e pubblica un nuovo
+    ActivitySnapshot (con il rollup già pronto) in un colpo solo. Solo le riletture complete
+    ricostruiscono i rollup; le sincronizzazioni incrementali e le scritture di qualsiasi
+    sessione (patch) li aggiornano con le sole righe cambiate.
+
+    Con uno snapshot locale (LocalSnapshot) la prima lettura viene dal disco e la
+    sincronizzazione con lo store parte subito in background; dopo ogni sincronizzazione
+    riuscita lo snapshot su disco viene riscritto, se i dati sono cambiati.
+    """
+
+    def __init__(self, ttl=CACHE_TTL, ricarica_completa=RICARICA_COMPLETA, locale=None):
+        self.ttl = ttl
+        self.ricarica_completa = ricarica_completa
+        self.locale = locale
+        self.versione = 0
+        self.errore = None       # ultimo errore del thread di aggiornamento
+        self._lock = threading.Lock()
+        self._sveglia = threading.Event()
+        self._thread = None
+        self._store = None
+        self._snapshot = None
+        self._stato = None       # stato di sincronizzazione restituito dallo store
+        self._completo = 0.0
+        self._salvata = None     # versione scritta nello snapshot locale
+
+    def _publish(self, df, rollup=None, kpi=None):
+        self.versione += 1
+        self._snapshot = ActivitySnapshot(df, self.versione, rollup, kpi)
+        return self._snapshot
+
+    def get(self, store):
+        """Snapshot attuale, senza accessi in rete dopo la prima lettura."""
+        with self._lock:
+            self._store = store
+            if self._snapshot is None:
+                locale = self.locale.load_activities(type(store).__name__) if self.locale else None
+                if locale is not None:
+                    # 🔹 Avvio dal disco: la sincronizzazione con lo store parte subito in background
+                    df, self._stato = locale
+                    self._salvata = self._publish(df).versione
+                    self._sveglia.set()
+                else:
+                    df, self._stato = store.sync()
+                    self._save(self._publish(df), self._stato)
+                self._completo = time.monotonic()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._aggiorna, name="activity-refresher", daemon=True)
+                self._thread.start()
+            return self._snapshot
+
+    def refresh(self):
+        """Una sincronizzazione: lettura e rollup fuori dal lock, lo scambio sotto lock."""
+        with self._lock:
+            store, stato, versione = self._store, self._stato, self.versione
+            df = self._snapshot._df if self._snapshot is not None else None
+            rollup, kpi = (self._snapshot._rollup, self._snapshot._kpi) if df is not None else (None, None)
+            completa = df is None or time.monotonic() - self._completo > self.ricarica_completa
+        inizio = time.monotonic()
+        nuovo, stato = store.sync(None if completa else df, None if completa else stato)
+        if nuovo is not df:
+            rollup, kpi = self._rollups(df, nuovo, None if completa else rollup, None if completa else kpi)
+        with self._lock:
+            # 🔹 Se nel frattempo una sessione ha scritto, lo snapshot patchato resta valido:
+            # il risultato si scarta e si riprova al giro successivo
+            if self.versione != versione:
+                return
+            if completa:
+                self._completo = inizio
+            self._stato = stato
+            if nuovo is not df:
+                self._publish(nuovo, rollup, kpi)
+            snapshot = self._snapshot if self._snapshot.versione != self._salvata else None
+        if snapshot is not None:
+            self._save(snapshot, stato)
+
+    @staticmethod
+    def _rollups(vecchio, nuovo, rollup, kpi):
+        """Rollup di nuovo: aggiornati con le righe cambiate rispetto a vecchio se ci sono già,
+        altrimenti ricostruiti da tutta la tabella."""
+        if rollup is None or kpi is None or not (
+            COLONNA_VERSIONE in vecchio.columns and COLONNA_VERSIONE in nuovo.columns
+        ):
+            rollup = build_rollup(nuovo)
+            return rollup, rollup_by(rollup, CHIAVI_KPI)
+        rimosse, aggiunte = changed_rows(vecchio, nuovo)
+        return update_rollup(rollup, rimosse, aggiunte), update_rollup(kpi, rimosse, aggiunte, CHIAVI_KPI)
+
+    def _save(self, snapshot, stato):
+        """Scrive lo snapshot su disco; un errore non interrompe l'app, resta in self.errore."""
+        if self.locale is None:
+            return
+        try:
+            self.locale.save_activities(snapshot._df, stato, type(self._store).__name__)
+            self._salvata = snapshot.versione
+        except Exception as e:
+            self.errore = e
+
+    def _aggiorna(self):
+        while True:
+            self._sveglia.wait(self.ttl)
+            self._sveglia.clear()
+            try:
+                self.refresh()
+                self.errore = None
+            except Exception as e:
+                # Si continua a servire l'ultimo snapshot valido
+                self.errore = e
+
+    def patch(self, righe, eliminati=()):
+        """Pubblica uno snapshot con le righe scritte (per ID) e senza quelle eliminate."""
+        with self._lock:
+            if self._snapshot is None:
+                return None
+            vecchio = self._snapshot._df
+            df = upsert_rows(vecchio, righe, eliminati)
+            rollup, kpi = self._snapshot._rollup, self._snapshot._kpi
+            if rollup is not None or kpi is not None:
+                # 🔹 Si tolgono dai rollup le versioni precedenti e si aggiungono le nuove
+                toccate = vecchio["ID"].isin(righe["ID"]) | vecchio["ID"].isin(eliminati)
+                if rollup is not None:
+                    rollup = update_rollup(rollup, vecchio[toccate], righe)
+                if kpi is not None:
+                    kpi = update_rollup(kpi, vecchio[toccate], righe, CHIAVI_KPI)
+            return self._publish(df, rollup, kpi)
+
+    def invalidate(self):
+        """Chiede al thread una rilettura completa immediata; intanto resta l'ultimo snapshot."""
+        with self._lock:
+            self._completo = 0.0
+            self.versione += 1
+        self._sveglia.set()
+
+
+UTENTI_TTL = 5 * 60   # secondi prima di rileggere il foglio Utenti; "utenti_ttl" nei secrets
+
+
+class UserDirectory:
+    """Utenti del processo in un dizionario NomeUtente → campi (Password, Ruolo, ...).
+
+    Il foglio Utenti viene letto alla prima richiesta e poi solo allo scadere del TTL o dopo
+    invalidate; le modifiche fatte dall'app aggiornano subito il dizionario con update, così
+    tutte le sessioni vedono la nuova password senza rileggere il foglio. Con uno snapshot
+    locale la prima lettura viene dal disco e il foglio si rilegge subito in background; lo
+    snapshot non contiene le password, quindi lookup aspetta la rilettura se non è ancora finita.
+    """
+
+    def __init__(self, store, ttl=UTENTI_TTL, locale=None):
+        self.store = store
+        self.ttl = ttl
+        self.locale = locale
+        self._lock = threading.Lock()
+        self._utenti = None
+        self._letto = 0.0
+        self._avvio = locale is not None   # lo snapshot su disco si usa solo alla prima lettura
+        self._password = False             # False se l'anagrafica viene dallo snapshot, senza password
+
+    def _set(self, df):
+        # Valori come testo: get_all_records trasforma in numeri le password di sole cifre
+        self._utenti = {
+            str(r["NomeUtente"]): {k: str(v) for k, v in r.items() if k != "NomeUtente"}
+            for r in df.to_dict("records")
+        }
+        self._password = "Password" in df.columns
+        self._letto = time.monotonic()
+
+    def _save(self):
+        if self.locale is None:
+            return
+        try:
+            self.locale.save_users(_users_frame(self._utenti))
+        except Exception:
+            pass   # lo snapshot è solo un'accelerazione: l'anagrafica valida resta in memoria
+
+    def _reload(self):
+        try:
+            df = self.store.load_utenti()
+        except Exception:
+            return   # resta la copia del disco fino allo scadere del TTL
+        with self._lock:
+            self._set(df)
+            self._save()
+
+    def users(self):
+        with self._lock:
+            if self._avvio:
+                self._avvio = False
+                df = self.locale.load_users()
+                if df is not None:
+                    self._set(df)
+                    threading.Thread(target=self._reload, name="users-refresher", daemon=True).start()
+            if self._utenti is None or time.monotonic() - self._letto > self.ttl:
+                self._set(self.store.load_utenti())
+                self._save()
+            return self._utenti
+
+    def lookup(self, nome):
+        """Campi dell'utente, password compresa, o None se non esiste."""
+        utenti = self.users()
+        with self._lock:
+            if not self._password:
+                self._set(self.store.load_utenti())
+                self._save()
+                utenti = self._utenti
+        return utenti.get(nome)
+
+    def frame(self):
+        """Anagrafica come DataFrame con le colonne del foglio Utenti."""
+        return _users_frame(self.users())
+
+    def update(self, nome, **campi):
+        """Riporta nel dizionario una modifica appena salvata."""
+        with self._lock:
+            if self._utenti is not None:
+                self._utenti[nome] = {**self._utenti.get(nome, {}), **campi}
+                self._save()
+
+    def invalidate(self):
+        with self._lock:
+            self._utenti = None
+
+def _users_frame(utenti):
+    df = pd.DataFrame(
+        [{"NomeUtente": nome, **campi} for nome, campi in utenti.items()],
+        columns=COLONNE_UTENTI,
+    )
+    return df.fillna({"Attivo": "1"})
@@ -0,0 +1,35 @@
+"""Cancella dai fogli attività dello Sheet le righe eliminate dall'app (Versione negativa).
+
+Uso: python compact_deleted.py service_account.json [NomeSheet] [--dry-run]
+
+L'app non cancella mai fisicamente le righe, così il numero di riga di un'attività non
+cambia mentre altri scrivono: le righe eliminate restano con la versione negativa e vengono
+ignorate in lettura. Questo script le toglie da tutti i fogli con le colonne ID e Versione
+(anche le partizioni). Da eseguire ad app ferma; con --dry-run conta solo le righe.
+"""
+import json
+import sys
+
+from storage import COLONNA_VERSIONE, SheetsConnection, compact_deleted
+
+SHEET_NAME = "GestionaleLavoro"
+
+
+def main(argv):
+    dry_run = "--dry-run" in argv
+    argomenti = [a for a in argv if a != "--dry-run"]
+    if not 1 <= len(argomenti) <= 2:
+        sys.exit("uso: python compact_deleted.py <service_account.json> [NomeSheet] [--dry-run]")
+    with open(argomenti[0]) as f:
+        connessione = SheetsConnection(json.load(f))
+    sheet_name = argomenti[1] if len(argomenti) > 1 else SHEET_NAME
+
+    azione = "da cancellare" if dry_run else "cancellate"
+    for foglio in connessione.spreadsheet(sheet_name).worksheets():
+        intestazione = foglio.row_values(1)
+        if "ID" in intestazione and COLONNA_VERSIONE in intestazione:
+            print(f"{foglio.title}: {compact_deleted(foglio, dry_run=dry_run)} righe {azione}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,139 @@
+"""Esportazione delle attività in CSV, Excel (XLSX) e Parquet.
+
+I file vengono scritti a blocchi di RIGHE_PER_BLOCCO righe in un file temporaneo, senza
+costruire tutto il risultato in memoria, e solo quando vengono chiesti. ExportCache tiene
+gli ultimi file generati per versione dei dati, filtro e formato: ripetere la stessa
+esportazione legge il file già pronto. Il download invece non è a blocchi: st.download_button
+tiene comunque in memoria tutto il contenuto, quindi get restituisce il file intero.
+"""
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from storage import stored_columns
+
+RIGHE_PER_BLOCCO = 50_000
+ESPORTAZIONI_MAX = 16         # file tenuti in cache
+RIGHE_MAX_EXCEL = 1_048_575   # limite di righe di un foglio Excel, intestazione esclusa
+
+# formato → (estensione, tipo MIME)
+FORMATI = {
+    "CSV": ("csv", "text/csv"),
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+
+def _chunks(df, righe_per_blocco):
+    for inizio in range(0, len(df), righe_per_blocco):
+        yield df.iloc[inizio:inizio + righe_per_blocco]
+
+
+def write_export(df, formato, percorso, righe_per_blocco=RIGHE_PER_BLOCCO):
+    """Scrive le colonne salvate di df nel file indicato, a blocchi."""
+    df = df[stored_columns(df)]
+    if formato == "CSV":
+        _write_csv(df, percorso, righe_per_blocco)
+    elif formato == "Excel":
+        _write_xlsx(df, percorso, righe_per_blocco)
+    elif formato == "Parquet":
+        _write_parquet(df, percorso, righe_per_blocco)
+    else:
+        raise ValueError(f"formato di esportazione sconosciuto: {formato}")
+
+
+def _write_csv(df, percorso, righe_per_blocco):
+    with open(percorso, "w", encoding="utf-8", newline="") as f:
+        if df.empty:
+            df.to_csv(f, index=False)
+        for i, blocco in enumerate(_chunks(df, righe_per_blocco)):
+            blocco.to_csv(f, index=False, header=i == 0)
+
+
+def _write_xlsx(df, percorso, righe_per_blocco):
+    try:
+        from openpyxl import Workbook
+    except ImportError as e:
+        raise ImportError("per esportare in Excel serve il pacchetto openpyxl") from e
+    if len(df) > RIGHE_MAX_EXCEL:
+        raise ValueError(f"troppe righe per un file Excel ({len(df)}): usare CSV o Parquet")
+    # write_only: le righe vengono scritte in streaming, senza tenere il foglio in memoria
+    libro = Workbook(write_only=True)
+    foglio = libro.create_sheet("Attivita")
+    foglio.append(list(df.columns))
+    for blocco in _chunks(df, righe_per_blocco):
+        blocco = blocco.astype(object)
+        for riga in blocco.where(blocco.notna(), None).itertuples(index=False):
+            foglio.append(list(riga))
+    libro.save(percorso)
+
+
+def _write_parquet(df, percorso, righe_per_blocco):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("per esportare in Parquet serve il pacchetto pyarrow") from e
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    # 🔹 Un row group per blocco: la tabella Arrow non viene mai costruita tutta insieme
+    with pq.ParquetWriter(percorso, schema) as scrittore:
+        for blocco in _chunks(df, righe_per_blocco):
+            scrittore.write_table(pa.Table.from_pandas(blocco, schema=schema, preserve_index=False))
+
+
+class ExportCache:
+    """Ultimi file esportati, uno per chiave (versione dei dati, filtro) e formato.
+
+    get genera il file solo se non è già in cache; i file più vecchi oltre max_file
+    vengono cancellati. Thread-safe: la cache è condivisa tra le sessioni.
+    """
+
+    def __init__(self, max_file=ESPORTAZIONI_MAX, cartella=None):
+        self.max_file = max_file
+        self.cartella = cartella or tempfile.mkdtemp(prefix="esportazioni_")
+        self._lock = threading.Lock()
+        self._file = OrderedDict()   # (chiave, formato) → percorso
+
+    def get(self, chiave, formato, dati):
+        """Contenuto (bytes) del file esportato; dati è una funzione che restituisce il DataFrame."""
+        voce = (chiave, formato)
+        with self._lock:
+            percorso = self._file.get(voce)
+            if percorso is not None:
+                self._file.move_to_end(voce)
+        if percorso is not None:
+            try:
+                return _read(percorso)
+            except FileNotFoundError:
+                pass   # eliminato da un'altra sessione nel frattempo: si rigenera
+
+        # 🔹 Generato fuori dal lock: le altre esportazioni non aspettano
+        fd, percorso = tempfile.mkstemp(suffix="." + FORMATI[formato][0], dir=self.cartella)
+        os.close(fd)
+        try:
+            write_export(dati(), formato, percorso)
+            contenuto = _read(percorso)
+        except Exception:
+            os.remove(percorso)
+            raise
+        with self._lock:
+            if voce in self._file:
+                os.remove(percorso)   # generato anche da un'altra sessione
+            else:
+                self._file[voce] = percorso
+                while len(self._file) > self.max_file:
+                    _, vecchio = self._file.popitem(last=False)
+                    os.remove(vecchio)
+        return contenuto
+
+    def clear(self):
+        with self._lock:
+            for percorso in self._file.values():
+                os.remove(percorso)
+            self._file.clear()
+
+
+def _read(percorso):
+    with open(percorso, "rb") as f:
+        return f.read()
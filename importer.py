@@ -0,0 +1,153 @@
+"""Importazione di attività storiche da file CSV o Excel (XLSX).
+
+Il file viene letto a blocchi di RIGHE_PER_BLOCCO righe, senza caricarlo tutto in memoria.
+Per ogni blocco le date sono decodificate in modo vettoriale (ISO 8601 o giorno/mese/anno,
+mai il formato storico dello Sheet), le righe controllate con validation.check_activities,
+i duplicati scartati e le righe valide scritte con un solo append, con ID nuovi presi in
+blocco dall'allocatore dello store.
+
+import_activities è un generatore che restituisce l'avanzamento dopo ogni blocco scritto:
+se un blocco fallisce, l'importazione si riprende passando riprendi_da = l'ultimo valore
+di "completate". I duplicati (stesso ID o stessa attività già presente) vengono scartati,
+quindi anche reimportare lo stesso file non crea doppioni.
+"""
+import pandas as pd
+
+from storage import COLONNE_ATTIVITA, COLONNE_NUMERICHE, format_dates
+from validation import check_activities
+
+RIGHE_PER_BLOCCO = 5_000
+COLONNE_IMPORTATE = [c for c in COLONNE_ATTIVITA if c not in ("ID", "Versione")]
+# Colonne che identificano un'attività indipendentemente dall'ID
+CHIAVE_DUPLICATI = ["NomeUtente", "Data", "MacroAttivita", "Tipologia", "Attivita", "Note", "Ore", "Minuti"]
+
+
+def read_chunks(file, nome_file, righe_per_blocco=RIGHE_PER_BLOCCO):
+    """Blocchi di righe del file come DataFrame, con le intestazioni del file."""
+    if nome_file.lower().endswith(".xlsx"):
+        yield from _xlsx_chunks(file, righe_per_blocco)
+    else:
+        yield from pd.read_csv(
+            file, sep=_separator(file), dtype=str, keep_default_na=False,
+            encoding="utf-8-sig", chunksize=righe_per_blocco,
+        )
+
+
+def _separator(file):
+    """";" per i CSV esportati da Excel in italiano, altrimenti ","."""
+    intestazione = file.readline()
+    file.seek(0)
+    if isinstance(intestazione, bytes):
+        intestazione = intestazione.decode("utf-8", errors="ignore")
+    return ";" if intestazione.count(";") > intestazione.count(",") else ","
+
+
+def _xlsx_chunks(file, righe_per_blocco):
+    try:
+        from openpyxl import load_workbook
+    except ImportError as e:
+        raise ImportError("per importare file Excel serve il pacchetto openpyxl") from e
+    # read_only: le righe vengono lette in streaming dal file compresso
+    libro = load_workbook(file, read_only=True, data_only=True)
+    try:
+        righe = libro.worksheets[0].iter_rows(values_only=True)
+        intestazione = ["" if c is None else str(c).strip() for c in next(righe, ())]
+        blocco = []
+        for riga in righe:
+            blocco.append((list(riga) + [None] * len(intestazione))[:len(intestazione)])
+            if len(blocco) == righe_per_blocco:
+                yield pd.DataFrame(blocco, columns=intestazione)
+                blocco = []
+        if blocco:
+            yield pd.DataFrame(blocco, columns=intestazione)
+    finally:
+        libro.close()
+
+
+def parse_file_dates(valori):
+    """Date di un file importato: ISO 8601 se cominciano con l'anno (con o senza la "T"),
+    altrimenti giorno/mese/anno. Le celle data di Excel arrivano già come datetime.
+
+    Il formato storico anno-giorno-mese vale solo per le righe già sullo Sheet: in un file
+    esterno "2024-03-05 10:00" è il 5 marzo.
+    """
+    valori = pd.Series(valori)
+    if pd.api.types.is_datetime64_any_dtype(valori):
+        return valori
+    testo = valori.astype(object).where(valori.notna(), "").astype(str).str.strip()
+    iso = testo.str.match(r"\d{4}-")
+    date = pd.to_datetime(testo.where(iso), format="ISO8601", errors="coerce")
+    altre = ~iso & testo.ne("")
+    if altre.any():
+        date = date.fillna(pd.to_datetime(testo.where(altre), format="mixed", dayfirst=True, errors="coerce"))
+    return date
+
+
+def activity_keys(df):
+    """Impronta (hash) di ogni riga sulle colonne di CHIAVE_DUPLICATI, con testo normalizzato."""
+    testo = df.reindex(columns=CHIAVE_DUPLICATI).astype(object)
+    testo["Data"] = format_dates(df["Data"]) if "Data" in df.columns else ""
+    for col in ("Ore", "Minuti"):
+        testo[col] = pd.to_numeric(testo[col], errors="coerce").fillna(0).astype(int)
+    testo = testo.where(testo.notna(), "").astype(str).apply(lambda c: c.str.strip())
+    return pd.util.hash_pandas_object(testo, index=False)
+
+
+def prepare_chunk(blocco, tassonomia, ids_presenti, chiavi_presenti):
+    """Righe valide e nuove di un blocco, errori (riga del file → messaggio) e numero di duplicati."""
+    blocco = blocco.rename(columns=lambda c: str(c).strip())
+    righe = blocco.reindex(columns=COLONNE_IMPORTATE).astype(object)
+    testo = [c for c in COLONNE_IMPORTATE if c not in COLONNE_NUMERICHE + ["Data"]]
+    righe[testo] = righe[testo].where(righe[testo].notna(), "").astype(str).apply(lambda c: c.str.strip())
+    righe["Data"] = parse_file_dates(righe["Data"])
+
+    # 🔹 Controlli: tassonomia, date e limiti, più utente e numeri leggibili
+    errori = [check_activities(righe, tassonomia)]
+    errori.append(pd.Series("utente mancante", index=righe.index)[righe["NomeUtente"].eq("")])
+    for col in COLONNE_NUMERICHE:
+        if col in righe.columns:
+            valori = righe[col].where(righe[col].notna(), "").astype(str).str.strip()
+            numeri = pd.to_numeric(valori.str.replace(",", ".", regex=False), errors="coerce")
+            errori.append(pd.Series(f"{col} non numerico", index=righe.index)[numeri.isna() & valori.ne("")])
+            righe[col] = numeri.fillna(0).astype(int)
+    errori = pd.concat(errori).groupby(level=0).agg("; ".join)
+
+    # 🔹 Duplicati: ID già presente o stessa attività già presente (anche nello stesso blocco)
+    ids = pd.to_numeric(blocco["ID"], errors="coerce") if "ID" in blocco.columns else pd.Series(index=righe.index)
+    chiavi = activity_keys(righe)
+    duplicate = ids.isin(ids_presenti) | chiavi.isin(chiavi_presenti) | chiavi.duplicated()
+    duplicate &= ~righe.index.isin(errori.index)
+    valide = ~righe.index.isin(errori.index) & ~duplicate
+    return righe[valide], errori, int(duplicate.sum())
+
+
+def import_activities(store, file, nome_file, tassonomia, base, riprendi_da=0, righe_per_blocco=RIGHE_PER_BLOCCO):
+    """Importa il file a blocchi; dopo ogni blocco restituisce un dizionario di avanzamento.
+
+    base è la tabella attività attuale (per i duplicati e l'intestazione dello Sheet). Le righe
+    del file prima di riprendi_da vengono saltate. Ogni avanzamento contiene "completate" (righe
+    del file elaborate finora), "importate", "duplicate", "errori" (Series riga del file →
+    messaggio, numerate da 2 come nel foglio di calcolo) e "righe" (le righe scritte, tipizzate).
+    """
+    ids_presenti = set(pd.to_numeric(base["ID"], errors="coerce").dropna().astype(int))
+    chiavi_presenti = set(activity_keys(base)) if not base.empty else set()
+    lette = 0
+    for blocco in read_chunks(file, nome_file, righe_per_blocco):
+        inizio, lette = lette, lette + len(blocco)
+        if lette <= riprendi_da:
+            continue
+        blocco.index = pd.RangeIndex(inizio, lette)
+        blocco = blocco.iloc[max(riprendi_da - inizio, 0):]
+
+        righe, errori, duplicate = prepare_chunk(blocco, tassonomia, ids_presenti, chiavi_presenti)
+        if not righe.empty:
+            # 🔹 ID nuovi in blocco e un solo append per tutto il blocco
+            righe.insert(0, "ID", store.next_ids(len(righe)))
+            righe = store.append_data(base, righe)
+            ids_presenti.update(righe["ID"].astype(int))
+            chiavi_presenti.update(activity_keys(righe))
+        errori.index = errori.index + 2
+        yield {
+            "completate": lette, "importate": len(righe), "duplicate": duplicate,
+            "errori": errori, "righe": righe,
+        }
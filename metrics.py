@@ -0,0 +1,172 @@
+"""Misure di latenza e volume delle operazioni (storage, API Sheets, pagine).
+
+Ogni operazione registra durata e byte trasferiti in un istogramma a intervalli fissi
+(LIMITI_ISTOGRAMMA); le operazioni più lente di SOGLIA_LENTA finiscono anche fra le
+ultime operazioni lente. Le chiamate fatte dal thread di un'esecuzione della pagina si
+possono raccogliere con begin_scope/end_scope, per sapere quante richieste fa un rerun.
+METRICHE è il registro del processo; to_prometheus lo esporta nel formato testo di Prometheus.
+"""
+import bisect
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+import pandas as pd
+
+LIMITI_ISTOGRAMMA = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]   # secondi
+SOGLIA_LENTA = 1.0          # secondi
+OPERAZIONI_LENTE = 50       # operazioni lente tenute in memoria
+ESECUZIONI = 50             # esecuzioni di pagina tenute in memoria
+PREFISSO_PROMETHEUS = "gestionale"
+
+
+class Metrics:
+    """Registro thread-safe di contatori e istogrammi per nome di operazione."""
+
+    def __init__(self, soglia_lenta=SOGLIA_LENTA):
+        self.soglia_lenta = soglia_lenta
+        self._lock = threading.Lock()
+        self._operazioni = {}   # nome → {"chiamate", "secondi", "byte", "errori", "intervalli"}
+        self.lente = deque(maxlen=OPERAZIONI_LENTE)
+        self.esecuzioni = deque(maxlen=ESECUZIONI)
+        self._locale = threading.local()
+
+    def record(self, nome, secondi, byte=0, errore=False, dettaglio=""):
+        with self._lock:
+            voce = self._operazioni.get(nome)
+            if voce is None:
+                voce = self._operazioni[nome] = {
+                    "chiamate": 0, "secondi": 0.0, "byte": 0, "errori": 0,
+                    "intervalli": [0] * (len(LIMITI_ISTOGRAMMA) + 1),
+                }
+            voce["chiamate"] += 1
+            voce["secondi"] += secondi
+            voce["byte"] += byte
+            voce["errori"] += errore
+            voce["intervalli"][bisect.bisect_left(LIMITI_ISTOGRAMMA, secondi)] += 1
+            if secondi >= self.soglia_lenta:
+                self.lente.append((pd.Timestamp.now(), nome, secondi, dettaglio))
+        raccolta = getattr(self._locale, "raccolta", None)
+        if raccolta is not None:
+            raccolta[nome] = raccolta.get(nome, 0) + 1
+
+    @contextmanager
+    def timer(self, nome, dettaglio=""):
+        """Misura il blocco; gli errori vengono contati e rilanciati."""
+        inizio = time.perf_counter()
+        errore = False
+        try:
+            yield
+        except BaseException:
+            errore = True
+            raise
+        finally:
+            self.record(nome, time.perf_counter() - inizio, errore=errore, dettaglio=dettaglio)
+
+    def timed(self, nome):
+        """Decoratore: misura ogni chiamata della funzione con il nome indicato."""
+        def decoratore(funzione):
+            @wraps(funzione)
+            def misurata(*args, **kwargs):
+                with self.timer(nome):
+                    return funzione(*args, **kwargs)
+            return misurata
+        return decoratore
+
+    def begin_scope(self):
+        """Da qui le operazioni registrate da questo thread vengono anche contate a parte."""
+        self._locale.raccolta = {}
+
+    def end_scope(self, pagina, secondi):
+        """Chiude la raccolta, registra la durata della pagina e restituisce i conteggi."""
+        raccolta = getattr(self._locale, "raccolta", None) or {}
+        self._locale.raccolta = None
+        self.record(f"pagina.{pagina}", secondi)
+        with self._lock:
+            self.esecuzioni.append((pd.Timestamp.now(), pagina, secondi, raccolta))
+        return raccolta
+
+    def summary(self):
+        """Una riga per operazione: chiamate, errori, tempi (medio e percentili stimati) e byte."""
+        with self._lock:
+            voci = {nome: {**v, "intervalli": list(v["intervalli"])} for nome, v in self._operazioni.items()}
+        righe = [
+            {
+                "Operazione": nome, "Chiamate": v["chiamate"], "Errori": v["errori"],
+                "Totale s": v["secondi"], "Media ms": v["secondi"] / v["chiamate"] * 1000,
+                "p50 ms": _percentile(v["intervalli"], 0.5) * 1000, "p95 ms": _percentile(v["intervalli"], 0.95) * 1000,
+                "Byte": v["byte"],
+            }
+            for nome, v in sorted(voci.items())
+        ]
+        return pd.DataFrame(righe, columns=["Operazione", "Chiamate", "Errori", "Totale s", "Media ms", "p50 ms", "p95 ms", "Byte"])
+
+    def histogram(self, nome):
+        """Conteggi per intervallo di durata ("≤ x s") di un'operazione."""
+        with self._lock:
+            intervalli = list(self._operazioni.get(nome, {}).get("intervalli", [0] * (len(LIMITI_ISTOGRAMMA) + 1)))
+        etichette = [f"≤ {l:g} s" for l in LIMITI_ISTOGRAMMA] + [f"> {LIMITI_ISTOGRAMMA[-1]:g} s"]
+        return pd.DataFrame({"Intervallo": etichette, "Chiamate": intervalli})
+
+    def to_prometheus(self):
+        """Istogrammi e contatori nel formato testo di Prometheus."""
+        with self._lock:
+            voci = {nome: {**v, "intervalli": list(v["intervalli"])} for nome, v in self._operazioni.items()}
+        p = PREFISSO_PROMETHEUS
+        righe = [
+            f"# HELP {p}_operazione_secondi Durata delle operazioni.",
+            f"# TYPE {p}_operazione_secondi histogram",
+        ]
+        for nome, v in sorted(voci.items()):
+            etichetta = f'operazione="{_escape(nome)}"'
+            cumulato = 0
+            for limite, conteggio in zip(LIMITI_ISTOGRAMMA + ["+Inf"], v["intervalli"]):
+                cumulato += conteggio
+                righe.append(f'{p}_operazione_secondi_bucket{{{etichetta},le="{limite}"}} {cumulato}')
+            righe.append(f"{p}_operazione_secondi_sum{{{etichetta}}} {v['secondi']}")
+            righe.append(f"{p}_operazione_secondi_count{{{etichetta}}} {v['chiamate']}")
+        for metrica, campo, descrizione in (
+            ("operazione_byte_total", "byte", "Byte trasferiti dalle operazioni."),
+            ("operazione_errori_total", "errori", "Operazioni terminate con un errore."),
+        ):
+            righe += [f"# HELP {p}_{metrica} {descrizione}", f"# TYPE {p}_{metrica} counter"]
+            righe += [f'{p}_{metrica}{{operazione="{_escape(n)}"}} {v[campo]}' for n, v in sorted(voci.items())]
+        return "\n".join(righe) + "\n"
+
+    def write_prometheus(self, percorso):
+        """Scrive to_prometheus nel file, in modo atomico (per il textfile collector)."""
+        cartella = os.path.dirname(os.path.abspath(percorso))
+        fd, temporaneo = tempfile.mkstemp(suffix=".tmp", dir=cartella)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(temporaneo, percorso)
+
+    def reset(self):
+        with self._lock:
+            self._operazioni.clear()
+            self.lente.clear()
+            self.esecuzioni.clear()
+
+
+def _percentile(intervalli, quota):
+    """Limite superiore dell'intervallo che contiene il percentile (stima dall'istogramma)."""
+    totale = sum(intervalli)
+    if not totale:
+        return 0.0
+    cumulato = 0
+    for limite, conteggio in zip(LIMITI_ISTOGRAMMA + [float("inf")], intervalli):
+        cumulato += conteggio
+        if cumulato >= quota * totale:
+            return limite
+    return float("inf")
+
+
+def _escape(testo):
+    return testo.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+METRICHE = Metrics()
@@ -0,0 +1,31 @@
+"""Converte una volta per tutte le date storiche (anno-giorno-mese) dello Sheet in ISO 8601.
+
+Uso: python migrate_dates.py service_account.json [NomeSheet] [--dry-run]
+
+Da eseguire ad app ferma. L'app legge comunque entrambi i formati, quindi la migrazione
+può essere fatta in qualsiasi momento; con --dry-run conta solo le date da convertire.
+"""
+import json
+import sys
+
+from storage import SheetsConnection, migrate_dates
+
+SHEET_NAME = "GestionaleLavoro"
+
+
+def main(argv):
+    dry_run = "--dry-run" in argv
+    argomenti = [a for a in argv if a != "--dry-run"]
+    if not 1 <= len(argomenti) <= 2:
+        sys.exit("uso: python migrate_dates.py <service_account.json> [NomeSheet] [--dry-run]")
+    with open(argomenti[0]) as f:
+        connessione = SheetsConnection(json.load(f))
+    sheet_name = argomenti[1] if len(argomenti) > 1 else SHEET_NAME
+
+    convertite = migrate_dates(connessione.worksheet(sheet_name, 0), dry_run=dry_run)
+    azione = "da convertire" if dry_run else "convertite"
+    print(f"{convertite} date {azione} in {sheet_name}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
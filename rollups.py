@@ -0,0 +1,158 @@
+"""Tabelle riassuntive (rollup) per KPI e grafici.
+
+Il rollup dei grafici somma le attività per giorno × utente × MacroAttivita × Tipologia ×
+malattia (più il tipo di accettazione, ricavato da Attivita); quello dei KPI (CHIAVI_KPI) solo
+per giorno × utente, così totali e intervalli di date costano in base a giorni e utenti anche
+quando le categorie sono tante. Ogni gruppo è indicizzato dall'impronta (hash) delle sue
+chiavi: update_rollup somma le differenze di inserimenti, modifiche e cancellazioni ai soli
+gruppi toccati, senza raggruppare di nuovo tutto il rollup.
+"""
+import numpy as np
+import pandas as pd
+
+CHIAVI_ROLLUP = ["Giorno", "NomeUtente", "MacroAttivita", "Tipologia", "TipoMalattia", "TipoMalattiaRef", "TipoAcc"]
+CHIAVI_KPI = ["Giorno", "NomeUtente"]
+MISURE_ROLLUP = ["Righe", "Ore", "Minuti", "NumCampioni", "NumReferti"]
+
+
+def _rows(df):
+    """Una riga per attività con le sole colonne di chiave e misura."""
+    attivita = df["Attivita"].astype(object).fillna("").astype(str).str.lower()
+    righe = pd.DataFrame({
+        # sempre in nanosecondi: l'impronta delle chiavi dipende dall'unità delle date
+        "Giorno": pd.to_datetime(df["Data"], errors="coerce").dt.normalize().astype("datetime64[ns]"),
+        "NomeUtente": df["NomeUtente"],
+        "MacroAttivita": df["MacroAttivita"],
+        "Tipologia": df["Tipologia"],
+        "TipoMalattia": df["TipoMalattia"],
+        "TipoMalattiaRef": df["TipoMalattiaRef"],
+        "TipoAcc": np.where(
+            attivita.str.contains("intern", regex=False), "Interni",
+            np.where(attivita.str.contains("estern", regex=False), "Esterni", "Altro"),
+        ),
+        "Righe": 1,
+    }, index=df.index)
+    for col in MISURE_ROLLUP[1:]:
+        righe[col] = pd.to_numeric(df[col], errors="coerce").fillna(0).astype(int)
+    return righe
+
+
+def _sum(righe, chiavi):
+    """Misure sommate per gruppo, con l'impronta delle chiavi come indice."""
+    somme = righe.groupby(chiavi, dropna=False, sort=False, observed=True)[MISURE_ROLLUP].sum().reset_index()
+    # 🔹 Impronta calcolata sui valori (non sui codici delle categorie): è la stessa per ogni frame
+    return somme.set_axis(pd.Index(pd.util.hash_pandas_object(somme[chiavi], index=False).values))
+
+
+def build_rollup(df, chiavi=CHIAVI_ROLLUP):
+    """Rollup completo della tabella attività."""
+    if df.empty:
+        return pd.DataFrame(columns=chiavi + MISURE_ROLLUP)
+    somme = _sum(_rows(df), chiavi)
+    return somme[somme["Righe"] != 0]
+
+
+def rollup_by(rollup, chiavi):
+    """Rollup meno dettagliato (es. per CHIAVI_KPI) ottenuto sommando i gruppi di rollup."""
+    if rollup.empty:
+        return pd.DataFrame(columns=chiavi + MISURE_ROLLUP)
+    return _sum(rollup, chiavi)
+
+
+def update_rollup(rollup, rimosse, aggiunte, chiavi=CHIAVI_ROLLUP):
+    """Rollup aggiornato togliendo le righe rimosse (o nella versione precedente) e
+    aggiungendo quelle nuove.
+
+    Le differenze si raggruppano per gruppo e si sommano (+=) ai gruppi già presenti,
+    trovati per impronta; solo i gruppi nuovi o svuotati aggiungono o tolgono righe. Il
+    rollup ricevuto non cambia, perché è condiviso dagli snapshot: grazie al copy-on-write
+    si copiano solo le colonne di misura.
+    """
+    parti = []
+    if not rimosse.empty:
+        meno = _rows(rimosse)
+        meno[MISURE_ROLLUP] = -meno[MISURE_ROLLUP]
+        parti.append(meno)
+    if not aggiunte.empty:
+        parti.append(_rows(aggiunte))
+    if not parti:
+        return rollup
+    delta = _sum(pd.concat(parti, ignore_index=True), chiavi)
+    delta = delta[delta[MISURE_ROLLUP].ne(0).any(axis=1).values]
+    if delta.empty:
+        return rollup
+    if rollup.empty:
+        return delta[delta["Righe"] > 0]
+
+    posizioni = rollup.index.get_indexer(delta.index)
+    trovati = posizioni >= 0
+    rollup = rollup.copy(deep=False)
+    misure = [rollup.columns.get_loc(c) for c in MISURE_ROLLUP]
+    rollup.iloc[posizioni[trovati], misure] += delta.loc[trovati, MISURE_ROLLUP].values
+
+    # 🔹 Gruppi rimasti senza attività tolti, gruppi nuovi in coda
+    svuotati = posizioni[trovati][rollup["Righe"].values[posizioni[trovati]] == 0]
+    if len(svuotati):
+        rollup = rollup.drop(index=rollup.index[svuotati])
+    nuovi = delta[~trovati & (delta["Righe"] > 0).values]
+    if not nuovi.empty:
+        rollup = pd.concat([rollup, nuovi])
+    return rollup
+
+
+def changed_rows(vecchio, nuovo):
+    """Righe da togliere e da aggiungere ai rollup per passare da vecchio a nuovo: (rimosse, aggiunte).
+
+    Le righe si confrontano per ID e Versione. Una sincronizzazione incrementale lascia le
+    righe in testa al loro posto: quel tratto si salta con un confronto fra array e solo le
+    righe successive si cercano per chiave.
+    """
+    n = min(len(vecchio), len(nuovo))
+    uguali = (vecchio["ID"].values[:n] == nuovo["ID"].values[:n]) & (
+        vecchio["Versione"].values[:n] == nuovo["Versione"].values[:n]
+    )
+    primo = n if uguali.all() else int(np.argmin(uguali))
+    vecchio, nuovo = vecchio.iloc[primo:], nuovo.iloc[primo:]
+    chiavi_vecchie = pd.MultiIndex.from_arrays([vecchio["ID"], vecchio["Versione"]])
+    chiavi_nuove = pd.MultiIndex.from_arrays([nuovo["ID"], nuovo["Versione"]])
+    return vecchio[~chiavi_vecchie.isin(chiavi_nuove)], nuovo[~chiavi_nuove.isin(chiavi_vecchie)]
+
+
+def filter_rollup(rollup, utente=None, start_date=None, end_date=None):
+    """Righe del rollup di un utente e/o di un periodo (date incluse); senza data se filtrato per periodo."""
+    mask = pd.Series(True, index=rollup.index)
+    if utente is not None:
+        mask &= rollup["NomeUtente"] == utente
+    if start_date is not None:
+        mask &= rollup["Giorno"] >= pd.Timestamp(start_date)
+    if end_date is not None:
+        mask &= rollup["Giorno"] < pd.Timestamp(end_date) + pd.Timedelta(days=1)
+    return rollup[mask]
+
+
+def totals(rollup):
+    """Ore equivalenti (ore + minuti/60), campioni e referti totali."""
+    somme = rollup[MISURE_ROLLUP].sum()
+    return somme["Ore"] + somme["Minuti"] / 60, int(somme["NumCampioni"]), int(somme["NumReferti"])
+
+
+def sum_by(rollup, chiavi, misura):
+    """Somma di una misura per le chiavi indicate (come groupby(chiavi)[misura].sum())."""
+    if misura == "OreTot":
+        rollup = rollup.assign(OreTot=rollup["Ore"] + rollup["Minuti"] / 60)
+    return rollup.groupby(chiavi, observed=True)[misura].sum().reset_index()
+
+
+def count_by(rollup, chiave, nome=None):
+    """Numero di attività per valore della chiave (come value_counts) in due colonne [nome, Conteggio]."""
+    conteggi = rollup.groupby(chiave, observed=True)["Righe"].sum()
+    conteggi = conteggi[conteggi > 0].sort_values(ascending=False, kind="stable")
+    return pd.DataFrame({nome or chiave: conteggi.index, "Conteggio": conteggi.values})
+
+
+def date_range(rollup):
+    """Primo e ultimo giorno con attività (date), o None se non ci sono date."""
+    giorni = rollup["Giorno"].dropna()
+    if giorni.empty:
+        return None
+    return giorni.min().date(), giorni.max().date()
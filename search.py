@@ -0,0 +1,56 @@
+"""Ricerca testuale nelle attività.
+
+L'indice è una colonna di testo normalizzato (minuscolo, senza accenti) costruita una sola
+volta per ogni versione dei dati; le ricerche confrontano solo quella colonna.
+"""
+import numpy as np
+import pandas as pd
+
+COLONNE_RICERCA = ["Note", "Attivita", "Tipologia", "TipoMalattia", "TipoMalattiaRef"]
+
+
+def normalize(testo):
+    """Minuscolo e senza accenti (Series di stringhe)."""
+    testo = testo.str.lower()
+    # 🔹 La scomposizione degli accenti serve solo ai valori non ASCII
+    accentati = ~testo.map(str.isascii, na_action="ignore").fillna(True).astype(bool)
+    if accentati.any():
+        testo = testo.copy()
+        testo[accentati] = (
+            testo[accentati].str.normalize("NFKD")
+            .str.encode("ascii", errors="ignore")
+            .str.decode("ascii")
+        )
+    return testo
+
+
+def build_search_index(df):
+    """Testo normalizzato delle colonne di ricerca, una riga per riga di df (stesso indice)."""
+    colonne = [c for c in COLONNE_RICERCA if c in df.columns]
+    if df.empty or not colonne:
+        return pd.Series("", index=df.index, dtype=object)
+    testo = [_normalize_column(df[c]) for c in colonne]
+    return testo[0].str.cat(testo[1:], sep=" ")
+
+
+def _normalize_column(colonna):
+    if isinstance(colonna.dtype, pd.CategoricalDtype):
+        # 🔹 Colonne categoriche: si normalizzano solo le categorie, poi si espandono i codici
+        categorie = normalize(pd.Series(colonna.cat.categories.astype(str), dtype=object)).to_numpy()
+        valori = np.append(categorie, "")[colonna.cat.codes.to_numpy()]   # codice -1 (NaN) → ""
+        return pd.Series(valori, index=colonna.index, dtype=object)
+    return normalize(colonna.astype(object).fillna("").astype(str))
+
+
+def search_mask(indice, query, index=None):
+    """Righe che contengono tutti i termini della query (AND), senza distinguere maiuscole e accenti.
+
+    Se index è indicato la ricerca è limitata a quelle righe dell'indice.
+    """
+    if index is not None:
+        indice = indice.reindex(index, fill_value="")
+    termini = normalize(pd.Series(str(query).split(), dtype=object)).tolist()
+    mask = pd.Series(True, index=indice.index)
+    for termine in termini:
+        mask &= indice.str.contains(termine, regex=False)
+    return mask
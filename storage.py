@@ -0,0 +1,1682 @@
+"""Persistenza dei dati di MedGenLab.
+
+Le attività e gli utenti possono stare su Google Sheets (GoogleSheetsStore) oppure in un
+database SQLite locale (SQLiteStore); l'app usa solo l'interfaccia comune ActivityStore.
+Questo modulo non dipende da Streamlit.
+"""
+import json
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+import gspread
+import requests
+from gspread.http_client import HTTPClient
+from gspread.utils import a1_to_rowcol, rowcol_to_a1
+from oauth2client.service_account import ServiceAccountCredentials
+
+from metrics import METRICHE
+
+# =====================================
+# Schema dati
+# =====================================
+COLONNE_ATTIVITA = [
+    "ID","NomeUtente","Data","MacroAttivita","Tipologia","Attivita",
+    "Note","Ore","Minuti","NumCampioni","TipoMalattia","NumReferti","TipoMalattiaRef","Versione"
+]
+COLONNE_NUMERICHE = ["Ore","Minuti","NumCampioni","NumReferti","Versione"]
+COLONNE_UTENTI = ["NomeUtente","Password","Ruolo","Attivo"]   # Attivo: "0" = disattivato, vuoto o "1" = attivo
+FORMATO_DATA = "%Y-%m-%dT%H:%M"          # ISO 8601, usato per tutte le nuove scritture
+FORMATO_DATA_LEGACY = "%Y-%d-%m %H:%M"   # anno-giorno-mese delle righe storiche (senza la "T")
+
+# Tipi in memoria: categorie per utenti e tassonomia, interi piccoli per ore e contatori
+SCHEMA_MEMORIA = {
+    "NomeUtente": "category", "MacroAttivita": "category", "Tipologia": "category",
+    "Attivita": "category", "TipoMalattia": "category", "TipoMalattiaRef": "category",
+    "Ore": "int16", "Minuti": "int16", "NumCampioni": "int32", "NumReferti": "int32",
+    "Versione": "int32",
+}
+COLONNA_MINUTI_TOTALI = "MinutiTotali"     # Ore * 60 + Minuti, calcolata al caricamento
+COLONNA_PARTIZIONE = "Partizione"          # foglio che contiene la riga (PartitionedSheetsStore)
+COLONNE_DERIVATE = [COLONNA_MINUTI_TOTALI, COLONNA_PARTIZIONE]  # solo in memoria, mai scritte
+
+# Concorrenza ottimistica: ogni riga ha un numero di versione incrementato ad ogni scrittura.
+# Sullo Sheet le righe non vengono mai cancellate fisicamente, così il numero di riga di un ID
+# non cambia: una riga eliminata resta con la versione negativa (-(versione + 1)) e viene
+# ignorata in lettura; compact_deleted la toglie davvero, ad app ferma.
+COLONNA_VERSIONE = "Versione"
+MAX_TENTATIVI = 4       # nuovi tentativi dopo un conflitto
+BACKOFF_BASE = 0.5      # secondi, raddoppiati ad ogni tentativo (con jitter)
+
+class VersionConflict(Exception):
+    """Righe modificate o eliminate da altri dopo l'ultima lettura, non risolte entro MAX_TENTATIVI."""
+
+    def __init__(self, ids):
+        super().__init__(f"righe modificate contemporaneamente da un altro utente (ID {sorted(ids)})")
+        self.ids = ids
+
+def parse_dates(valori):
+    """Decodifica vettoriale delle date: ISO 8601 (riconoscibile dalla "T") o formato storico.
+
+    I valori già datetime passano senza conversioni; quelli non interpretabili diventano NaT.
+    """
+    valori = pd.Series(valori)
+    if pd.api.types.is_datetime64_any_dtype(valori):
+        return valori
+    testo = valori.astype(object).where(valori.notna(), "").astype(str).str.strip()
+    iso = testo.str.contains("T", regex=False)
+    date = pd.to_datetime(testo.where(iso), format=FORMATO_DATA, errors="coerce")
+    date = date.fillna(pd.to_datetime(testo.where(~iso), format=FORMATO_DATA_LEGACY, errors="coerce"))
+    # 🔹 Residui (es. Timestamp convertiti in testo con i secondi): ISO generico
+    residui = date.isna() & testo.ne("")
+    if residui.any():
+        date[residui] = pd.to_datetime(testo[residui], format="ISO8601", errors="coerce")
+    return date
+
+def drop_deleted(df):
+    """Toglie le righe eliminate (Versione negativa) lette dallo Sheet."""
+    if COLONNA_VERSIONE not in df.columns:
+        return df
+    eliminate = df[COLONNA_VERSIONE] < 0
+    return df[~eliminate].reset_index(drop=True) if eliminate.any() else df
+
+def format_dates(date):
+    """Codifica vettoriale delle date per la scrittura (ISO 8601); NaT diventa vuoto."""
+    return parse_dates(date).dt.strftime(FORMATO_DATA).fillna("")
+
+def prepare_data(df, formato=None):
+    """Applica ai dati letti dallo Sheet le conversioni di tipo usate dall'app.
+
+    Senza formato le date sono lette con parse_dates (ISO o storico).
+    """
+    if "Data" in df.columns:
+        if formato is None:
+            df["Data"] = parse_dates(df["Data"])
+        else:
+            df["Data"] = pd.to_datetime(df["Data"], format=formato, errors="coerce")
+
+    # Conversione numerica sicura
+    for col in COLONNE_NUMERICHE:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0).astype(int)
+
+    return apply_schema(df)
+
+def apply_schema(df):
+    """Applica i tipi compatti di SCHEMA_MEMORIA e aggiunge la colonna dei minuti totali."""
+    for col, tipo in SCHEMA_MEMORIA.items():
+        if col in df.columns:
+            df[col] = df[col].astype(tipo)
+    if "Ore" in df.columns and "Minuti" in df.columns:
+        df[COLONNA_MINUTI_TOTALI] = (df["Ore"].astype("int32") * 60 + df["Minuti"]).astype("int32")
+    return df
+
+def memory_report(df):
+    """Memoria occupata da ogni colonna del frame (byte, indice compreso) con il totale."""
+    byte = df.memory_usage(deep=True)
+    return pd.concat([byte, pd.Series({"Totale": byte.sum()})])
+
+def stored_columns(df):
+    """Colonne del frame che esistono anche sullo Sheet (senza quelle derivate)."""
+    return [c for c in df.columns if c not in COLONNE_DERIVATE]
+
+def to_sheet_rows(df, colonne):
+    """Converte le righe del DataFrame nei valori testuali scritti sullo Sheet."""
+    out = df.reindex(columns=colonne)
+    if "Data" in out.columns:
+        out = out.assign(Data=format_dates(out["Data"]))
+    out = out.astype(object)
+    return out.where(out.notna(), "").astype(str).values.tolist()
+
+def from_sheet_rows(righe, colonne):
+    """Ricostruisce dai valori testuali dello Sheet lo stesso DataFrame che darebbe load_data."""
+    df = pd.DataFrame(righe, columns=colonne)
+    if "ID" in df.columns:
+        df["ID"] = pd.to_numeric(df["ID"], errors="coerce")
+    return drop_deleted(prepare_data(df))
+
+def _align_categories(df, righe):
+    """Stesse categorie nelle colonne categoriche di df e righe, perché concat le conservi."""
+    righe = righe.copy()
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype) and col in righe.columns:
+            nuove = pd.Index(righe[col].dropna().astype(object).unique()).difference(df[col].cat.categories)
+            if len(nuove):
+                df[col] = df[col].cat.add_categories(nuove)
+            righe[col] = pd.Categorical(righe[col], categories=df[col].cat.categories)
+    return df, righe
+
+def upsert_rows(df, righe, eliminati=()):
+    """Sostituisce per ID le righe già presenti (stessa posizione), aggiunge le nuove in coda
+    e toglie gli ID eliminati."""
+    if df.empty:
+        return righe.reset_index(drop=True)
+    df = df[~df["ID"].isin(eliminati)]
+    df, righe = _align_categories(df, righe)
+    posizioni = pd.Series(df.index, index=df["ID"].values)
+    posizioni = posizioni[~posizioni.index.duplicated(keep="last")].reindex(righe["ID"].values)
+    esistenti = posizioni.notna().values
+    sostituite = righe[esistenti].set_axis(posizioni[esistenti].astype(int).values)
+    df = pd.concat([df.drop(index=sostituite.index), sostituite]).sort_index()
+    return pd.concat([df, righe[~esistenti]], ignore_index=True)
+
+def _data_vuota(data):
+    return data.isna() | data.astype(str).str.strip().eq("")
+
+def merge_rows(existing, df):
+    """Unisce per ID le righe di df a quelle esistenti, in modo vettoriale.
+
+    Le righe con ID già presente prendono i valori di df (nella stessa posizione), quelle
+    nuove vanno in coda e gli ID assenti da df vengono tolti. Una Data vuota o NaT in df
+    non sovrascrive quella esistente. Con ID ripetuti in df vale l'ultima riga.
+    """
+    if existing.empty:
+        return df.copy()
+    nuove = df.drop_duplicates("ID", keep="last").set_index("ID", drop=False)
+
+    # 🔹 Righe esistenti ancora presenti in df, aggiornate colonna per colonna
+    updated = existing[existing["ID"].isin(nuove.index)]
+    allineate = nuove.reindex(updated["ID"].values)
+    for col in nuove.columns:
+        valori = allineate[col]
+        if col == "Data" and col in updated.columns:
+            # 👇 Se nel DF la data è vuota o NaT, NON toccarla
+            valori = valori.where(~_data_vuota(valori), updated["Data"].values)
+        updated[col] = valori.values
+
+    # 🔹 Righe nuove in coda
+    aggiunte = nuove[~nuove.index.isin(existing["ID"])]
+    if aggiunte.empty:
+        return updated
+    return pd.concat([updated, aggiunte.reset_index(drop=True)], ignore_index=True)
+
+def _sheet_frame(df, colonne):
+    """Valori testuali delle righe, indicizzati per ID."""
+    return pd.DataFrame(to_sheet_rows(df, colonne), columns=colonne, index=df["ID"].values)
+
+def _as_versions(valori):
+    return pd.to_numeric(pd.Series(valori, dtype=object), errors="coerce").fillna(0).astype(int)
+
+def _reapply_changes(letta, nuova, attuale):
+    """Riporta sulla riga attuale i soli campi che la sessione ha cambiato rispetto a quella letta."""
+    cambiate = letta.ne(nuova)
+    cambiate[COLONNA_VERSIONE] = False
+    riga = attuale.copy()
+    riga[cambiate] = nuova[cambiate]
+    return riga
+
+def _changes(vecchie, nuove):
+    """ID delle righe con almeno un campo cambiato (coppie ID, colonna) ed ID eliminati."""
+    comuni = nuove.index[nuove.index.isin(vecchie.index)]
+    dati = [c for c in vecchie.columns if c != COLONNA_VERSIONE]
+    diverse = vecchie.loc[comuni, dati].ne(nuove.loc[comuni, dati]).stack()
+    return diverse[diverse].index, vecchie.index.difference(nuove.index)
+
+
+# =====================================
+# Connessione Google Sheets
+# =====================================
+SCOPE = [
+    "https://spreadsheets.google.com/feeds",
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive.file",
+    "https://www.googleapis.com/auth/drive",
+]
+TOKEN_MAX_AGE = 45 * 60   # secondi: si riautorizza prima della scadenza (1 ora) del token
+
+# Quote dell'API Sheets per utente (il service account): richieste al minuto
+QUOTA_LETTURE = 60
+QUOTA_SCRITTURE = 60
+FINESTRA_QUOTA = 60            # secondi
+TENTATIVI_API = 5              # nuovi tentativi dopo 429, timeout o errori del server
+BACKOFF_API = 1.0              # secondi, raddoppiati ad ogni tentativo (con jitter)
+BACKOFF_API_MAX = 32.0
+CODICI_RIPROVA = {408, 429, 500, 502, 503, 504}
+COALESCENZA = 0.5              # secondi in cui una lettura identica riusa l'ultima risposta
+
+class TokenBucket:
+    """Limitatore a gettoni: al massimo capacita richieste per finestra, con ricarica continua."""
+
+    def __init__(self, capacita, finestra=FINESTRA_QUOTA):
+        self.capacita = capacita
+        self._ritmo = capacita / finestra   # gettoni al secondo
+        self._gettoni = float(capacita)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Prende un gettone, aspettando se serve; restituisce i secondi di attesa."""
+        with self._lock:
+            adesso = time.monotonic()
+            self._gettoni = min(self.capacita, self._gettoni + (adesso - self._ultimo) * self._ritmo)
+            self._ultimo = adesso
+            # Il gettone si prenota subito (anche in negativo): le richieste escono in ordine d'arrivo
+            self._gettoni -= 1
+            attesa = max(-self._gettoni / self._ritmo, 0.0)
+        if attesa:
+            time.sleep(attesa)
+        return attesa
+
+class SheetsQuota:
+    """Quote, nuovi tentativi e letture condivise per tutte le chiamate del processo.
+
+    Letture (GET) e scritture passano da due TokenBucket dimensionati sulle quote di Sheets.
+    Su 429, timeout ed errori 5xx si riprova con backoff esponenziale e jitter; le scritture
+    solo su 429, che garantisce che la richiesta non è stata applicata (un append ripetuto
+    duplicherebbe le righe). Letture identiche contemporanee condividono una sola chiamata,
+    e per COALESCENZA secondi riusano la risposta; ogni scrittura chiude la condivisione,
+    così nessuno legge dati precedenti alla propria scrittura.
+    """
+
+    def __init__(self, letture=QUOTA_LETTURE, scritture=QUOTA_SCRITTURE, finestra=FINESTRA_QUOTA,
+                 tentativi=TENTATIVI_API, coalescenza=COALESCENZA):
+        self.letture = TokenBucket(letture, finestra)
+        self.scritture = TokenBucket(scritture, finestra)
+        self.tentativi = tentativi
+        self.coalescenza = coalescenza
+        self._lock = threading.Lock()
+        self._generazione = 0    # cresce ad ogni scrittura
+        self._in_corso = {}      # chiave → Future della lettura in corso
+        self._recenti = {}       # chiave → (istante, risposta)
+        self.statistiche = {"letture": 0, "scritture": 0, "condivise": 0, "riprovate": 0, "attesa_quota": 0.0}
+
+    def call(self, metodo, chiave, esegui):
+        """Esegue la richiesta esegui() rispettando quote e condivisione; chiave identifica la richiesta."""
+        if metodo.lower() != "get":
+            try:
+                return self._retry(self.scritture, esegui, scrittura=True)
+            finally:
+                with self._lock:
+                    self._generazione += 1
+                    self._recenti.clear()
+
+        with self._lock:
+            chiave = (self._generazione, chiave)
+            adesso = time.monotonic()
+            recente = self._recenti.get(chiave)
+            if recente is not None and adesso - recente[0] < self.coalescenza:
+                self.statistiche["condivise"] += 1
+                return recente[1]
+            futura = self._in_corso.get(chiave)
+            capofila = futura is None
+            if capofila:
+                futura = self._in_corso[chiave] = Future()
+            else:
+                self.statistiche["condivise"] += 1
+        if not capofila:
+            return futura.result()
+
+        try:
+            risposta = self._retry(self.letture, esegui)
+            risposta.content   # letto una volta sola, prima di condividere la risposta
+        except BaseException as e:
+            futura.set_exception(e)
+            with self._lock:
+                del self._in_corso[chiave]
+            raise
+        with self._lock:
+            del self._in_corso[chiave]
+            adesso = time.monotonic()
+            self._recenti = {k: v for k, v in self._recenti.items() if adesso - v[0] < self.coalescenza}
+            self._recenti[chiave] = (adesso, risposta)
+        futura.set_result(risposta)
+        return risposta
+
+    def _retry(self, bucket, esegui, scrittura=False):
+        for tentativo in range(self.tentativi + 1):
+            attesa = bucket.acquire()
+            with self._lock:
+                self.statistiche["scritture" if scrittura else "letture"] += 1
+                self.statistiche["attesa_quota"] += attesa
+            try:
+                return esegui()
+            except gspread.exceptions.APIError as e:
+                codice = e.code
+                if tentativo == self.tentativi or (codice != 429 if scrittura else codice not in CODICI_RIPROVA):
+                    raise
+            except (requests.ConnectionError, requests.Timeout):
+                if scrittura or tentativo == self.tentativi:
+                    raise
+            with self._lock:
+                self.statistiche["riprovate"] += 1
+            time.sleep(min(BACKOFF_API * 2 ** tentativo, BACKOFF_API_MAX) * random.uniform(0.5, 1.5))
+
+def api_operation(metodo, endpoint):
+    """Nome breve di una richiesta all'API, per le metriche: "sheets.values.get", "drive.get", ..."""
+    metodo = metodo.lower()
+    if "/spreadsheets/" not in endpoint:
+        return f"drive.{metodo}"
+    percorso = re.sub(r"^[^/:]+/?", "", endpoint.split("/spreadsheets/", 1)[1])   # senza l'ID dello spreadsheet
+    if percorso.startswith("values:"):
+        return f"sheets.values.{percorso[len('values:'):]}"      # batchGet, batchUpdate, batchClear
+    if percorso.startswith("values/"):
+        azione = re.search(r":(append|clear)$", percorso)
+        if azione:
+            return f"sheets.values.{azione.group(1)}"
+        return "sheets.values.get" if metodo == "get" else "sheets.values.update"
+    if percorso.startswith(":"):
+        return f"sheets.{percorso[1:]}"                           # :batchUpdate
+    return f"sheets.{metodo}"                                     # metadati dello spreadsheet
+
+class QuotaHTTPClient(HTTPClient):
+    """HTTPClient di gspread che fa passare ogni richiesta da una SheetsQuota (attributo quota).
+
+    Ogni richiesta viene anche misurata in METRICHE (durata, attese comprese, e byte).
+    """
+
+    quota = None
+
+    def request(self, method, endpoint, *args, **kwargs):
+        esegui = lambda: super(QuotaHTTPClient, self).request(method, endpoint, *args, **kwargs)
+        inizio = time.perf_counter()
+        risposta = None
+        try:
+            if self.quota is None:
+                risposta = esegui()
+            else:
+                risposta = self.quota.call(method, (method, endpoint, repr(args), repr(sorted(kwargs.items()))), esegui)
+            return risposta
+        finally:
+            corpo = kwargs.get("json")
+            byte = len(json.dumps(corpo)) if corpo is not None else 0
+            byte += len(risposta.content) if risposta is not None else 0
+            METRICHE.record(
+                api_operation(method, endpoint), time.perf_counter() - inizio,
+                byte=byte, errore=risposta is None, dettaglio=endpoint,
+            )
+
+class SheetsConnection:
+    """Client gspread autorizzato una sola volta per processo.
+
+    Spreadsheet e worksheet restano in cache: lo Sheet viene cercato per nome su Drive
+    solo la prima volta, poi viene riaperto con la sua key. Prima che il token scada il
+    client viene riautorizzato e gli handle ricreati. Tutte le richieste passano dalla
+    stessa SheetsQuota, che resta valida anche dopo la riautorizzazione.
+    """
+
+    def __init__(self, creds_dict, quota=None):
+        self._creds_dict = creds_dict
+        self.quota = quota or SheetsQuota()
+        self._lock = threading.RLock()
+        self._client = None
+        self._autorizzato = 0.0
+        self._chiavi = {}        # nome → key dello spreadsheet
+        self._spreadsheet = {}   # key → Spreadsheet
+        self._worksheet = {}     # (key, worksheet) → Worksheet
+
+    def client(self):
+        with self._lock:
+            if self._client is None or time.monotonic() - self._autorizzato > TOKEN_MAX_AGE:
+                creds = ServiceAccountCredentials.from_json_keyfile_dict(self._creds_dict, SCOPE)
+                self._client = gspread.authorize(creds, http_client=QuotaHTTPClient)
+                self._client.http_client.quota = self.quota
+                self._autorizzato = time.monotonic()
+                self._spreadsheet.clear()
+                self._worksheet.clear()
+            return self._client
+
+    def spreadsheet(self, sheet_name):
+        with self._lock:
+            client = self.client()
+            key = self._chiavi.get(sheet_name)
+            if key is None:
+                sh = client.open(sheet_name)
+                self._chiavi[sheet_name] = key = sh.id
+                self._spreadsheet[key] = sh
+            elif key not in self._spreadsheet:
+                self._spreadsheet[key] = client.open_by_key(key)
+            return self._spreadsheet[key]
+
+    def worksheet(self, sheet_name, worksheet=0):
+        """Worksheet per indice (come get_worksheet) o per nome."""
+        with self._lock:
+            sh = self.spreadsheet(sheet_name)
+            chiave = (sh.id, worksheet)
+            if chiave not in self._worksheet:
+                if isinstance(worksheet, int):
+                    self._worksheet[chiave] = sh.get_worksheet(worksheet)
+                else:
+                    self._worksheet[chiave] = sh.worksheet(worksheet)
+            return self._worksheet[chiave]
+
+
+# =====================================
+# Lettura e scrittura su Google Sheets
+# =====================================
+def load_data(sheet):
+    """Carica i dati da Google Sheets; Data diventa datetime (da ISO 8601 o dal formato storico)."""
+    return _read_sheet(sheet)[0]
+
+def _read_sheet(sheet):
+    """Come load_data, restituendo anche le righe dati lette dallo Sheet (eliminate comprese)."""
+    data = sheet.get_all_records()
+    df = pd.DataFrame(data)
+
+    if df.empty:
+        return pd.DataFrame(columns=COLONNE_ATTIVITA), len(data)
+
+    return drop_deleted(prepare_data(df)), len(data)
+
+def sheet_columns(sheet, df):
+    """Restituisce le colonne dello Sheet e l'eventuale intestazione da scrivere se il foglio è vuoto."""
+    if not df.empty:
+        return stored_columns(df), []
+    colonne = sheet.row_values(1)
+    if colonne:
+        return colonne, []
+    return list(COLONNE_ATTIVITA), [list(COLONNE_ATTIVITA)]
+
+def next_id(sheet):
+    """Calcola il prossimo ID leggendo solo la colonna ID (colonna A) dello Sheet."""
+    ids = pd.to_numeric(pd.Series(sheet.col_values(1)[1:], dtype=object), errors="coerce")
+    return int(ids.max()) + 1 if ids.notna().any() else 1
+
+# Blocchi di ID: ogni processo ne riserva BLOCCO_ID alla volta e li distribuisce in locale
+BLOCCO_ID = 20
+FOGLIO_CONTATORI = "Contatori"
+COLONNE_CONTATORI = ["Contatore", "Quantita", "Data"]
+
+class IdAllocator:
+    """Distribuisce ID presi da blocchi riservati in esclusiva al processo.
+
+    riserva(n) deve restituire il primo di n ID consecutivi che nessun altro riceverà;
+    viene chiamata solo quando il blocco corrente è esaurito. Gli ID di un blocco non usati
+    prima della chiusura del processo restano come buchi nella numerazione.
+    """
+
+    def __init__(self, riserva, blocco=BLOCCO_ID):
+        self._riserva = riserva
+        self.blocco = blocco
+        self._lock = threading.Lock()
+        self._prossimo = self._fine = 0
+
+    def next_id(self):
+        return self.next_ids(1)[0]
+
+    def next_ids(self, n):
+        """n ID insieme: il resto del blocco corrente e, se non basta, un blocco nuovo abbastanza grande."""
+        with self._lock:
+            ids = []
+            while len(ids) < n:
+                if self._prossimo >= self._fine:
+                    quanti = max(self.blocco, n - len(ids))
+                    self._prossimo = self._riserva(quanti)
+                    self._fine = self._prossimo + quanti
+                presi = min(n - len(ids), self._fine - self._prossimo)
+                ids.extend(range(self._prossimo, self._prossimo + presi))
+                self._prossimo += presi
+            return ids
+
+def add_filled_worksheet(spreadsheet, title, righe, rows=1000):
+    """Crea un foglio già con le sue righe, in un'unica batch_update (addSheet e updateCells).
+
+    La richiesta è atomica: chi trova il foglio lo trova già scritto, mai vuoto fra la
+    creazione e la prima update. Solleva APIError se il foglio esiste già.
+    """
+    id_foglio = random.randrange(1, 2 ** 31)
+    spreadsheet.batch_update({"requests": [
+        {"addSheet": {"properties": {
+            "sheetId": id_foglio, "title": title,
+            "gridProperties": {"rowCount": rows, "columnCount": max(len(r) for r in righe)},
+        }}},
+        {"updateCells": {
+            "start": {"sheetId": id_foglio, "rowIndex": 0, "columnIndex": 0},
+            "rows": [{"values": [{"userEnteredValue": {"stringValue": str(v)}} for v in riga]} for riga in righe],
+            "fields": "userEnteredValue",
+        }},
+    ]})
+
+def lease_ids(contatori, n):
+    """Riserva n ID consecutivi sul foglio Contatori e restituisce il primo.
+
+    Il foglio è un registro in sola aggiunta: la prima riga è la base (ID massimo esistente
+    quando il foglio è stato creato), ogni riserva aggiunge una riga con la sua quantità.
+    Google Sheets serializza gli append, quindi l'ordine delle righe è lo stesso per tutti:
+    il blocco di una riserva comincia dopo la somma delle righe che la precedono e due
+    processi non ricevono mai gli stessi ID. Costa un append e la lettura della colonna
+    delle quantità fino alla propria riga.
+    """
+    risposta = contatori.append_rows(
+        [["ID", str(n), datetime.now().strftime(FORMATO_DATA)]],
+        value_input_option="RAW", table_range="A1",
+    )
+    riga = a1_to_rowcol(risposta["updates"]["updatedRange"].split("!")[-1].split(":")[0])[0]
+    quantita = contatori.get(f"B2:B{riga}")
+    precedenti = pd.to_numeric(pd.Series([r[0] if r else "" for r in quantita[:-1]], dtype=object), errors="coerce")
+    return int(precedenti.fillna(0).sum()) + 1
+
+def _max_id(df):
+    """ID massimo di df, 0 se non ce ne sono."""
+    ids = pd.to_numeric(df["ID"], errors="coerce") if "ID" in df.columns else pd.Series(dtype=float)
+    return int(ids.max()) if ids.notna().any() else 0
+
+def sync_data(sheet, df=None, stato=None):
+    """Sincronizzazione incrementale: scarica solo le righe aggiunte in coda dall'ultima lettura.
+
+    stato è il numero di righe dati dello Sheet (eliminate comprese) alla sincronizzazione
+    precedente. Si leggono solo le colonne ID e Versione: se le righe già note ci sono tutte con
+    la stessa versione e quelle nuove stanno tutte dopo le righe lette, si scarica solo quel
+    tratto finale, qualunque sia l'ordine dei loro ID (con i blocchi di IdAllocator le sessioni
+    aggiungono ID non crescenti). Se altri hanno modificato, eliminato o spostato righe si
+    ricarica tutto. Restituisce (df, stato).
+    """
+    # 🔹 Uno stato di formato diverso (es. da uno snapshot precedente) vale una lettura completa
+    if df is None or not isinstance(stato, int) or df.empty or COLONNA_VERSIONE not in df.columns:
+        return _read_sheet(sheet)
+
+    righe_lette = stato
+    colonne = stored_columns(df)
+    lettere = [rowcol_to_a1(1, colonne.index(c) + 1)[:-1] for c in ("ID", COLONNA_VERSIONE)]
+    colonne_lette = sheet.batch_get([f"{l}2:{l}" for l in lettere], major_dimension="COLUMNS")
+    ids_sheet, ver_sheet = [v[0] if v else [] for v in colonne_lette]
+    ids = pd.to_numeric(pd.Series(ids_sheet, dtype=object), errors="coerce")
+    versioni = pd.Series(_as_versions(list(ver_sheet) + [""] * (len(ids) - len(ver_sheet))).values, index=ids.values)
+    note = pd.Series(_as_versions(df[COLONNA_VERSIONE]).values, index=df["ID"].values)
+
+    # 🔹 Modifiche o cancellazioni di altri (o ID anomali): serve una lettura completa
+    if ids.isna().any() or versioni.index.has_duplicates or note.index.has_duplicates:
+        return sync_data(sheet)
+    if not note.index.isin(versioni.index).all() or (versioni.reindex(note.index) != note).any():
+        return sync_data(sheet)
+
+    # le righe eliminate (versione negativa) non sono nuove anche se il loro ID non è noto
+    nuove = ~ids.isin(note.index).values & (versioni.values >= 0)
+    # 🔹 Righe tolte (compattazione) o righe nuove fra quelle già lette: l'ordine è cambiato
+    if len(ids) < righe_lette or nuove[:righe_lette].any():
+        return sync_data(sheet)
+    if not nuove.any():
+        return df, len(ids)
+
+    # 🔹 Solo il tratto finale dello Sheet, dopo le righe già lette
+    ultima = rowcol_to_a1(1, len(colonne))[:-1]
+    coda = sheet.get(f"A{righe_lette + 2}:{ultima}{len(ids) + 1}")
+    coda = [(list(r) + [""] * len(colonne))[:len(colonne)] for r in coda]
+    coda = from_sheet_rows(coda, colonne)
+    coda = coda[~coda["ID"].isin(note.index)]
+    return upsert_rows(df, coda), len(ids)
+
+def append_sheet_rows(sheet, base, righe):
+    """Aggiunge in coda allo Sheet solo le righe nuove (versione 1) con append_rows.
+
+    base è l'ultimo stato noto, da cui si ricava l'intestazione. Restituisce le righe
+    tipizzate come se fossero state rilette dallo Sheet.
+    """
+    righe = righe.copy()
+    # 🔹 Le colonne seguono l'intestazione dello Sheet (scritta se il foglio è vuoto)
+    colonne, intestazione = sheet_columns(sheet, base)
+    for col in COLONNE_NUMERICHE:
+        if col in righe.columns:
+            righe[col] = pd.to_numeric(righe[col], errors="coerce").fillna(0).astype(int)
+    righe[COLONNA_VERSIONE] = 1
+    valori = to_sheet_rows(righe, colonne)
+
+    sheet.append_rows(intestazione + valori, value_input_option="RAW")
+    return from_sheet_rows(valori, colonne)
+
+def _write_rows(sheet, colonne, intestazione, vecchie, nuove):
+    """Un passaggio di scrittura con controllo di versione (compare-and-swap per riga).
+
+    Le righe la cui versione sullo Sheet non coincide più con quella letta non vengono
+    scritte e sono restituite come conflitti {ID: riga, o None se non esiste più o è stata
+    eliminata}. Le righe eliminate non si cancellano: prendono la versione negativa nella
+    stessa batch_update delle celle, quindi nessuna riga si sposta fra la lettura della
+    mappa ID → riga e la scrittura. Restituisce lo stato noto dopo la scrittura e i conflitti.
+    """
+    id_col = colonne.index("ID") + 1
+    ver_col = colonne.index(COLONNA_VERSIONE) + 1
+    nuove = nuove.copy()
+
+    # 🔹 Mappa ID → riga e versione attuale leggendo solo le colonne ID e Versione
+    ids_sheet, ver_sheet = [], []
+    if not vecchie.empty:
+        lettere = [rowcol_to_a1(1, c)[:-1] for c in (id_col, ver_col)]
+        colonne_lette = sheet.batch_get([f"{l}2:{l}" for l in lettere], major_dimension="COLUMNS")
+        ids_sheet, ver_sheet = [v[0] if v else [] for v in colonne_lette]
+    ids_sheet = pd.to_numeric(pd.Series(ids_sheet, dtype=object), errors="coerce")
+    ver_sheet = _as_versions(list(ver_sheet) + [""] * (len(ids_sheet) - len(ver_sheet)))
+    riga_di = dict(zip(ids_sheet, range(2, len(ids_sheet) + 2)))
+    versione_di = dict(zip(ids_sheet, ver_sheet))
+    versione_letta = dict(zip(vecchie.index, _as_versions(vecchie[COLONNA_VERSIONE])))
+
+    # 🔹 Celle cambiate sulle righe presenti in entrambe le versioni
+    diverse, eliminate = _changes(vecchie, nuove)
+    conflitti = {
+        i: riga_di.get(i) if versione_di.get(i, -1) >= 0 else None
+        for i in set(diverse.get_level_values(0)) | set(eliminate)
+        if riga_di.get(i) is None or versione_di[i] != versione_letta[i]
+    }
+
+    celle = [
+        {"range": rowcol_to_a1(riga_di[i], colonne.index(c) + 1), "values": [[nuove.at[i, c]]]}
+        for i, c in diverse
+        if i not in conflitti
+    ]
+    for i in set(diverse.get_level_values(0)) - set(conflitti):
+        nuove.at[i, COLONNA_VERSIONE] = str(versione_letta[i] + 1)
+        celle.append({"range": rowcol_to_a1(riga_di[i], ver_col), "values": [[nuove.at[i, COLONNA_VERSIONE]]]})
+    # 🔹 Righe eliminate: solo la versione, negativa; la riga resta al suo posto
+    for i in eliminate:
+        if i not in conflitti:
+            celle.append({"range": rowcol_to_a1(riga_di[i], ver_col), "values": [[str(-(versione_letta[i] + 1))]]})
+    if celle:
+        sheet.batch_update(celle, value_input_option="RAW")
+
+    # 🔹 Righe nuove in coda, con versione 1
+    aggiunte = ~nuove.index.isin(vecchie.index)
+    nuove.loc[aggiunte, COLONNA_VERSIONE] = "1"
+    if intestazione or aggiunte.any():
+        sheet.append_rows(intestazione + nuove[aggiunte].values.tolist(), value_input_option="RAW")
+
+    # 🔹 Le righe in conflitto restano come erano state lette
+    in_conflitto = [i for i in conflitti if i in nuove.index]
+    nuove.loc[in_conflitto] = vecchie.loc[in_conflitto]
+    ripristinate = [i for i in eliminate if i in conflitti]
+    stato = pd.concat([nuove, vecchie.loc[ripristinate]])
+    return stato, conflitti
+
+def _remerge(sheet, colonne, vecchie, nuove, stato, conflitti):
+    """Riapplica le modifiche della sessione sulle righe in conflitto, rilette dallo Sheet."""
+    ultima = rowcol_to_a1(1, len(colonne))[:-1]
+    con_riga = {i: r for i, r in conflitti.items() if r is not None}
+    lette = sheet.batch_get([f"A{r}:{ultima}{r}" for r in con_riga.values()]) if con_riga else []
+    attuali = {}
+    for i, valori in zip(con_riga, lette):
+        riga = (list(valori[0]) if valori else []) + [""] * len(colonne)
+        riga = pd.Series(riga[:len(colonne)], index=colonne)
+        # la riga può essere stata spostata a mano: si riprova al giro successivo con la mappa aggiornata
+        if pd.to_numeric(riga["ID"], errors="coerce") != i:
+            continue
+        if _as_versions([riga[COLONNA_VERSIONE]])[0] < 0:
+            conflitti[i] = None   # eliminata nel frattempo da un altro utente
+        else:
+            attuali[i] = riga
+
+    base, updated = stato.copy(), stato.copy()
+    for i in conflitti:
+        if i not in attuali:
+            if conflitti[i] is None:
+                # eliminata da un altro utente: non c'è più nulla da aggiornare
+                base, updated = base.drop(index=i), updated.drop(index=i)
+            continue
+        base.loc[i] = attuali[i]
+        if i in nuove.index:
+            updated.loc[i] = _reapply_changes(vecchie.loc[i], nuove.loc[i], attuali[i])
+        else:
+            # 🔹 Eliminata qui ma modificata da un altro utente: vince la modifica, la riga resta
+            updated.loc[i] = attuali[i]
+    return base, updated
+
+def write_delta(sheet, base, updated):
+    """Scrive sullo Sheet solo le differenze tra l'ultimo stato noto (base) e quello nuovo.
+
+    Le celle modificate e le versioni negative delle righe eliminate partono in un'unica
+    batch_update, le righe nuove in coda con append_rows. Ogni riga scritta
+    incrementa la sua Versione: se nel frattempo un altro utente l'ha cambiata, le modifiche
+    vengono riapplicate sull'ultima versione e riprovate con backoff esponenziale; una riga
+    eliminata qui e modificata da altri non viene eliminata.
+    Restituisce il DataFrame aggiornato, tipizzato come se fosse stato riletto.
+    """
+    colonne, intestazione = sheet_columns(sheet, base)
+    if COLONNA_VERSIONE not in colonne:
+        # 🔹 Fogli creati prima della colonna Versione: la aggiunge in fondo all'intestazione
+        sheet.update(values=[[COLONNA_VERSIONE]], range_name=rowcol_to_a1(1, len(colonne) + 1))
+        colonne = colonne + [COLONNA_VERSIONE]
+
+    vecchie = _sheet_frame(base, colonne)
+    vecchie = vecchie[~vecchie.index.duplicated(keep="last")]
+    nuove = _sheet_frame(updated, colonne)
+
+    for tentativo in range(MAX_TENTATIVI + 1):
+        if tentativo:
+            time.sleep(BACKOFF_BASE * 2 ** (tentativo - 1) * random.uniform(0.5, 1.5))
+        stato, conflitti = _write_rows(sheet, colonne, intestazione, vecchie, nuove)
+        intestazione = []
+        if not conflitti:
+            return from_sheet_rows(stato.values.tolist(), colonne)
+        vecchie, nuove = _remerge(sheet, colonne, vecchie, nuove, stato, conflitti)
+
+    raise VersionConflict(list(conflitti))
+
+def _check_user_fields(modifiche):
+    ignote = {c for campi in modifiche.values() for c in campi} - set(COLONNE_UTENTI[1:])
+    if ignote:
+        raise ValueError(f"campi utente non validi: {sorted(ignote)}")
+
+def update_user_rows(sheet, modifiche):
+    """Aggiorna sul foglio Utenti solo le celle indicate e aggiunge gli utenti nuovi.
+
+    modifiche è {NomeUtente: {colonna: valore}}. Intestazione e colonna dei nomi (la A) si
+    leggono con una sola batch_get, poi le celle degli utenti esistenti partono in un'unica
+    batch_update: niente clear del foglio, quindi nessun momento in cui gli utenti mancano.
+    Gli utenti nuovi si aggiungono in coda con append_rows, come le attività: due admin che
+    aggiungono utenti insieme non scrivono sulla stessa riga. Le colonne assenti
+    dall'intestazione (es. Attivo sui fogli più vecchi) vengono aggiunte.
+    """
+    _check_user_fields(modifiche)
+    intestazione, nomi = sheet.batch_get(["1:1", "A2:A"])
+    intestazione = list(intestazione[0]) if intestazione else []
+    riga_di = {str(r[0]): i for i, r in enumerate(nomi, start=2) if r}
+
+    celle, nuovi = [], []
+    def colonna_di(colonna):
+        if colonna not in intestazione:
+            intestazione.append(colonna)
+            celle.append({"range": rowcol_to_a1(1, len(intestazione)), "values": [[colonna]]})
+        return intestazione.index(colonna) + 1
+
+    for nome, campi in modifiche.items():
+        riga = riga_di.get(nome)
+        if riga is None:
+            # 🔹 Utente nuovo: riga completa, scritta in coda
+            campi = {"NomeUtente": nome, "Password": "", "Ruolo": "utente", "Attivo": "1", **campi}
+            for colonna in campi:
+                colonna_di(colonna)
+            nuovi.append(campi)
+            continue
+        for colonna, valore in campi.items():
+            celle.append({"range": rowcol_to_a1(riga, colonna_di(colonna)), "values": [[str(valore)]]})
+    if celle:
+        sheet.batch_update(celle, value_input_option="RAW")
+    if nuovi:
+        sheet.append_rows(
+            [[str(campi.get(c, "")) for c in intestazione] for campi in nuovi],
+            value_input_option="RAW", table_range="A1",
+        )
+
+def migrate_dates(sheet, dry_run=False):
+    """Migrazione una tantum delle date dello Sheet dal formato storico a ISO 8601.
+
+    Legge solo la colonna Data e, se ci sono date storiche, la riscrive tutta con un'unica
+    update; le Versioni non cambiano perché il valore delle date resta lo stesso. Va eseguita
+    ad app ferma. Restituisce il numero di date convertite.
+    """
+    colonne = sheet.row_values(1)
+    if "Data" not in colonne:
+        return 0
+    col = colonne.index("Data") + 1
+    testo = pd.Series(sheet.col_values(col)[1:], dtype=object).fillna("").astype(str)
+    date = parse_dates(testo)
+    storiche = ~testo.str.contains("T", regex=False) & date.notna()
+    if storiche.any() and not dry_run:
+        nuove = testo.where(~storiche, format_dates(date))
+        lettera = rowcol_to_a1(1, col)[:-1]
+        sheet.update(
+            values=[[v] for v in nuove],
+            range_name=f"{lettera}2:{lettera}{len(nuove) + 1}",
+            value_input_option="RAW",
+        )
+    return int(storiche.sum())
+
+def compact_deleted(sheet, dry_run=False):
+    """Cancella fisicamente le righe eliminate (Versione negativa) di un foglio attività.
+
+    Cancellare sposta le righe successive, quindi va eseguita ad app ferma. Legge solo la
+    colonna Versione e manda tutte le cancellazioni in un'unica richiesta. Restituisce il
+    numero di righe cancellate.
+    """
+    colonne = sheet.row_values(1)
+    if COLONNA_VERSIONE not in colonne:
+        return 0
+    versioni = _as_versions(sheet.col_values(colonne.index(COLONNA_VERSIONE) + 1)[1:])
+    righe = [r for r, v in zip(range(2, len(versioni) + 2), versioni) if v < 0]
+    if righe and not dry_run:
+        # 🔹 Dal basso verso l'alto: ogni cancellazione non sposta quelle che la seguono
+        sheet.spreadsheet.batch_update({"requests": [
+            {"deleteDimension": {"range": {
+                "sheetId": sheet.id, "dimension": "ROWS", "startIndex": r - 1, "endIndex": r
+            }}}
+            for r in reversed(righe)
+        ]})
+    return len(righe)
+
+
+# =====================================
+# Snapshot locale (avvio rapido)
+# =====================================
+class LocalSnapshot:
+    """Copia su disco delle tabelle attività e utenti in formato Arrow IPC.
+
+    Viene scritta dopo ogni sincronizzazione riuscita e letta con memory map all'avvio, così
+    la prima pagina non aspetta Google Sheets. Con le attività si salva anche lo stato di
+    sincronizzazione e il backend che l'ha prodotto (sorgente): lo snapshot di un altro
+    backend viene ignorato. Le scritture sono atomiche (file temporaneo e rename). Le password
+    non vengono salvate; cartella e file sono leggibili solo dal proprietario.
+    """
+
+    def __init__(self, cartella):
+        self.cartella = cartella
+
+    def _path(self, nome):
+        return os.path.join(self.cartella, f"{nome}.arrow")
+
+    def _write(self, nome, df, metadati):
+        import pyarrow as pa
+
+        os.makedirs(self.cartella, mode=0o700, exist_ok=True)
+        tabella = pa.Table.from_pandas(df, preserve_index=False)
+        tabella = tabella.replace_schema_metadata({
+            **(tabella.schema.metadata or {}),
+            b"gestionale": json.dumps(metadati, default=lambda v: v.item()).encode(),
+        })
+        # mkstemp crea il file con permessi 0600, che il rename conserva
+        fd, temporaneo = tempfile.mkstemp(suffix=".tmp", dir=self.cartella)
+        try:
+            with os.fdopen(fd, "wb") as f, pa.ipc.new_file(f, tabella.schema) as scrittore:
+                scrittore.write_table(tabella)
+            os.replace(temporaneo, self._path(nome))
+        except BaseException:
+            os.remove(temporaneo)
+            raise
+
+    def _read(self, nome):
+        """(DataFrame, metadati) o None se il file manca o non è leggibile."""
+        try:
+            import pyarrow as pa
+
+            with pa.memory_map(self._path(nome)) as f:
+                tabella = pa.ipc.open_file(f).read_all()
+                metadati = json.loads(tabella.schema.metadata[b"gestionale"])
+                return tabella.to_pandas(), metadati
+        except Exception:
+            return None
+
+    def save_activities(self, df, stato, sorgente):
+        self._write("attivita", df, {"stato": stato, "sorgente": sorgente})
+
+    def load_activities(self, sorgente):
+        """(df, stato) dell'ultimo snapshot dello stesso backend, o None."""
+        letto = self._read("attivita")
+        if letto is None or letto[1].get("sorgente") != sorgente:
+            return None
+        return letto[0], letto[1]["stato"]
+
+    def save_users(self, df):
+        """Anagrafica senza la colonna Password."""
+        self._write("utenti", df.drop(columns="Password", errors="ignore"), {})
+
+    def load_users(self):
+        """Anagrafica senza password (tolte anche dagli snapshot scritti prima), o None."""
+        letto = self._read("utenti")
+        return None if letto is None else letto[0].drop(columns="Password", errors="ignore")
+
+
+# =====================================
+# Backend intercambiabili
+# =====================================
+def _in_range(date, inizio=None, fine=None):
+    mask = date.notna()
+    if inizio is not None:
+        mask &= date >= pd.Timestamp(inizio)
+    if fine is not None:
+        mask &= date < pd.Timestamp(fine) + pd.Timedelta(days=1)
+    return mask
+
+# Operazioni dei backend misurate in METRICHE come "store.<nome>"
+OPERAZIONI_STORE = [
+    "load_data", "load_range", "sync", "append_data", "write_delta", "reserve_ids",
+    "load_utenti", "save_utenti", "update_utenti",
+]
+
+def _instrument(cls):
+    """Avvolge con un timer le operazioni di OPERAZIONI_STORE implementate nella classe
+    (i metodi astratti restano come sono)."""
+    for nome in OPERAZIONI_STORE:
+        metodo = vars(cls).get(nome)
+        if metodo is not None and not getattr(metodo, "__isabstractmethod__", False):
+            setattr(cls, nome, METRICHE.timed(f"store.{nome}")(metodo))
+    return cls
+
+class ActivityStore(ABC):
+    """Interfaccia comune ai backend di persistenza di attività e utenti.
+
+    Un backend che non implementa tutti i metodi astratti non si può istanziare. Le
+    operazioni di OPERAZIONI_STORE di ogni sottoclasse vengono misurate automaticamente.
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        _instrument(cls)
+
+    @abstractmethod
+    def load_data(self):
+        """Tutte le attività, tipizzate come da prepare_data."""
+
+    def load_range(self, inizio=None, fine=None):
+        """Attività con Data fra inizio e fine (date incluse; None = senza limite)."""
+        df = self.load_data()
+        return df[_in_range(df["Data"], inizio, fine)]
+
+    def sync(self, df=None, stato=None):
+        """Aggiorna df (letto con stato) alle modifiche successive; restituisce (df, stato).
+
+        Senza df o stato rilegge tutto. I backend che non sanno fare di meglio rileggono sempre.
+        """
+        return self.load_data(), None
+
+    @abstractmethod
+    def append_data(self, base, righe):
+        """Aggiunge righe nuove; restituisce le righe come sono state salvate."""
+
+    @abstractmethod
+    def write_delta(self, base, updated):
+        """Salva le differenze fra base e updated; restituisce il nuovo stato completo."""
+
+    def next_id(self):
+        """Prossimo ID libero, dal blocco riservato a questo processo (self.ids)."""
+        return self.ids.next_id()
+
+    def next_ids(self, n):
+        """n ID liberi, per gli inserimenti multipli."""
+        return self.ids.next_ids(n)
+
+    @abstractmethod
+    def reserve_ids(self, n):
+        """Riserva in esclusiva n ID consecutivi e restituisce il primo."""
+
+    @abstractmethod
+    def load_utenti(self):
+        """Anagrafica utenti con le colonne di COLONNE_UTENTI."""
+
+    @abstractmethod
+    def save_utenti(self, df):
+        """Sostituisce l'anagrafica utenti con df."""
+
+    def update_utenti(self, modifiche):
+        """Modifiche in blocco {NomeUtente: {colonna: valore}}: aggiorna gli utenti esistenti
+        (password, ruolo, Attivo) e aggiunge quelli nuovi."""
+        _check_user_fields(modifiche)
+        df = self.load_utenti().reindex(columns=COLONNE_UTENTI).astype(object).set_index("NomeUtente")
+        for nome, campi in modifiche.items():
+            if nome not in df.index:
+                df.loc[nome] = {"Password": "", "Ruolo": "utente", "Attivo": "1"}
+            for colonna, valore in campi.items():
+                df.loc[nome, colonna] = str(valore)
+        self.save_utenti(df.fillna({"Attivo": "1"}).reset_index())
+
+_instrument(ActivityStore)
+
+class GoogleSheetsStore(ActivityStore):
+    """Attività sul primo foglio dello Sheet, utenti sul foglio "Utenti"."""
+
+    def __init__(self, connessione, sheet_name, worksheet=0, worksheet_utenti="Utenti",
+                 worksheet_contatori=FOGLIO_CONTATORI):
+        self.connessione = connessione
+        self.sheet_name = sheet_name
+        self.worksheet = worksheet
+        self.worksheet_utenti = worksheet_utenti
+        self.worksheet_contatori = worksheet_contatori
+        self.ids = IdAllocator(self.reserve_ids)
+
+    @property
+    def sheet(self):
+        # Chiesto ogni volta alla connessione: l'handle cambia quando il token viene rinnovato
+        return self.connessione.worksheet(self.sheet_name, self.worksheet)
+
+    def load_data(self):
+        return load_data(self.sheet)
+
+    def sync(self, df=None, stato=None):
+        return sync_data(self.sheet, df, stato)
+
+    def append_data(self, base, righe):
+        return append_sheet_rows(self.sheet, base, righe)
+
+    def write_delta(self, base, updated):
+        return write_delta(self.sheet, base, updated)
+
+    def _max_id(self):
+        return next_id(self.sheet) - 1
+
+    def reserve_ids(self, n):
+        try:
+            contatori = self.connessione.worksheet(self.sheet_name, self.worksheet_contatori)
+        except gspread.WorksheetNotFound:
+            # 🔹 Primo uso: la base è l'ID massimo già presente. Foglio e righe nascono insieme,
+            # così la riserva di un altro processo non finisce mai dove andrà la base
+            try:
+                add_filled_worksheet(
+                    self.connessione.spreadsheet(self.sheet_name), self.worksheet_contatori,
+                    [COLONNE_CONTATORI, ["base", self._max_id(), datetime.now().strftime(FORMATO_DATA)]],
+                )
+            except gspread.exceptions.APIError:
+                pass   # creato nel frattempo da un altro processo
+            contatori = self.connessione.worksheet(self.sheet_name, self.worksheet_contatori)
+        return lease_ids(contatori, n)
+
+    def load_utenti(self):
+        ws = self.connessione.worksheet(self.sheet_name, self.worksheet_utenti)
+        # Valori come testo: una password di sole cifre non deve diventare un numero
+        df = pd.DataFrame(ws.get_all_records(numericise_ignore=["all"]))
+        if df.empty:
+            df = pd.DataFrame(columns=COLONNE_UTENTI)
+        return df
+
+    def save_utenti(self, df):
+        ws = self.connessione.worksheet(self.sheet_name, self.worksheet_utenti)
+        ws.clear()
+        ws.update([df.columns.tolist()] + df.astype(str).values.tolist())
+
+    def update_utenti(self, modifiche):
+        update_user_rows(self.connessione.worksheet(self.sheet_name, self.worksheet_utenti), modifiche)
+
+
+# Partizioni temporali: un foglio per anno o per mese, elencati nel foglio "Partizioni"
+FOGLIO_PARTIZIONI = "Partizioni"
+COLONNE_PARTIZIONI = ["Nome", "Inizio", "Fine", "Sigillata", "Revisione"]
+PREFISSO_PARTIZIONE = "Attivita_"
+PERIODI = {"anno": "%Y", "mese": "%Y-%m"}
+
+def _giorno(data):
+    return "" if pd.isna(data) else pd.Timestamp(data).strftime("%Y-%m-%d")
+
+def _revisione():
+    return f"{random.getrandbits(48):012x}"
+
+def _concat_partitions(parti):
+    """Unisce le righe delle partizioni; le categorie diverse fra le parti vengono riunite."""
+    parti = [p for p in parti if not p.empty]
+    if not parti:
+        return pd.DataFrame(columns=COLONNE_ATTIVITA + [COLONNA_PARTIZIONE])
+    return _partition_schema(pd.concat(parti, ignore_index=True))
+
+def _partition_schema(df):
+    """Tipi di SCHEMA_MEMORIA sulle righe unite da più partizioni.
+
+    Le righe dei fogli senza colonna Versione (o altre numeriche) valgono 0 come in prepare_data.
+    """
+    for col in COLONNE_NUMERICHE:
+        if col in df.columns:
+            df[col] = df[col].fillna(0)
+    df[COLONNA_PARTIZIONE] = df[COLONNA_PARTIZIONE].astype("category")
+    return apply_schema(df)
+
+class PartitionedSheetsStore(GoogleSheetsStore):
+    """Attività suddivise in un foglio per periodo (anno o mese) dello stesso Sheet.
+
+    Il foglio "Partizioni" è il catalogo: nome, intervallo di date [Inizio, Fine), stato e
+    Revisione di ogni partizione. Il primo foglio, con lo storico, diventa la partizione
+    d'archivio. Le righe nuove vanno nella partizione del periodo della loro data; quelle
+    modificate restano dove sono, finché la data non esce dall'intervallo della partizione.
+    rollover sigilla le partizioni dei periodi conclusi: la sincronizzazione le rilegge solo
+    se la loro Revisione, rinnovata ad ogni scrittura, è cambiata. In memoria ogni riga porta
+    il nome della sua partizione nella colonna derivata Partizione.
+
+    Le pagine dell'app filtrano per data lo snapshot condiviso in memoria (ActivityCache), non
+    lo store: dopo la prima lettura ogni sync legge il catalogo e le sole partizioni aperte, e
+    le sigillate tornano dalla cache finché la loro Revisione non cambia, quindi nessuna pagina
+    rilegge i periodi che non mostra. load_range serve alle letture fuori dallo snapshot.
+    """
+
+    def __init__(self, connessione, sheet_name, periodo="anno", worksheet=0,
+                 worksheet_utenti="Utenti", worksheet_partizioni=FOGLIO_PARTIZIONI):
+        if periodo not in PERIODI:
+            raise ValueError(f"periodo non valido: {periodo!r} (ammessi: {', '.join(PERIODI)})")
+        super().__init__(connessione, sheet_name, worksheet, worksheet_utenti)
+        self.periodo = periodo
+        self.worksheet_partizioni = worksheet_partizioni
+        self._lock = threading.RLock()
+        self._catalogo = None
+        self._intestazioni = {}   # partizione → colonne del foglio
+        self._sigillate = {}      # partizione sigillata → (Revisione, df, righe del foglio) dell'ultima lettura
+        self._periodo = None      # partizione corrente all'ultimo rollover
+
+    def _ws(self, nome):
+        return self.connessione.worksheet(self.sheet_name, nome)
+
+    def partition_of(self, data):
+        """Nome della partizione del periodo che contiene data."""
+        return PREFISSO_PARTIZIONE + pd.Timestamp(data).strftime(PERIODI[self.periodo])
+
+    def _bounds(self, nome):
+        inizio = pd.Timestamp(nome[len(PREFISSO_PARTIZIONE):])
+        passo = pd.DateOffset(years=1) if self.periodo == "anno" else pd.DateOffset(months=1)
+        return inizio, inizio + passo
+
+    # ---------- Catalogo ----------
+    def _partitions(self, rileggi=False):
+        """Catalogo delle partizioni indicizzato per nome (in cache finché non si chiede di rileggerlo)."""
+        with self._lock:
+            if self._catalogo is not None and not rileggi:
+                return self._catalogo
+            try:
+                valori = self._ws(self.worksheet_partizioni).get_all_values()
+            except gspread.WorksheetNotFound:
+                valori = self._create_catalog()
+            catalogo = pd.DataFrame(
+                [(list(r) + [""] * len(COLONNE_PARTIZIONI))[:len(COLONNE_PARTIZIONI)] for r in valori[1:]],
+                columns=COLONNE_PARTIZIONI,
+            )
+            catalogo["Riga"] = range(2, len(catalogo) + 2)
+            # Due processi possono registrare la stessa partizione: vale la prima riga
+            catalogo = catalogo[catalogo["Nome"].ne("")].drop_duplicates("Nome")
+            for col in ("Inizio", "Fine"):
+                catalogo[col] = pd.to_datetime(catalogo[col], format="%Y-%m-%d", errors="coerce")
+            catalogo["Sigillata"] = catalogo["Sigillata"].eq("1")
+            self._catalogo = catalogo.set_index("Nome", drop=False)
+            return self._catalogo
+
+    def _create_catalog(self):
+        """Crea il catalogo con il primo foglio come archivio sigillato, delimitato dalle sue date."""
+        archivio = self.connessione.worksheet(self.sheet_name, self.worksheet)
+        colonne = archivio.row_values(1)
+        date = pd.Series(dtype="datetime64[ns]")
+        if "Data" in colonne:
+            date = parse_dates(pd.Series(archivio.col_values(colonne.index("Data") + 1)[1:], dtype=object)).dropna()
+        inizio = date.min().normalize() if not date.empty else pd.NaT
+        fine = date.max().normalize() + pd.Timedelta(days=1) if not date.empty else pd.NaT
+        valori = [COLONNE_PARTIZIONI, [archivio.title, _giorno(inizio), _giorno(fine), "1", _revisione()]]
+        try:
+            add_filled_worksheet(self.connessione.spreadsheet(self.sheet_name), self.worksheet_partizioni, valori, rows=100)
+        except gspread.exceptions.APIError:
+            # creato nel frattempo da un altro processo
+            return self._ws(self.worksheet_partizioni).get_all_values()
+        return valori
+
+    def _ensure(self, nome):
+        """Crea la partizione (foglio con intestazione e riga nel catalogo) se non esiste ancora."""
+        with self._lock:
+            if nome in self._partitions().index or nome in self._partitions(rileggi=True).index:
+                return
+            inizio, fine = self._bounds(nome)
+            try:
+                ws = self.connessione.spreadsheet(self.sheet_name).add_worksheet(
+                    title=nome, rows=1000, cols=len(COLONNE_ATTIVITA)
+                )
+                ws.update(values=[COLONNE_ATTIVITA], range_name="A1", value_input_option="RAW")
+            except gspread.exceptions.APIError:
+                pass   # foglio creato nel frattempo da un altro processo
+            sigillata = fine <= self._bounds(self.partition_of(pd.Timestamp.now()))[0]
+            # 🔹 Nel catalogo solo dopo l'intestazione: chi legge il catalogo trova il foglio pronto
+            self._ws(self.worksheet_partizioni).append_rows(
+                [[nome, _giorno(inizio), _giorno(fine), "1" if sigillata else "", _revisione()]],
+                value_input_option="RAW",
+            )
+            self._partitions(rileggi=True)
+
+    def _touch(self, nome):
+        """Nuova Revisione dopo una scrittura, se la partizione è (o sta per essere) sigillata."""
+        with self._lock:
+            catalogo = self._partitions()
+            riga = catalogo.loc[nome]
+            corrente = self._bounds(self.partition_of(pd.Timestamp.now()))[0]
+            # 🔹 Anche se il catalogo in cache non la dà ancora per sigillata: rollover può averlo appena fatto
+            if not (riga["Sigillata"] or (pd.notna(riga["Fine"]) and riga["Fine"] <= corrente)):
+                return
+            revisione = _revisione()
+            self._ws(self.worksheet_partizioni).update(
+                values=[[revisione]],
+                range_name=rowcol_to_a1(riga["Riga"], COLONNE_PARTIZIONI.index("Revisione") + 1),
+                value_input_option="RAW",
+            )
+            catalogo.loc[nome, "Revisione"] = revisione
+
+    def rollover(self, oggi=None):
+        """Sigilla le partizioni dei periodi conclusi e crea quella del periodo corrente.
+
+        Costa una lettura del catalogo e scrive solo al cambio di periodo. Restituisce il catalogo.
+        """
+        corrente = self.partition_of(oggi if oggi is not None else pd.Timestamp.now())
+        with self._lock:
+            catalogo = self._partitions(rileggi=True)
+            inizio = self._bounds(corrente)[0]
+            scadute = catalogo[~catalogo["Sigillata"] & catalogo["Fine"].notna() & (catalogo["Fine"] <= inizio)]
+            if not scadute.empty:
+                colonna = COLONNE_PARTIZIONI.index("Sigillata") + 1
+                self._ws(self.worksheet_partizioni).batch_update(
+                    [{"range": rowcol_to_a1(r, colonna), "values": [["1"]]} for r in scadute["Riga"]],
+                    value_input_option="RAW",
+                )
+                catalogo.loc[scadute.index, "Sigillata"] = True
+            if corrente not in catalogo.index:
+                self._ensure(corrente)
+            self._periodo = corrente
+            return self._catalogo
+
+    # ---------- Lettura ----------
+    def _columns(self, nome):
+        with self._lock:
+            if nome not in self._intestazioni:
+                self._intestazioni[nome] = self._ws(nome).row_values(1) or list(COLONNE_ATTIVITA)
+            return self._intestazioni[nome]
+
+    def _read_partition(self, nome):
+        """Righe di una partizione e righe dati del suo foglio (stato di sync_data); quelle
+        sigillate vengono riusate finché la Revisione non cambia."""
+        riga = self._partitions().loc[nome]
+        letta = self._sigillate.get(nome)
+        if riga["Sigillata"] and letta is not None and letta[0] == riga["Revisione"]:
+            return letta[1:]
+        df, righe = _read_sheet(self._ws(nome))
+        if not df.empty:
+            self._intestazioni[nome] = stored_columns(df)
+        df = df.assign(**{COLONNA_PARTIZIONE: nome})
+        if riga["Sigillata"]:
+            self._sigillate[nome] = (riga["Revisione"], df, righe)
+        return df, righe
+
+    def load_data(self):
+        catalogo = self._partitions(rileggi=True)
+        return _concat_partitions([self._read_partition(nome)[0] for nome in catalogo.index])
+
+    def load_range(self, inizio=None, fine=None):
+        """Legge solo le partizioni il cui intervallo si sovrappone al periodo richiesto."""
+        catalogo = self._partitions(rileggi=True)
+        sovrapposte = pd.Series(True, index=catalogo.index)
+        if fine is not None:
+            sovrapposte &= catalogo["Inizio"].isna() | (catalogo["Inizio"] < pd.Timestamp(fine) + pd.Timedelta(days=1))
+        if inizio is not None:
+            sovrapposte &= catalogo["Fine"].isna() | (catalogo["Fine"] > pd.Timestamp(inizio))
+        df = _concat_partitions([self._read_partition(nome)[0] for nome in catalogo.index[sovrapposte]])
+        return df[_in_range(df["Data"], inizio, fine)]
+
+    def sync(self, df=None, stato=None):
+        """Sincronizzazione partizione per partizione; stato è {partizione: (stato di sync_data, Revisione)}.
+
+        Le partizioni aperte si sincronizzano in modo incrementale con sync_data, quelle sigillate
+        solo se la Revisione è cambiata dall'ultima lettura: il costo non cresce con lo storico.
+        rollover si esegue solo al cambio di periodo; negli altri casi basta rileggere il
+        catalogo, che porta le Revisioni scritte dagli altri processi e le partizioni nuove.
+        """
+        if self.partition_of(pd.Timestamp.now()) != self._periodo:
+            catalogo = self.rollover()
+        else:
+            catalogo = self._partitions(rileggi=True)
+        if df is None or stato is None or COLONNA_PARTIZIONE not in df.columns:
+            parti = {nome: self._read_partition(nome) for nome in catalogo.index}
+            stato = {nome: (righe, catalogo.at[nome, "Revisione"]) for nome, (_, righe) in parti.items()}
+            return _concat_partitions([parte for parte, _ in parti.values()]), stato
+
+        nuovo_stato = {}
+        for nome in catalogo.index:
+            revisione = catalogo.at[nome, "Revisione"]
+            precedente = stato.get(nome)
+            if precedente is not None and catalogo.at[nome, "Sigillata"] and precedente[1] == revisione:
+                nuovo_stato[nome] = precedente
+                continue
+            parte = df[df[COLONNA_PARTIZIONE] == nome]
+            if precedente is None:
+                letta, stato_parte = self._read_partition(nome)
+            else:
+                vista = parte.reindex(columns=self._columns(nome))
+                letta, stato_parte = sync_data(self._ws(nome), vista, precedente[0])
+                if letta is vista:
+                    nuovo_stato[nome] = (stato_parte, revisione)
+                    continue
+                letta = letta.assign(**{COLONNA_PARTIZIONE: nome})
+                if catalogo.at[nome, "Sigillata"]:
+                    self._sigillate[nome] = (revisione, letta, stato_parte)
+            df = upsert_rows(df, letta, parte["ID"][~parte["ID"].isin(letta["ID"])])
+            nuovo_stato[nome] = (stato_parte, revisione)
+
+        # 🔹 Partizioni tolte dal catalogo
+        rimaste = df[COLONNA_PARTIZIONE].isin(catalogo.index)
+        if not rimaste.all():
+            df = df[rimaste].reset_index(drop=True)
+        return df, nuovo_stato
+
+    # ---------- Scrittura ----------
+    def _route(self, righe):
+        """Partizione di destinazione: quella della riga se la data vi rientra (o manca),
+        altrimenti quella del periodo della data; le righe senza partizione né data vanno
+        nel periodo corrente."""
+        catalogo = self._partitions()
+        date = parse_dates(righe["Data"]) if "Data" in righe.columns else pd.Series(pd.NaT, index=righe.index)
+        if COLONNA_PARTIZIONE in righe.columns:
+            attuale = righe[COLONNA_PARTIZIONE].astype(object)
+        else:
+            attuale = pd.Series(None, index=righe.index, dtype=object)
+        inizio = pd.to_datetime(attuale.map(catalogo["Inizio"]))
+        fine = pd.to_datetime(attuale.map(catalogo["Fine"]))
+        dentro = attuale.isin(catalogo.index) & (
+            date.isna() | ((inizio.isna() | (date >= inizio)) & (fine.isna() | (date < fine)))
+        )
+        periodo = PREFISSO_PARTIZIONE + date.dt.strftime(PERIODI[self.periodo])
+        return attuale.where(dentro, periodo).fillna(self.partition_of(pd.Timestamp.now()))
+
+    def append_data(self, base, righe):
+        destinazioni = self._route(righe.drop(columns=COLONNA_PARTIZIONE, errors="ignore"))
+        salvate = []
+        for nome, gruppo in righe.groupby(destinazioni.values, sort=False):
+            self._ensure(nome)
+            presenti = base[base[COLONNA_PARTIZIONE] == nome] if COLONNA_PARTIZIONE in base.columns else base.iloc[:0]
+            scritte = append_sheet_rows(self._ws(nome), presenti.reindex(columns=self._columns(nome)), gruppo)
+            salvate.append(scritte.assign(**{COLONNA_PARTIZIONE: nome}))
+            self._touch(nome)
+        return pd.concat(salvate, ignore_index=True)
+
+    def write_delta(self, base, updated):
+        """Scrive le differenze toccando solo le partizioni delle righe cambiate.
+
+        Ogni partizione riceve da write_delta le sole righe toccate (con controllo di versione).
+        Una riga la cui data esce dall'intervallo della sua partizione viene spostata: eliminata
+        da quella vecchia e aggiunta a quella del nuovo periodo, con versione 1.
+        """
+        colonne = [c for c in COLONNE_ATTIVITA if c in base.columns or c in updated.columns]
+        vecchie = _sheet_frame(base, colonne)
+        vecchie = vecchie[~vecchie.index.duplicated(keep="last")]
+        nuove = _sheet_frame(updated, colonne)
+        diverse, eliminate = _changes(vecchie, nuove)
+
+        origine = base.drop_duplicates("ID", keep="last").set_index("ID")
+        origine = origine[COLONNA_PARTIZIONE].astype(object) if COLONNA_PARTIZIONE in origine.columns \
+            else pd.Series(None, index=origine.index, dtype=object)
+        destinazione = pd.Series(self._route(updated).values, index=updated["ID"].values)
+        comuni = destinazione.index[destinazione.index.isin(origine.index)]
+        spostate = comuni[destinazione[comuni].values != origine[comuni].values]
+        toccate = (
+            set(diverse.get_level_values(0)) | set(eliminate) | set(spostate)
+            | set(nuove.index.difference(vecchie.index))
+        )
+        if not toccate:
+            return base
+
+        da = origine[origine.index.isin(toccate)]
+        a = destinazione[destinazione.index.isin(toccate)]
+        scritte = []
+        for nome in dict.fromkeys(list(da.dropna()) + list(a)):
+            self._ensure(nome)
+            intestazione = self._columns(nome)
+            risultato = write_delta(
+                self._ws(nome),
+                base[base["ID"].isin(da.index[da.values == nome])].reindex(columns=intestazione),
+                updated[updated["ID"].isin(a.index[a.values == nome])].reindex(columns=intestazione),
+            )
+            self._intestazioni[nome] = stored_columns(risultato)
+            scritte.append(risultato.assign(**{COLONNA_PARTIZIONE: nome}))
+            self._touch(nome)
+
+        scritte = pd.concat(scritte, ignore_index=True)
+        eliminati = [i for i in da.index if i not in set(scritte["ID"])]
+        # 🔹 Una partizione appena dotata della colonna Versione la porta anche nelle altre righe
+        return _partition_schema(upsert_rows(base, scritte, eliminati))
+
+    def _max_id(self):
+        """ID massimo fra tutte le partizioni, con una sola lettura della colonna ID di ognuna."""
+        intervalli = [f"'{nome}'!A2:A" for nome in self._partitions().index]
+        risposta = self.connessione.spreadsheet(self.sheet_name).values_batch_get(
+            intervalli, params={"majorDimension": "COLUMNS"}
+        )
+        valori = [v for r in risposta.get("valueRanges", []) for v in (r.get("values") or [[]])[0]]
+        ids = pd.to_numeric(pd.Series(valori, dtype=object), errors="coerce")
+        return int(ids.max()) if ids.notna().any() else 0
+
+
+SCHEMA_SQLITE = """
+CREATE TABLE IF NOT EXISTS attivita (
+    ID INTEGER PRIMARY KEY,              -- la chiave primaria è anche l'indice su ID
+    NomeUtente TEXT NOT NULL DEFAULT '',
+    Data TEXT,                           -- ISO "AAAA-MM-GG HH:MM", ordinabile
+    MacroAttivita TEXT NOT NULL DEFAULT '',
+    Tipologia TEXT NOT NULL DEFAULT '',
+    Attivita TEXT NOT NULL DEFAULT '',
+    Note TEXT NOT NULL DEFAULT '',
+    Ore INTEGER NOT NULL DEFAULT 0,
+    Minuti INTEGER NOT NULL DEFAULT 0,
+    NumCampioni INTEGER NOT NULL DEFAULT 0,
+    TipoMalattia TEXT NOT NULL DEFAULT '',
+    NumReferti INTEGER NOT NULL DEFAULT 0,
+    TipoMalattiaRef TEXT NOT NULL DEFAULT '',
+    Versione INTEGER NOT NULL DEFAULT 1,
+    Sequenza INTEGER NOT NULL DEFAULT 0  -- transazione dell'ultimo inserimento o modifica
+);
+CREATE INDEX IF NOT EXISTS idx_attivita_utente ON attivita (NomeUtente);
+CREATE INDEX IF NOT EXISTS idx_attivita_data ON attivita (Data);
+CREATE TABLE IF NOT EXISTS eliminazioni (
+    ID INTEGER PRIMARY KEY,
+    Sequenza INTEGER NOT NULL            -- transazione che ha eliminato la riga
+);
+CREATE INDEX IF NOT EXISTS idx_eliminazioni_sequenza ON eliminazioni (Sequenza);
+CREATE TABLE IF NOT EXISTS contatori (
+    Nome TEXT PRIMARY KEY,
+    Valore INTEGER NOT NULL              -- ultimo valore riservato
+);
+CREATE TABLE IF NOT EXISTS utenti (
+    NomeUtente TEXT PRIMARY KEY,
+    Password TEXT NOT NULL,
+    Ruolo TEXT NOT NULL,
+    Attivo TEXT NOT NULL DEFAULT '1'
+);
+"""
+
+class SQLiteStore(ActivityStore):
+    """Database SQLite locale, utilizzabile senza rete.
+
+    Inserimenti, modifiche ed eliminazioni avvengono in transazioni BEGIN IMMEDIATE: il
+    controllo di versione e la scrittura sono atomici anche fra più processi. I conflitti si
+    risolvono come su Sheets: le modifiche si riapplicano sull'ultima versione e una riga
+    modificata da altri dopo la lettura non viene eliminata.
+
+    Ogni transazione che scrive attività prende un numero dal contatore Sequenza e lo lascia
+    sulle righe inserite o modificate (colonna Sequenza) e su quelle eliminate (tabella
+    eliminazioni). Le transazioni sono serializzate, quindi i numeri seguono l'ordine dei
+    commit: sync legge solo quanto scritto dopo l'ultima sequenza vista, con qualsiasi ID.
+    """
+
+    FORMATO_DB = "%Y-%m-%d %H:%M"
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Database creati prima della colonna Sequenza: le righe esistenti valgono 0
+        tabelle = [r[0] for r in self._conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        if "attivita" in tabelle and "Sequenza" not in [r[1] for r in self._conn.execute("PRAGMA table_info(attivita)")]:
+            self._conn.execute("ALTER TABLE attivita ADD COLUMN Sequenza INTEGER NOT NULL DEFAULT 0")
+        self._conn.executescript(SCHEMA_SQLITE)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_attivita_sequenza ON attivita (Sequenza)")
+        # Database creati prima della colonna Attivo
+        if "Attivo" not in [r[1] for r in self._conn.execute("PRAGMA table_info(utenti)")]:
+            self._conn.execute("ALTER TABLE utenti ADD COLUMN Attivo TEXT NOT NULL DEFAULT '1'")
+        self.ids = IdAllocator(self.reserve_ids)
+
+    @contextmanager
+    def _transazione(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    @staticmethod
+    def _sequence(conn):
+        """Numero della transazione in corso per Sequenza: il contatore sale di uno."""
+        conn.execute("INSERT OR IGNORE INTO contatori VALUES ('Sequenza', 0)")
+        conn.execute("UPDATE contatori SET Valore = Valore + 1 WHERE Nome = 'Sequenza'")
+        return conn.execute("SELECT Valore FROM contatori WHERE Nome = 'Sequenza'").fetchone()[0]
+
+    def _insert(self, conn, valori):
+        """INSERT delle righe di _db_rows, marcate con una nuova Sequenza."""
+        sequenza = self._sequence(conn)
+        segnaposto = ",".join("?" * (len(COLONNE_ATTIVITA) + 1))
+        conn.executemany(
+            f"INSERT INTO attivita ({', '.join(COLONNE_ATTIVITA)}, Sequenza) VALUES ({segnaposto})",
+            [v + (sequenza,) for v in valori],
+        )
+
+    def _db_rows(self, df):
+        """Righe pronte per l'INSERT/UPDATE, con la data in formato ISO."""
+        df = df.reindex(columns=COLONNE_ATTIVITA).copy()
+        df["Data"] = parse_dates(df["Data"]).dt.strftime(self.FORMATO_DB)
+        for col in COLONNE_NUMERICHE:
+            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0).astype(int)
+        df = df.astype(object)
+        testo = [c for c in COLONNE_ATTIVITA if c not in COLONNE_NUMERICHE + ["ID", "Data"]]
+        df[testo] = df[testo].fillna("")
+        return list(df.where(df.notna(), None).itertuples(index=False, name=None))
+
+    def _read(self, where="", params=()):
+        df = pd.read_sql_query(
+            f"SELECT {', '.join(COLONNE_ATTIVITA)} FROM attivita {where} ORDER BY ID", self._conn, params=params
+        )
+        return prepare_data(df, self.FORMATO_DB)
+
+    def load_data(self):
+        with self._lock:
+            return self._read()
+
+    def load_range(self, inizio=None, fine=None):
+        """Solo le righe del periodo, selezionate dall'indice su Data."""
+        condizioni, params = ["Data IS NOT NULL"], []
+        if inizio is not None:
+            condizioni.append("Data >= ?")
+            params.append(pd.Timestamp(inizio).strftime(self.FORMATO_DB))
+        if fine is not None:
+            condizioni.append("Data < ?")
+            params.append((pd.Timestamp(fine) + pd.Timedelta(days=1)).strftime(self.FORMATO_DB))
+        with self._lock:
+            return self._read("WHERE " + " AND ".join(condizioni), params)
+
+    def _last_sequence(self):
+        (sequenza,) = self._conn.execute("SELECT Valore FROM contatori WHERE Nome = 'Sequenza'").fetchone() or (0,)
+        return sequenza
+
+    def sync(self, df=None, stato=None):
+        """Lo stato è {"sequenza": ultima Sequenza letta}: si leggono solo le righe inserite o
+        modificate dopo (con l'indice su Sequenza) e gli ID eliminati dopo, qualunque sia l'ID."""
+        with self._lock:
+            # 🔹 Lettura in una transazione: righe e sequenza dallo stesso istante del database
+            self._conn.execute("BEGIN")
+            try:
+                if df is None or not isinstance(stato, dict) or COLONNA_VERSIONE not in df.columns:
+                    return self._read(), {"sequenza": self._last_sequence()}
+                sequenza = self._last_sequence()
+                if sequenza == stato["sequenza"]:
+                    return df, stato
+                nuove = self._read("WHERE Sequenza > ?", (stato["sequenza"],))
+                eliminate = pd.read_sql_query(
+                    "SELECT ID FROM eliminazioni WHERE Sequenza > ?", self._conn, params=(stato["sequenza"],)
+                )["ID"]
+            finally:
+                self._conn.execute("COMMIT")
+        return upsert_rows(df, nuove, eliminate[~eliminate.isin(nuove["ID"])]), {"sequenza": sequenza}
+
+    def append_data(self, base, righe):
+        righe = righe.copy()
+        righe[COLONNA_VERSIONE] = 1
+        valori = self._db_rows(righe)
+        with self._transazione() as conn:
+            self._insert(conn, valori)
+        return from_sheet_rows(to_sheet_rows(righe, COLONNE_ATTIVITA), COLONNE_ATTIVITA)
+
+    def write_delta(self, base, updated):
+        vecchie = _sheet_frame(base, COLONNE_ATTIVITA)
+        vecchie = vecchie[~vecchie.index.duplicated(keep="last")]
+        nuove = _sheet_frame(updated, COLONNE_ATTIVITA)
+        diverse, eliminate = _changes(vecchie, nuove)
+        cambiate = list(dict.fromkeys(diverse.get_level_values(0)))
+        toccate = cambiate + list(eliminate)
+
+        assegnazioni = ", ".join(f"{c} = ?" for c in COLONNE_ATTIVITA[1:])
+        with self._transazione() as conn:
+            # 🔹 Stato attuale delle righe toccate, letto dentro la transazione
+            attuali = pd.DataFrame(columns=COLONNE_ATTIVITA)
+            if toccate:
+                segnaposto = ",".join("?" * len(toccate))
+                attuali = self._read(f"WHERE ID IN ({segnaposto})", [int(i) for i in toccate])
+                attuali = _sheet_frame(attuali, COLONNE_ATTIVITA)
+
+            aggiornate = []
+            for i in cambiate:
+                if i not in attuali.index:
+                    # eliminata da un altro utente: non c'è più nulla da aggiornare
+                    nuove = nuove.drop(index=i)
+                    continue
+                riga = nuove.loc[i]
+                if attuali.at[i, COLONNA_VERSIONE] != vecchie.at[i, COLONNA_VERSIONE]:
+                    riga = _reapply_changes(vecchie.loc[i], riga, attuali.loc[i])
+                riga[COLONNA_VERSIONE] = str(int(attuali.at[i, COLONNA_VERSIONE]) + 1)
+                nuove.loc[i] = riga
+                aggiornate.append(i)
+
+            sequenza = self._sequence(conn) if aggiornate or len(eliminate) else None
+            if aggiornate:
+                valori = self._db_rows(from_sheet_rows(nuove.loc[aggiornate].values.tolist(), COLONNE_ATTIVITA))
+                conn.executemany(
+                    f"UPDATE attivita SET {assegnazioni}, Sequenza = ? WHERE ID = ?",
+                    [v[1:] + (sequenza,) + v[:1] for v in valori],
+                )
+            # 🔹 Eliminazioni solo se la riga è ancora alla versione letta, altrimenti resta
+            # con la modifica dell'altro utente
+            eliminabili = []
+            for i in eliminate:
+                if i not in attuali.index:
+                    continue
+                if attuali.at[i, COLONNA_VERSIONE] == vecchie.at[i, COLONNA_VERSIONE]:
+                    eliminabili.append((int(i),))
+                else:
+                    nuove.loc[i] = attuali.loc[i]
+            if eliminabili:
+                conn.executemany("DELETE FROM attivita WHERE ID = ?", eliminabili)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO eliminazioni VALUES (?, ?)", [(i, sequenza) for (i,) in eliminabili]
+                )
+
+            aggiunte = ~nuove.index.isin(vecchie.index)
+            nuove.loc[aggiunte, COLONNA_VERSIONE] = "1"
+            if aggiunte.any():
+                valori = self._db_rows(from_sheet_rows(nuove[aggiunte].values.tolist(), COLONNE_ATTIVITA))
+                self._insert(conn, valori)
+
+        return from_sheet_rows(nuove.values.tolist(), COLONNE_ATTIVITA)
+
+    def reserve_ids(self, n):
+        """Incremento atomico del contatore "ID" in una transazione; non scende mai sotto MAX(ID)."""
+        with self._transazione() as conn:
+            (contatore,) = conn.execute("SELECT MAX(Valore) FROM contatori WHERE Nome = 'ID'").fetchone()
+            (massimo,) = conn.execute("SELECT MAX(ID) FROM attivita").fetchone()
+            ultimo = max(contatore or 0, massimo or 0)
+            conn.execute("INSERT OR REPLACE INTO contatori VALUES ('ID', ?)", (ultimo + n,))
+        return ultimo + 1
+
+    def load_utenti(self):
+        with self._lock:
+            df = pd.read_sql_query("SELECT * FROM utenti", self._conn)
+        if df.empty:
+            df = pd.DataFrame(columns=COLONNE_UTENTI)
+        return df
+
+    def save_utenti(self, df):
+        valori = df.reindex(columns=COLONNE_UTENTI).fillna({"Attivo": "1"}).astype(str).values.tolist()
+        with self._transazione() as conn:
+            conn.execute("DELETE FROM utenti")
+            conn.executemany("INSERT INTO utenti VALUES (?, ?, ?, ?)", valori)
+
+    def update_utenti(self, modifiche):
+        """Tutte le modifiche in una transazione, una UPDATE per utente sulle sole colonne indicate."""
+        _check_user_fields(modifiche)
+        with self._transazione() as conn:
+            for nome, campi in modifiche.items():
+                conn.execute(
+                    "INSERT OR IGNORE INTO utenti (NomeUtente, Password, Ruolo) VALUES (?, '', 'utente')", (nome,)
+                )
+                if campi:
+                    assegnazioni = ", ".join(f"{c} = ?" for c in campi)
+                    conn.execute(
+                        f"UPDATE utenti SET {assegnazioni} WHERE NomeUtente = ?",
+                        [str(v) for v in campi.values()] + [nome],
+                    )
+
+
+if __name__ == "__main__":
+    # Uso offline: python storage.py gestionale.db NomeUtente Password Ruolo
+    import sys
+
+    if len(sys.argv) != 5:
+        sys.exit("uso: python storage.py <file.db> <NomeUtente> <Password> <utente|capo>")
+    path, nome, password, ruolo = sys.argv[1:]
+    store = SQLiteStore(path)
+    store.update_utenti({nome: {"Password": password, "Ruolo": ruolo, "Attivo": "1"}})
+    print(f"Utente {nome} ({ruolo}) salvato in {path}")
@@ -0,0 +1,109 @@
+"""Tassonomia delle attività (MacroAttività → Tipologia → Attività) e tipi di malattia.
+
+Usata dall'app per menu e controlli e dal benchmark per generare dati realistici.
+"""
+macro_tipologia_attivita = {
+    "AGENDA": {
+        "Gestione agenda appuntamenti e telefono": [
+            "Informazioni analisi",
+            "Telefonate in entrata",
+            "Telefonate in uscita",
+            "Comunicazione con pazienti (mail o telefono)",
+            "Organizzazione appuntamenti con medici",
+            "Supporto amministrativo (se pertinente)",
+            "Prenotazioni"
+        ],
+        "Controllo e-mail e risposta": [
+            "Prenotazioni",
+            "Informazioni analisi",
+            "Richieste varie"
+        ]
+    },
+    "CONSULENZA GENETICA": {
+        "Ambulatorio": [
+            "Consulenza",
+            "Controllo Impegnative",
+            "Relazioni consulenza"
+        ],
+        "Teleconsulenza": [
+            "Consulenza Telefonica",
+            "Relazione Post-test"
+        ]
+    },
+    "ACCETTAZIONE": {
+        "Accettazione campioni e impegnative": [
+            "Accettazione campioni interni",
+            "Accettazione campioni esterni",
+            "Registrazione impegnative access",
+            "Conteggio impegnative (mensile)"
+        ]
+    },
+    "ORDINI E MAGAZZINO": {
+        "Gestione Ordini Reagenti e varie": [
+            "Richiesta preventivo",
+            "Ordine SAP",
+            "Verifica arrivi DDT",
+            "Controllo Giacenza"
+        ]
+    },
+    "LABORATORIO": {
+        "Lavoro al bancone": [
+            "Estrazione DNA",
+            "Preparazione reagenti",
+            "Analisi molecolare",
+            "Digestioni",
+            "Blot",
+            "Ibridazioni",
+            "Genotipizzazione OA"
+        ],
+        "Manutenzione strumenti": [
+            "Pulizia ABI e/o cambio capillari",
+            "Pulizia NextSeq",
+            "Pulizia MiSeq",
+            "Backup Dati"
+        ]
+    },
+    "INFORMATICA": {
+        "Backup Dati NGS": ["Scarico Dati NGS"],
+        "Programmazione": ["Programmazione"],
+        "Interpretazione dati grezzi": [
+            "Analisi dati NGS",
+            "Match OA",
+            "Interpretazione analisi Sanger",
+            "Interpretazione analisi MLPA",
+            "Interpretazione analisi Microsatelliti",
+            "Interpretazione analisi Metilazione",
+            "Lettura e interpretazione Lastre"
+        ]
+    },
+    "REFERTAZIONE": {
+        "Compilazione referti": [
+            "Calcolo coverage e OMIM",
+            "Stesura bozza referto",
+            "Trascrizione referti"
+        ],
+        "Rilettura e validazione referti": [
+            "NGS",
+            "Analisi di sequenza (Trombofilia, Segregazioni mut)",
+            "MLPA",
+            "Analisi di frammenti (FC, Trombofilia, ecc.)",
+            "FSHD"
+        ]
+    },
+    "ATTIVITA' DIDATTICA": {
+        "Lezioni": ["Lezioni"],
+        "Esami": ["Esami"],
+        "Correzione tesi": ["Correzione tesi"],
+        "Slide": ["Slide"]
+    },
+    "RICERCA": {
+        "Articolo scientifico": ["Scrittura", "Revisione", "Sottomissione"],
+        "Riunioni e attività amministrative": ["Riunioni e attività amministrative"],
+        "Studio e analisi": ["Studio articoli","Analisi dei dati"]
+    }
+}
+
+tipi_malattia = [
+    "FSHD", "Genetica oculare", "Cardio", "Neurodegenerative", "Autismo", "Oncogenetica",
+    "Covid", "Rene Policistico", "Routine", "Infettivologia", "Altro"
+]
@@ -1,8 +1,11 @@
+import json
 import pandas as pd
 from datetime import datetime
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 
+from storage import GoogleSheetsStore, SheetsConnection
+
 # =====================================
 # CONFIGURAZIONE
 # =====================================
@@ -34,9 +37,15 @@ print(f"Righe iniziali: {len(df_before)}")
 # =====================================
 print("\n👥 Inserimento simulato di due nuove attività...")
 
+# Due store indipendenti, come due processi: gli ID arrivano da blocchi riservati diversi
+with open(GOOGLE_CREDS_FILE) as f:
+    creds_dict = json.load(f)
+store_1 = GoogleSheetsStore(SheetsConnection(creds_dict), SHEET_NAME)
+store_2 = GoogleSheetsStore(SheetsConnection(creds_dict), SHEET_NAME)
+
 new_activities = [
     {
-        "ID": int(df_before["ID"].max() + 1) if not df_before.empty else 1,
+        "ID": store_1.next_id(),
         "NomeUtente": "GiuliaC",
         "Data": datetime.now().isoformat(sep=" "),
         "MacroAttivita": "LABORATORIO",
@@ -51,7 +60,7 @@ new_activities = [
         "TipoMalattiaRef": ""
     },
     {
-        "ID": int(df_before["ID"].max() + 2) if not df_before.empty else 2,
+        "ID": store_2.next_id(),
         "NomeUtente": "MarioTest",
         "Data": datetime.now().isoformat(sep=" "),
         "MacroAttivita": "REFERTAZIONE",
@@ -91,6 +100,13 @@ if len(df_after) < len(df_before) + 2:
 else:
     print("✅ Tutte le righe sono ancora presenti.")
 
+duplicati = df_after["ID"].duplicated().sum()
+if duplicati > 0:
+    ok_rows = False
+    print(f"❌ ERRORE: {duplicati} ID duplicati.")
+else:
+    print("✅ Nessun ID duplicato.")
+
 if missing_dates > 0:
     ok_rows = False
     print(f"⚠️ ATTENZIONE: {missing_dates} righe senza data.")
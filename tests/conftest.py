@@ -0,0 +1,100 @@
+"""Fixture comuni: tabelle attività su fogli in memoria (benchmark.MemoryWorksheet).
+
+activities, memory_sheet e memory_connection restituiscono le funzioni (o la classe) con cui
+i test costruiscono i propri dati.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gspread
+import pandas as pd
+import pytest
+
+from benchmark import MemoryWorksheet
+from storage import COLONNE_ATTIVITA, to_sheet_rows
+
+
+def make_activities(ids, **campi):
+    """Attività di prova con gli ID indicati, versione 1."""
+    df = pd.DataFrame({
+        "ID": list(ids),
+        "NomeUtente": "anna",
+        "Data": pd.Timestamp("2024-03-05 10:00"),
+        "MacroAttivita": "LABORATORIO",
+        "Tipologia": "Lavoro al bancone",
+        "Attivita": "Estrazione DNA",
+        "Note": [f"nota {i}" for i in ids],
+        "Ore": 1, "Minuti": 30, "NumCampioni": 0, "TipoMalattia": "", "NumReferti": 0, "TipoMalattiaRef": "",
+        "Versione": 1,
+    })
+    return df.assign(**campi)
+
+
+def make_memory_sheet(df, **kwargs):
+    """Foglio in memoria senza latenza con intestazione e righe di df."""
+    return MemoryWorksheet([COLONNE_ATTIVITA] + to_sheet_rows(df, COLONNE_ATTIVITA), latenza=0, **kwargs)
+
+
+@pytest.fixture
+def activities():
+    return make_activities
+
+
+@pytest.fixture
+def memory_sheet():
+    return make_memory_sheet
+
+
+@pytest.fixture
+def memory_connection():
+    return MemoryConnection
+
+
+@pytest.fixture
+def sheet():
+    return make_memory_sheet(make_activities(range(1, 6)))
+
+
+class MemoryConnection:
+    """SheetsConnection con un solo spreadsheet di fogli in memoria, per titolo."""
+
+    def __init__(self, *fogli):
+        self.fogli = {f.title: f for f in fogli}
+
+    def spreadsheet(self, sheet_name):
+        return self
+
+    def worksheet(self, sheet_name, worksheet=0):
+        if isinstance(worksheet, int):
+            return list(self.fogli.values())[worksheet]
+        if worksheet not in self.fogli:
+            raise gspread.WorksheetNotFound(worksheet)
+        return self.fogli[worksheet]
+
+    def add_worksheet(self, title, rows, cols):
+        self.fogli[title] = MemoryWorksheet(latenza=0, title=title)
+        return self.fogli[title]
+
+    def batch_update(self, body):
+        """Solo le richieste di add_filled_worksheet: addSheet e updateCells dal suo angolo in alto a sinistra."""
+        titoli = {}
+        for richiesta in body["requests"]:
+            if "addSheet" in richiesta:
+                proprieta = richiesta["addSheet"]["properties"]
+                titoli[proprieta["sheetId"]] = proprieta["title"]
+                self.fogli[proprieta["title"]] = MemoryWorksheet(latenza=0, title=proprieta["title"])
+            else:
+                celle = richiesta["updateCells"]
+                self.fogli[titoli[celle["start"]["sheetId"]]].righe = [
+                    [v["userEnteredValue"]["stringValue"] for v in riga["values"]] for riga in celle["rows"]
+                ]
+
+    def values_batch_get(self, intervalli, params=None):
+        risposte = []
+        for intervallo in intervalli:
+            nome, a1 = intervallo.rsplit("!", 1)
+            valori = self.fogli[nome.strip("'")].batch_get([a1], major_dimension=params.get("majorDimension"))[0]
+            risposte.append({"values": valori})
+        return {"valueRanges": risposte}
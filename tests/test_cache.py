@@ -0,0 +1,107 @@
+import time
+
+import pandas as pd
+
+from benchmark import MemoryWorksheet
+from cache import ActivityCache, UserDirectory
+from rollups import build_rollup
+from storage import GoogleSheetsStore, LocalSnapshot, append_sheet_rows
+
+
+def counted_store(store, monkeypatch):
+    """store con l'elenco degli argomenti delle sue chiamate a sync."""
+    sync = store.sync
+    store.letture = []
+    monkeypatch.setattr(store, "sync", lambda df=None, stato=None: store.letture.append(df) or sync(df, stato))
+    return store
+
+
+def test_sessions_share_one_snapshot(sheet, memory_connection, monkeypatch):
+    store = counted_store(GoogleSheetsStore(memory_connection(sheet), "Attivita"), monkeypatch)
+    cache = ActivityCache(ttl=3600)
+
+    primo = cache.get(store)
+    assert cache.get(store) is primo and cache.get(store) is primo
+    assert store.letture == [None]
+    assert list(primo.view()["ID"]) == [1, 2, 3, 4, 5]
+
+
+def test_snapshot_refreshed_after_ttl(sheet, activities, memory_connection, monkeypatch):
+    store = counted_store(GoogleSheetsStore(memory_connection(sheet), "Attivita"), monkeypatch)
+    cache = ActivityCache(ttl=0.05)
+    primo = cache.get(store)
+    primo.rollup
+    append_sheet_rows(sheet, primo.view(), activities([6], Ore=3))
+
+    scadenza = time.monotonic() + 5
+    while cache.get(store) is primo and time.monotonic() < scadenza:
+        time.sleep(0.01)
+    cache.ttl = 3600   # il thread di aggiornamento non si riattiva più durante gli altri test
+    nuovo = cache.get(store)
+    assert list(nuovo.view()["ID"]) == [1, 2, 3, 4, 5, 6]
+    # 🔹 Sincronizzazione incrementale: rollup aggiornato con la sola riga nuova
+    assert store.letture[1] is not None
+    pd.testing.assert_frame_equal(nuovo._rollup, build_rollup(nuovo.view()), check_like=True)
+
+
+def test_write_patches_snapshot_and_invalidate_reloads(sheet, activities, memory_connection, monkeypatch):
+    store = counted_store(GoogleSheetsStore(memory_connection(sheet), "Attivita"), monkeypatch)
+    cache = ActivityCache(ttl=3600)
+    primo = cache.get(store)
+
+    righe = store.append_data(primo.view(), activities([6]))
+    patchato = cache.patch(righe, eliminati=[2])
+    assert cache.get(store) is patchato and patchato.versione == primo.versione + 1
+    assert list(patchato.view()["ID"]) == [1, 3, 4, 5, 6]
+
+    cache.invalidate()
+    cache.refresh()
+    assert store.letture[-1] is None   # rilettura completa
+    assert list(cache.get(store).view()["ID"]) == [1, 2, 3, 4, 5, 6]
+
+
+def users_store(memory_connection, monkeypatch):
+    """GoogleSheetsStore con il foglio Utenti in memoria; store.letture conta le letture degli utenti."""
+    utenti = MemoryWorksheet(
+        [["NomeUtente", "Password", "Ruolo", "Attivo"], ["anna", "1234", "utente", "1"], ["bob", "b1", "capo", ""]],
+        latenza=0, title="Utenti",
+    )
+    store = GoogleSheetsStore(memory_connection(MemoryWorksheet(latenza=0, title="Attivita"), utenti), "Attivita")
+    load_utenti = store.load_utenti
+    store.letture = 0
+
+    def contata():
+        store.letture += 1
+        return load_utenti()
+    monkeypatch.setattr(store, "load_utenti", contata)
+    return store
+
+
+def test_user_lookup_reads_sheet_once_per_ttl(memory_connection, monkeypatch):
+    store = users_store(memory_connection, monkeypatch)
+    utenti = UserDirectory(store, ttl=3600)
+
+    assert utenti.lookup("anna") == {"Password": "1234", "Ruolo": "utente", "Attivo": "1"}
+    assert utenti.lookup("bob")["Ruolo"] == "capo" and utenti.lookup("carla") is None
+    assert store.letture == 1
+
+    # 🔹 Una modifica salvata dall'app è subito visibile, senza rileggere il foglio
+    utenti.update("anna", Password="nuova")
+    assert utenti.lookup("anna")["Password"] == "nuova" and store.letture == 1
+
+    utenti.invalidate()
+    assert utenti.lookup("anna")["Password"] == "1234" and store.letture == 2
+    utenti.ttl = 0
+    utenti.lookup("anna")
+    assert store.letture == 3
+
+
+def test_user_lookup_after_start_from_local_snapshot(tmp_path, memory_connection, monkeypatch):
+    store = users_store(memory_connection, monkeypatch)
+    locale = LocalSnapshot(str(tmp_path))
+    UserDirectory(store, locale=locale).frame()   # scrive lo snapshot, senza password
+    monkeypatch.setattr("cache.threading.Thread.start", lambda self: None)   # nessuna rilettura in background
+
+    utenti = UserDirectory(store, locale=locale)
+    assert list(utenti.frame()["NomeUtente"]) == ["anna", "bob"] and store.letture == 1
+    assert utenti.lookup("anna")["Password"] == "1234" and store.letture == 2
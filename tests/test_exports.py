@@ -0,0 +1,30 @@
+import io
+
+import pandas as pd
+
+from exports import ExportCache
+
+
+def test_export_generated_once_per_key_and_format(tmp_path, activities):
+    cache = ExportCache(max_file=2, cartella=str(tmp_path))
+    generazioni = []
+
+    def dati():
+        generazioni.append(1)
+        return activities(range(1, 4))
+
+    csv = cache.get(("v1", "tutti"), "CSV", dati)
+    assert cache.get(("v1", "tutti"), "CSV", dati) == csv
+    assert len(generazioni) == 1
+    assert list(pd.read_csv(io.BytesIO(csv))["ID"]) == [1, 2, 3]
+
+    # 🔹 Altro formato o altra versione dei dati: un file nuovo
+    parquet = cache.get(("v1", "tutti"), "Parquet", dati)
+    assert list(pd.read_parquet(io.BytesIO(parquet))["ID"]) == [1, 2, 3]
+    cache.get(("v2", "tutti"), "CSV", dati)
+    assert len(generazioni) == 3
+
+    # il più vecchio oltre max_file viene cancellato e poi rigenerato
+    assert len(list(tmp_path.iterdir())) == 2
+    cache.get(("v1", "tutti"), "CSV", dati)
+    assert len(generazioni) == 4
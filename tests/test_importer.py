@@ -0,0 +1,25 @@
+import io
+
+import pandas as pd
+import pytest
+
+from importer import parse_file_dates, prepare_chunk, read_chunks
+from taxonomy import macro_tipologia_attivita
+
+
+@pytest.mark.parametrize("data", ["2024-03-05 10:00", "2024-03-05T10:00", "05/03/2024 10:00"])
+def test_file_dates_are_not_year_day_month(data):
+    assert parse_file_dates([data])[0] == pd.Timestamp("2024-03-05 10:00")
+
+
+def test_prepare_chunk_reads_both_iso_spellings():
+    file = io.StringIO(
+        "NomeUtente;Data;MacroAttivita;Tipologia;Attivita;Ore;Minuti\n"
+        "anna;2024-03-05 10:00;LABORATORIO;Lavoro al bancone;Estrazione DNA;1;30\n"
+        "anna;2024-03-05T11:00;LABORATORIO;Lavoro al bancone;Estrazione DNA;1;30\n"
+    )
+    blocco = next(read_chunks(file, "attivita.csv"))
+    righe, errori, duplicate = prepare_chunk(blocco, macro_tipologia_attivita, [], [])
+
+    assert errori.empty and duplicate == 0
+    assert list(righe["Data"]) == [pd.Timestamp("2024-03-05 10:00"), pd.Timestamp("2024-03-05 11:00")]
@@ -0,0 +1,49 @@
+import pytest
+
+from metrics import METRICHE, Metrics
+from storage import SQLiteStore
+
+
+def test_prometheus_export_has_cumulative_buckets(tmp_path):
+    metriche = Metrics()
+    metriche.record("sheets.values.get", 0.02, byte=100)
+    metriche.record("sheets.values.get", 3.0, byte=50, errore=True)
+    metriche.record('foglio "Attivita"', 0.001)
+
+    testo = metriche.to_prometheus()
+    assert 'gestionale_operazione_secondi_bucket{operazione="sheets.values.get",le="0.01"} 0' in testo
+    assert 'gestionale_operazione_secondi_bucket{operazione="sheets.values.get",le="0.025"} 1' in testo
+    assert 'gestionale_operazione_secondi_bucket{operazione="sheets.values.get",le="+Inf"} 2' in testo
+    assert 'gestionale_operazione_secondi_count{operazione="sheets.values.get"} 2' in testo
+    assert 'gestionale_operazione_byte_total{operazione="sheets.values.get"} 150' in testo
+    assert 'gestionale_operazione_errori_total{operazione="sheets.values.get"} 1' in testo
+    assert 'operazione="foglio \\"Attivita\\""' in testo
+    # 🔹 Solo l'operazione oltre la soglia è fra quelle lente
+    assert [nome for _, nome, _, _ in metriche.lente] == ["sheets.values.get"]
+
+    metriche.write_prometheus(str(tmp_path / "gestionale.prom"))
+    assert (tmp_path / "gestionale.prom").read_text(encoding="utf-8") == testo
+
+
+def test_scope_counts_only_this_thread_calls():
+    metriche = Metrics()
+    metriche.record("prima", 0.1)
+    metriche.begin_scope()
+    metriche.record("sheets.values.get", 0.1)
+    metriche.record("sheets.values.get", 0.1)
+    with pytest.raises(ValueError), metriche.timer("store.sync"):
+        raise ValueError
+
+    assert metriche.end_scope("Attivita", 0.5) == {"sheets.values.get": 2, "store.sync": 1}
+    riepilogo = metriche.summary().set_index("Operazione")
+    assert riepilogo.loc["store.sync", "Errori"] == 1
+    assert riepilogo.loc["pagina.Attivita", "Chiamate"] == 1
+
+
+def test_store_operations_are_timed(tmp_path, activities):
+    METRICHE.reset()
+    store = SQLiteStore(str(tmp_path / "attivita.db"))
+    store.append_data(None, activities([1, 2]))
+    store.sync()
+
+    assert METRICHE.summary().set_index("Operazione").loc[["store.append_data", "store.sync"], "Chiamate"].tolist() == [1, 1]
@@ -0,0 +1,59 @@
+import pandas as pd
+import pytest
+
+from benchmark import MemoryWorksheet
+from storage import COLONNA_PARTIZIONE, COLONNE_ATTIVITA, PartitionedSheetsStore, SCHEMA_MEMORIA, load_data, to_sheet_rows
+
+
+@pytest.fixture
+def partitioned_store(memory_connection):
+    return lambda foglio: PartitionedSheetsStore(memory_connection(foglio), "Attivita", "anno")
+
+
+def test_legacy_archive_write_keeps_schema(activities, partitioned_store):
+    # 🔹 Archivio storico senza colonna Versione
+    colonne = [c for c in COLONNE_ATTIVITA if c != "Versione"]
+    storico = activities(range(1, 5), Data=pd.Timestamp("2023-05-02 09:00"))
+    store = partitioned_store(MemoryWorksheet([colonne] + to_sheet_rows(storico, colonne), latenza=0, title="Storico"))
+    base, _ = store.sync()
+
+    aggiornata = base.copy()
+    aggiornata.loc[aggiornata["ID"] == 2, "Note"] = "modificata"
+    risultato = store.write_delta(base, aggiornata)
+
+    assert risultato["Versione"].dtype == SCHEMA_MEMORIA["Versione"]
+    assert risultato.set_index("ID")["Versione"].to_dict() == {1: 0, 2: 1, 3: 0, 4: 0}
+    riletta, _ = PartitionedSheetsStore(store.connessione, "Attivita", "anno").sync()
+    assert riletta.set_index("ID")["Note"][2] == "modificata"
+
+
+def test_row_moves_between_partitions(activities, memory_sheet, partitioned_store):
+    store = partitioned_store(memory_sheet(activities(range(1, 4), Data=pd.Timestamp("2024-03-05 10:00")), title="Storico"))
+    base, _ = store.sync()
+
+    # 🔹 La riga 3 cambia anno: esce dall'archivio ed entra nella partizione del 2025
+    aggiornata = base.copy()
+    aggiornata.loc[aggiornata["ID"] == 3, "Data"] = pd.Timestamp("2025-01-03 10:00")
+    risultato = store.write_delta(base, aggiornata).set_index("ID")
+
+    assert risultato.loc[3, COLONNA_PARTIZIONE] == "Attivita_2025"
+    assert risultato.loc[3, "Versione"] == 1   # riga nuova nella partizione di arrivo
+    assert risultato["Versione"].dtype == SCHEMA_MEMORIA["Versione"]
+    assert list(load_data(store._ws("Storico"))["ID"]) == [1, 2]
+    assert list(load_data(store._ws("Attivita_2025"))["ID"]) == [3]
+
+    riletta, _ = PartitionedSheetsStore(store.connessione, "Attivita", "anno").sync()
+    pd.testing.assert_frame_equal(riletta.set_index("ID").sort_index(), risultato.sort_index(), check_dtype=False, check_categorical=False)
+
+
+def test_rollover_only_when_period_changes(monkeypatch, activities, memory_sheet, partitioned_store):
+    store = partitioned_store(memory_sheet(activities(range(1, 4)), title="Storico"))
+    df, stato = store.sync()
+    chiamate = []
+    monkeypatch.setattr(store, "rollover", lambda: chiamate.append(1) or store._partitions())
+
+    store.sync(df, stato)
+    assert chiamate == []
+    store._periodo = "Attivita_2020"   # come se il periodo fosse appena cambiato
+    store.sync(df, stato)
+    assert chiamate == [1]
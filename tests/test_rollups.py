@@ -0,0 +1,78 @@
+import pandas as pd
+import pytest
+
+from rollups import (
+    CHIAVI_KPI, CHIAVI_ROLLUP, MISURE_ROLLUP, build_rollup, changed_rows, rollup_by, totals, update_rollup,
+)
+from storage import upsert_rows
+
+
+def canonical(rollup, chiavi):
+    """Rollup confrontabile: chiavi come testo, righe ordinate, indice ignorato."""
+    rollup = rollup.astype({c: object for c in chiavi if c != "Giorno"}).astype({m: "int64" for m in MISURE_ROLLUP})
+    return rollup.sort_values(chiavi, key=lambda c: c.astype(str)).reset_index(drop=True)[chiavi + MISURE_ROLLUP]
+
+
+@pytest.fixture
+def table(activities):
+    df = activities(range(1, 9), NomeUtente=["anna", "bob"] * 4)
+    df["Data"] = pd.Timestamp("2024-03-05 10:00") + pd.to_timedelta([0, 0, 1, 1, 2, 2, 2, 3], unit="D")
+    df.loc[df["ID"] > 4, ["MacroAttivita", "Tipologia", "Attivita", "TipoMalattia"]] = [
+        "ACCETTAZIONE", "Accettazione campioni", "Campioni esterni", "FSHD",
+    ]
+    df["NumCampioni"] = range(8)
+    return df
+
+
+def test_update_matches_rebuild(table, activities):
+    df = table
+    rollup = build_rollup(df)
+    kpi = rollup_by(rollup, CHIAVI_KPI)
+
+    # 🔹 Una modifica che cambia gruppo, una che cambia solo le misure, una cancellazione, una riga nuova
+    vecchie = df[df["ID"].isin([1, 2, 8])]
+    nuove = df[df["ID"].isin([1, 2])].assign(Ore=[5, 1], NomeUtente=["anna", "carla"])
+    aggiunta = activities([9], NomeUtente="dario")
+    nuove = pd.concat([nuove, aggiunta], ignore_index=True)
+    attuale = pd.concat([df[~df["ID"].isin([1, 2, 8])], nuove], ignore_index=True)
+
+    aggiornato = update_rollup(rollup, vecchie, nuove)
+    pd.testing.assert_frame_equal(canonical(aggiornato, CHIAVI_ROLLUP), canonical(build_rollup(attuale), CHIAVI_ROLLUP))
+    aggiornato_kpi = update_rollup(kpi, vecchie, nuove, CHIAVI_KPI)
+    pd.testing.assert_frame_equal(
+        canonical(aggiornato_kpi, CHIAVI_KPI), canonical(build_rollup(attuale, CHIAVI_KPI), CHIAVI_KPI)
+    )
+    assert aggiornato.index.is_unique and aggiornato_kpi.index.is_unique
+    # il rollup di partenza (condiviso dagli snapshot) non cambia
+    pd.testing.assert_frame_equal(rollup, build_rollup(df))
+
+
+def test_changed_rows_after_sync(table, activities):
+    df = table
+    # 🔹 Come una sincronizzazione: la riga 3 modificata, la 6 eliminata, la 9 aggiunta in coda
+    righe = pd.concat([df[df["ID"] == 3].assign(Ore=7, Versione=2), activities([9])], ignore_index=True)
+    nuovo = upsert_rows(df, righe, [6])
+
+    rimosse, aggiunte = changed_rows(df, nuovo)
+    assert sorted(rimosse["ID"]) == [3, 6] and sorted(aggiunte["ID"]) == [3, 9]
+    pd.testing.assert_frame_equal(
+        canonical(update_rollup(build_rollup(df), rimosse, aggiunte), CHIAVI_ROLLUP),
+        canonical(build_rollup(nuovo), CHIAVI_ROLLUP),
+    )
+    assert [len(r) for r in changed_rows(df, df)] == [0, 0]
+
+
+def test_emptied_groups_are_removed(table):
+    df = table
+    rollup = update_rollup(build_rollup(df), df[df["ID"] == 8], df.iloc[:0])
+    assert rollup["Righe"].gt(0).all()
+    assert len(rollup) == len(build_rollup(df[df["ID"] != 8]))
+
+
+def test_kpi_totals_match_rows(table):
+    df = table
+    kpi = rollup_by(build_rollup(df), CHIAVI_KPI)
+    assert len(kpi) == df[["NomeUtente"]].assign(Giorno=df["Data"].dt.normalize()).drop_duplicates().shape[0]
+    ore, campioni, referti = totals(kpi)
+    assert ore == (df["Ore"].sum() + df["Minuti"].sum() / 60)
+    assert (campioni, referti) == (df["NumCampioni"].sum(), 0)
@@ -0,0 +1,22 @@
+from search import build_search_index, search_mask
+from storage import apply_schema
+
+
+def test_search_ignores_case_and_accents(activities):
+    df = apply_schema(activities(range(1, 5), Note=["Più campioni", "CAFFÈ", None, "estrazione rapida"]))
+    indice = build_search_index(df)
+
+    assert list(df.loc[search_mask(indice, "piu"), "ID"]) == [1]
+    assert list(df.loc[search_mask(indice, "Caffe"), "ID"]) == [2]
+    # 🔹 Tutti i termini, anche da colonne diverse (Attivita "Estrazione DNA")
+    assert list(df.loc[search_mask(indice, "dna rapida"), "ID"]) == [4]
+
+
+def test_search_limited_to_filtered_rows(activities):
+    df = activities(range(1, 5), Note="uguale")
+    indice = build_search_index(df)
+    filtrate = df[df["ID"] > 2]
+
+    assert list(filtrate[search_mask(indice, "UGUALE", filtrate.index)]["ID"]) == [3, 4]
+    assert search_mask(indice, "assente").sum() == 0
+    assert build_search_index(df.iloc[:0]).empty
@@ -0,0 +1,298 @@
+import gspread
+import pandas as pd
+import pytest
+import requests
+
+from benchmark import MemoryWorksheet
+from storage import (
+    COLONNE_CONTATORI, ActivityStore, GoogleSheetsStore, IdAllocator, LocalSnapshot, SheetsQuota, SQLiteStore, TokenBucket,
+    append_sheet_rows, compact_deleted, lease_ids, load_data, sync_data, update_user_rows, write_delta,
+)
+
+
+class ForeignWriteSheet(MemoryWorksheet):
+    """Foglio che esegue una scrittura di un'altra sessione subito dopo la prossima batch_get,
+    cioè fra la lettura della mappa ID → riga e la scrittura."""
+
+    altra_sessione = None
+
+    def batch_get(self, *args, **kwargs):
+        risultato = super().batch_get(*args, **kwargs)
+        scrittura, self.altra_sessione = self.altra_sessione, None
+        if scrittura is not None:
+            scrittura()
+        return risultato
+
+
+def notes(sheet):
+    return load_data(sheet).set_index("ID")["Note"].to_dict()
+
+
+def response(codice=200, contenuto=b"{}"):
+    risposta = requests.Response()
+    risposta.status_code, risposta._content = codice, contenuto
+    return risposta
+
+
+def api_error(codice):
+    return gspread.exceptions.APIError(response(codice, b'{"error": {"code": %d, "message": "errore"}}' % codice))
+
+
+def replies(*esiti):
+    """Funzione per SheetsQuota.call che restituisce (o solleva) gli esiti in ordine e conta le chiamate."""
+    esiti = list(esiti)
+
+    def esegui():
+        esegui.chiamate += 1
+        esito = esiti.pop(0)
+        if isinstance(esito, Exception):
+            raise esito
+        return esito
+    esegui.chiamate = 0
+    return esegui
+
+
+def test_concurrent_delete_does_not_shift_rows(activities, memory_sheet):
+    sheet = ForeignWriteSheet([r for r in memory_sheet(activities(range(1, 6))).righe], latenza=0)
+    base = load_data(sheet)
+
+    # 🔹 L'altra sessione elimina la riga 2 mentre questa modifica la 4 ed elimina la 5
+    sheet.altra_sessione = lambda: write_delta(sheet, base, base[base["ID"] != 2])
+    aggiornata = base[base["ID"] != 5].copy()
+    aggiornata.loc[aggiornata["ID"] == 4, "Note"] = "modificata"
+    risultato = write_delta(sheet, base, aggiornata)
+
+    assert notes(sheet) == {1: "nota 1", 3: "nota 3", 4: "modificata"}
+    assert sorted(risultato["ID"]) == [1, 2, 3, 4]   # la 2 resta finché non si rilegge
+    # le righe eliminate restano al loro posto, con la versione negativa
+    assert [r[0] for r in sheet.righe[1:]] == ["1", "2", "3", "4", "5"]
+    assert [r[-1] for r in sheet.righe[1:]] == ["1", "-2", "1", "2", "-2"]
+
+
+def test_edit_of_row_deleted_by_another_session(sheet):
+    base = load_data(sheet)
+    write_delta(sheet, base, base[base["ID"] != 3])
+
+    aggiornata = base.copy()
+    aggiornata.loc[aggiornata["ID"] == 3, "Note"] = "modificata"
+    risultato = write_delta(sheet, base, aggiornata)
+
+    assert 3 not in set(risultato["ID"])
+    assert 3 not in notes(sheet)
+
+
+def test_delete_yields_to_concurrent_edit(sheet):
+    base = load_data(sheet)
+    modificata = base.copy()
+    modificata.loc[modificata["ID"] == 2, "Note"] = "modificata"
+
+    # 🔹 L'altra sessione modifica la riga 2 dopo la lettura di questa, che poi la elimina
+    write_delta(sheet, base, modificata)
+    risultato = write_delta(sheet, base, base[base["ID"] != 2])
+
+    assert notes(sheet) == {1: "nota 1", 2: "modificata", 3: "nota 3", 4: "nota 4", 5: "nota 5"}
+    assert risultato.set_index("ID")["Note"][2] == "modificata"
+
+
+def test_sqlite_delete_yields_to_concurrent_edit(tmp_path, activities):
+    db = str(tmp_path / "attivita.db")
+    questa, altra = SQLiteStore(db), SQLiteStore(db)
+    questa.append_data(None, activities(range(1, 4)))
+    base = questa.load_data()
+
+    modificata = base.copy()
+    modificata.loc[modificata["ID"] == 2, "Note"] = "modificata"
+    altra.write_delta(base, modificata)
+    risultato = questa.write_delta(base, base[~base["ID"].isin([2, 3])])
+
+    assert questa.load_data().set_index("ID")["Note"].to_dict() == {1: "nota 1", 2: "modificata"}
+    assert risultato.set_index("ID")["Note"].to_dict() == {1: "nota 1", 2: "modificata"}
+
+
+def test_sqlite_sync_reads_only_later_writes(tmp_path, monkeypatch, activities):
+    db = str(tmp_path / "attivita.db")
+    questa, altra = SQLiteStore(db), SQLiteStore(db)
+    questa.append_data(None, activities([1, 2, 51]))
+    df, stato = questa.sync()
+
+    # 🔹 Un ID più basso dopo uno più alto, poi un'eliminazione e una modifica che lasciano
+    # invariati numero di righe e somma delle versioni
+    altra.append_data(None, activities([3]))
+    base = altra.load_data()
+    modificata = base[base["ID"] != 1].copy()
+    modificata.loc[modificata["ID"] == 2, "Note"] = "modificata"
+    altra.write_delta(base, modificata)
+
+    letture = []
+    lettura = questa._read
+    monkeypatch.setattr(questa, "_read", lambda where="", params=(): letture.append(where) or lettura(where, params))
+    df, stato = questa.sync(df, stato)
+
+    assert letture == ["WHERE Sequenza > ?"]
+    assert df.set_index("ID")["Note"].to_dict() == {2: "modificata", 51: "nota 51", 3: "nota 3"}
+    assert questa.sync(df, stato)[0] is df
+
+
+def test_compact_deleted(sheet, activities, memory_sheet):
+    base = load_data(sheet)
+    write_delta(sheet, base, base[~base["ID"].isin([2, 4])])
+
+    assert compact_deleted(sheet, dry_run=True) == 2
+    assert compact_deleted(sheet) == 2
+    assert [r[0] for r in sheet.righe[1:]] == ["1", "3", "5"]
+    pd.testing.assert_frame_equal(load_data(sheet), load_data(memory_sheet(activities([1, 3, 5]))))
+
+
+def test_sync_after_appends_from_two_allocators(sheet, monkeypatch, activities):
+    contatori = MemoryWorksheet([COLONNE_CONTATORI, ["ID", "5", ""]], latenza=0)
+    sessione_a, sessione_b = (IdAllocator(lambda n: lease_ids(contatori, n)) for _ in range(2))
+    sessione_a.next_id()   # A riserva per prima: il blocco di B ha ID maggiori
+    append_sheet_rows(sheet, load_data(sheet), activities([sessione_b.next_id()]))
+    df, stato = sync_data(sheet)
+
+    # 🔹 Dopo la 26 di B arriva la 7 di A: gli ID in coda non sono crescenti
+    for sessione in (sessione_a, sessione_b):
+        append_sheet_rows(sheet, df, activities([sessione.next_id()]))
+
+    monkeypatch.setattr(sheet, "get_all_records", lambda **kwargs: pytest.fail("rilettura completa"))
+    df, stato = sync_data(sheet, df, stato)
+    assert list(df["ID"]) == [1, 2, 3, 4, 5, 26, 7, 27]
+    assert stato == 8
+
+
+def test_counters_sheet_is_created_with_its_base(sheet, memory_connection):
+    connessione = memory_connection(sheet)
+    prima, seconda = GoogleSheetsStore(connessione, "Attivita"), GoogleSheetsStore(connessione, "Attivita")
+
+    assert prima.reserve_ids(20) == 6   # dopo l'ID massimo già presente
+    assert seconda.reserve_ids(20) == 26
+    assert [r[:2] for r in connessione.fogli["Contatori"].righe] == [
+        COLONNE_CONTATORI[:2], ["base", "5"], ["ID", "20"], ["ID", "20"],
+    ]
+
+
+def test_sync_after_compaction_reloads(sheet, activities):
+    base, stato = sync_data(sheet)
+    write_delta(sheet, base, base[base["ID"] != 2])
+    compact_deleted(sheet)
+    append_sheet_rows(sheet, base, activities([6]))
+
+    df, stato = sync_data(sheet, base, stato)
+    assert list(df["ID"]) == [1, 3, 4, 5, 6]
+    assert stato == 5
+
+
+def test_user_update_touches_only_given_cells():
+    utenti = MemoryWorksheet([["NomeUtente", "Password", "Ruolo"], ["anna", "a1", "utente"], ["bob", "b1", "capo"]], latenza=0)
+    update_user_rows(utenti, {"bob": {"Password": "b2", "Attivo": "0"}})
+
+    assert utenti.righe == [
+        ["NomeUtente", "Password", "Ruolo", "Attivo"], ["anna", "a1", "utente"], ["bob", "b2", "capo", "0"],
+    ]
+
+
+def test_users_added_concurrently_are_both_kept():
+    utenti = ForeignWriteSheet([["NomeUtente", "Password", "Ruolo", "Attivo"], ["anna", "a1", "utente", "1"]], latenza=0)
+    # 🔹 Un altro admin aggiunge carla fra la lettura dei nomi e la scrittura di dario
+    utenti.altra_sessione = lambda: update_user_rows(utenti, {"carla": {"Password": "c1"}})
+    update_user_rows(utenti, {"dario": {"Password": "d1", "Ruolo": "capo"}})
+
+    assert utenti.righe[1:] == [
+        ["anna", "a1", "utente", "1"], ["carla", "c1", "utente", "1"], ["dario", "d1", "capo", "1"],
+    ]
+
+
+def test_local_snapshot_keeps_no_passwords(tmp_path):
+    locale = LocalSnapshot(str(tmp_path / "snapshot"))
+    locale.save_users(pd.DataFrame({"NomeUtente": ["anna"], "Password": ["segreta"], "Ruolo": ["utente"]}))
+
+    assert list(locale.load_users().columns) == ["NomeUtente", "Ruolo"]
+    assert b"segreta" not in (tmp_path / "snapshot" / "utenti.arrow").read_bytes()
+    assert (tmp_path / "snapshot" / "utenti.arrow").stat().st_mode & 0o077 == 0
+
+
+def test_incomplete_store_fails_at_creation(activities):
+    class SoloLettura(ActivityStore):
+        def load_data(self):
+            return activities([1])
+
+    with pytest.raises(TypeError, match="abstract"):
+        SoloLettura()
+
+
+def test_tail_sync_reads_only_rows_added_since_last_load(sheet, activities, monkeypatch):
+    base, stato = sync_data(sheet)
+    # 🔹 ID non crescenti, come da due blocchi di IdAllocator
+    append_sheet_rows(sheet, base, activities([27, 8]))
+    letture = []
+    monkeypatch.setattr(sheet, "get_all_records", lambda **kwargs: pytest.fail("lettura completa"))
+    monkeypatch.setattr(sheet, "get", lambda a1, **kwargs: letture.append(a1) or MemoryWorksheet.get(sheet, a1))
+
+    df, stato = sync_data(sheet, base, stato)
+    assert letture == ["A7:N8"]
+    assert list(df["ID"]) == [1, 2, 3, 4, 5, 27, 8]
+    assert stato == 7
+    assert sync_data(sheet, df, stato)[0] is df
+
+
+def test_token_bucket_waits_once_the_window_is_used(monkeypatch):
+    attese = []
+    monkeypatch.setattr("storage.time.sleep", attese.append)
+    bucket = TokenBucket(2, finestra=10)
+
+    assert bucket.acquire() == 0 and bucket.acquire() == 0
+    # 🔹 Un gettone ogni 5 secondi: la terza e la quarta richiesta aspettano il proprio turno
+    assert bucket.acquire() == pytest.approx(5, abs=0.1)
+    assert bucket.acquire() == pytest.approx(10, abs=0.1)
+    assert attese == pytest.approx([5, 10], abs=0.1)
+
+
+def test_quota_retries_reads_but_writes_only_on_429(monkeypatch):
+    attese = []
+    monkeypatch.setattr("storage.time.sleep", attese.append)
+    quota = SheetsQuota(tentativi=3)
+
+    lettura = replies(api_error(429), requests.Timeout(), api_error(503), response())
+    assert quota.call("get", "valori", lettura).status_code == 200
+    assert lettura.chiamate == 4 and quota.statistiche["riprovate"] == 3
+    # backoff esponenziale con jitter: 1, 2, 4 secondi ± 50%
+    assert [0.5 <= a / 2 ** i <= 1.5 for i, a in enumerate(attese)] == [True] * 3
+
+    # 🔹 Una scrittura non si ripete dopo un errore del server: potrebbe essere già stata applicata
+    with pytest.raises(gspread.exceptions.APIError):
+        quota.call("post", "append", replies(api_error(503), response()))
+    scrittura = replies(api_error(429), response())
+    quota.call("post", "append", scrittura)
+    assert scrittura.chiamate == 2
+
+    with pytest.raises(gspread.exceptions.APIError):
+        quota.call("get", "valori", replies(*[api_error(429)] * 4, response()))
+
+
+def test_quota_shares_identical_reads_until_a_write():
+    quota = SheetsQuota(coalescenza=60)
+    lettura = replies(response(contenuto=b"1"), response(contenuto=b"2"))
+
+    assert quota.call("get", "valori", lettura).content == b"1"
+    assert quota.call("get", "valori", lettura).content == b"1"
+    assert lettura.chiamate == 1
+    quota.call("post", "append", replies(response()))
+    assert quota.call("get", "valori", lettura).content == b"2"
+    assert quota.statistiche["condivise"] == 1
+
+
+def test_bulk_rows_saved_with_one_append(sheet, activities, memory_connection, monkeypatch):
+    store = GoogleSheetsStore(memory_connection(sheet), "Attivita")
+    store.next_id()   # un blocco già in uso: le righe della griglia ne prendono il resto e uno nuovo
+    base, stato = store.sync()
+    scritture = []
+    append_rows = sheet.append_rows
+    monkeypatch.setattr(sheet, "append_rows", lambda righe, **kwargs: scritture.append(righe) or append_rows(righe, **kwargs))
+
+    griglia = activities(store.next_ids(25), Versione=0)
+    righe = store.append_data(base, griglia)
+
+    assert len(scritture) == 1 and len(scritture[0]) == 25
+    assert list(righe["ID"]) == list(range(7, 32)) and (righe["Versione"] == 1).all()
+    df, _ = store.sync(base, stato)
+    assert list(df["ID"]) == list(range(1, 6)) + list(range(7, 32))
@@ -0,0 +1,41 @@
+"""Controlli sulle attività prima della scrittura (inserimento multiplo e importazione).
+
+I controlli sono vettoriali: ogni regola è una maschera sull'intero DataFrame.
+"""
+import pandas as pd
+
+from storage import parse_dates
+
+COLONNE_TASSONOMIA = ["MacroAttivita", "Tipologia", "Attivita"]
+
+
+def taxonomy_triples(tassonomia):
+    """Terne (MacroAttivita, Tipologia, Attivita) ammesse dal dizionario macro → tipologia → attività."""
+    return pd.MultiIndex.from_tuples(
+        [(m, t, a) for m, tipologie in tassonomia.items() for t, attivita in tipologie.items() for a in attivita],
+        names=COLONNE_TASSONOMIA,
+    )
+
+
+def check_activities(df, tassonomia):
+    """Errori delle righe non valide (stesso indice di df, messaggi separati da "; ").
+
+    Controlla che la terna Macro/Tipologia/Attività esista nel dizionario, che la data sia
+    leggibile e che ore, minuti e contatori siano numeri nei limiti.
+    """
+    numeri = lambda col: pd.to_numeric(df[col], errors="coerce") if col in df.columns else pd.Series(0, index=df.index)
+    terne = pd.MultiIndex.from_frame(df.reindex(columns=COLONNE_TASSONOMIA).astype(object).fillna(""))
+    controlli = [
+        (~terne.isin(taxonomy_triples(tassonomia)), "MacroAttività, Tipologia e Attività non corrispondono"),
+        (parse_dates(df["Data"]).isna() if "Data" in df.columns else pd.Series(True, index=df.index),
+         "data mancante o non valida"),
+        (~numeri("Ore").fillna(0).between(0, 24), "ore fuori dai limiti (0-24)"),
+        (~numeri("Minuti").fillna(0).between(0, 59), "minuti fuori dai limiti (0-59)"),
+        (numeri("NumCampioni").fillna(0).lt(0) | numeri("NumReferti").fillna(0).lt(0), "contatori negativi"),
+    ]
+    errori = pd.Series("", index=df.index, dtype=object)
+    for mask, messaggio in controlli:
+        mask = pd.Series(mask, index=df.index)
+        errori[mask] = errori[mask] + "; " + messaggio
+    errori = errori[errori.ne("")]
+    return errori.str[2:]